@@ -11,10 +11,32 @@ def create_app():
     from .api.recommendation import recommendation_bp
     from .api.assistant import assistant_bp
     from .api.knowledge import knowledge_bp
+    from .api.similar import similar_bp
+    from .api.ingest import ingest_bp
     app.register_blueprint(dashboard_bp, url_prefix='/api')
     app.register_blueprint(future_bp, url_prefix='/api')
     app.register_blueprint(recommendation_bp, url_prefix='/api')
     app.register_blueprint(assistant_bp, url_prefix='/api')
     app.register_blueprint(knowledge_bp, url_prefix='/api')
+    app.register_blueprint(similar_bp, url_prefix='/api')
+    app.register_blueprint(ingest_bp, url_prefix='/api')
+
+    # Prometheus 抓取端点不在 /api 前缀下
+    from .api.metrics import metrics_bp
+    app.register_blueprint(metrics_bp)
+
+    # 每个响应附带 Server-Timing 分阶段耗时
+    from .services.timing_service import init_app as init_timing
+    init_timing(app)
+
+    # 请求延迟、在途请求数等运行指标
+    from .services.metrics_service import init_app as init_metrics
+    init_metrics(app)
+
+    # 后台轮询用户数据文件，内容变化时增量热加载（PENSION_DATA_RELOAD_INTERVAL=0 关闭）；
+    # 监视线程在处理请求的进程收到第一个请求时启动，预分叉的 worker 各自启动。
+    # SQLite 模式下改为在请求前同步其他进程写入库中的用户
+    from .services.reload_service import init_app as init_reload
+    init_reload(app)
 
     return app
\ No newline at end of file
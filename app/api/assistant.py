@@ -1,8 +1,9 @@
 # backend/app/api/assistant.py
 from flask import Blueprint, request, jsonify
-from app.services.nlp_service import process_user_message, extract_health_info
+from app.services.nlp_service import process_user_message, get_analysis_cache_stats
 from app.services.analysis_service import get_user_profile
 from app.services.data_service import get_latest_metrics, update_user_metrics
+from app.services.history_service import get_chat_history as load_chat_history
 import speech_recognition as sr
 import io
 import base64
@@ -27,10 +28,10 @@ def chat():
         user_profile = get_user_profile(metrics)
 
         # 处理消息
-        result = process_user_message(message, user_profile)
+        result = process_user_message(message, user_profile, user_id=user_id)
 
         # 从对话中提取健康信息并更新画像
-        health_info = extract_health_info(message)
+        health_info = result['health_info']
         if health_info:
             update_user_metrics(user_id, health_info)
             # 重新计算画像
@@ -83,10 +84,10 @@ def voice_chat():
         user_profile = get_user_profile(metrics)
 
         # 处理消息
-        result = process_user_message(message, user_profile)
+        result = process_user_message(message, user_profile, user_id=user_id)
 
         # 从对话中提取健康信息并更新画像
-        health_info = extract_health_info(message)
+        health_info = result['health_info']
         if health_info:
             update_user_metrics(user_id, health_info)
             # 重新计算画像
@@ -102,29 +103,20 @@ def voice_chat():
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
+@assistant_bp.route('/assistant/analysis-cache', methods=['GET'])
+def get_analysis_cache():
+    try:
+        return jsonify(get_analysis_cache_stats())
+    except Exception as e:
+        print(f"Error in get_analysis_cache: {e}")
+        return jsonify({"error": str(e)}), 500
+
 @assistant_bp.route('/assistant/history/<int:user_id>', methods=['GET'])
 def get_chat_history(user_id):
     try:
-        # 模拟聊天历史，实际应用中应从数据库获取
-        history = [
-            {
-                'id': 1,
-                'message': '我最近感觉记忆力下降了',
-                'response': '我理解您的担忧。记忆力问题可能是多种因素造成的。建议您记录一下具体的情况，比如什么时候出现的问题，有没有伴随其他症状。同时，保持规律的作息和适量的运动对大脑健康很有帮助。',
-                'timestamp': '2024-01-01T10:00:00Z',
-                'intent': 'symptom_report',
-                'sentiment': 'negative'
-            },
-            {
-                'id': 2,
-                'message': '谢谢你的建议，我会试试的',
-                'response': '不客气！记住，健康管理是一个持续的过程。如果您有任何新的情况或需要更多建议，都可以随时告诉我。我会一直在这里支持您。',
-                'timestamp': '2024-01-01T10:05:00Z',
-                'intent': 'general_chat',
-                'sentiment': 'positive'
-            }
-        ]
-        return jsonify({"history": history})
+        cursor = request.args.get('cursor', type=int)
+        limit = request.args.get('limit', 20, type=int)
+        return jsonify(load_chat_history(user_id, cursor, limit))
     except Exception as e:
         print(f"Error in get_chat_history: {e}")
-        return jsonify({"error": str(e)}), 500
\ No newline at end of file
+        return jsonify({"error": str(e)}), 500
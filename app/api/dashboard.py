@@ -1,6 +1,9 @@
 # backend/app/api/dashboard.py
-from flask import Blueprint, jsonify
+from flask import Blueprint, jsonify, request
 from app.services.analysis_service import get_dashboard_analysis
+from app.services.backtest_service import backtest_user_allocation
+from app.services.data_service import get_latest_metrics
+from app.services.peer_service import get_peer_percentiles
 
 dashboard_bp = Blueprint('dashboard', __name__)
 
@@ -15,4 +18,33 @@ def get_dashboard_data(user_id):
         print(f"Error in get_dashboard_data: {e}")
         import traceback
         traceback.print_exc()
-        return jsonify({"error": str(e)}), 500
\ No newline at end of file
+        return jsonify({"error": str(e)}), 500
+
+@dashboard_bp.route('/dashboard/<int:user_id>/backtest', methods=['GET'])
+def get_allocation_backtest(user_id):
+    try:
+        metrics = get_latest_metrics(user_id)
+        if not metrics:
+            return jsonify({"error": "User not found"}), 404
+        rules = request.args.get('rebalance')
+        if rules:
+            data = backtest_user_allocation(metrics, rules.split(','))
+        else:
+            data = backtest_user_allocation(metrics)
+        return jsonify(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"Error in get_allocation_backtest: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@dashboard_bp.route('/dashboard/<int:user_id>/percentiles', methods=['GET'])
+def get_user_percentiles(user_id):
+    try:
+        data = get_peer_percentiles(user_id)
+        if data is None:
+            return jsonify({"error": "User not found"}), 404
+        return jsonify(data)
+    except Exception as e:
+        print(f"Error in get_user_percentiles: {e}")
+        return jsonify({"error": str(e)}), 500
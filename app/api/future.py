@@ -1,5 +1,7 @@
 from flask import Blueprint, jsonify, request
-from app.services.future_service import get_future_insights, simulate_future
+from app.services.future_service import get_future_insights, simulate_future, sweep_future
+from app.services.monte_carlo_service import simulate_retirement_outcomes
+from app.services.data_service import get_latest_metrics
 
 future_bp = Blueprint('future', __name__)
 
@@ -23,5 +25,42 @@ def api_simulate_future(user_id):
         if data is None:
             return jsonify({"error": "User not found"}), 404
         return jsonify(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@future_bp.route('/future-insights/<int:user_id>/sweep', methods=['POST'])
+def api_sweep_future(user_id):
+    try:
+        payload = request.get_json(silent=True) or {}
+        data = sweep_future(
+            user_id,
+            payload.get('ranges') or {},
+            months=int(payload.get('months', 12)),
+            encoding=payload.get('encoding', 'base64'),
+        )
+        if data is None:
+            return jsonify({"error": "User not found"}), 404
+        return jsonify(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@future_bp.route('/future-insights/<int:user_id>/monte-carlo', methods=['GET'])
+def api_monte_carlo(user_id):
+    try:
+        metrics = get_latest_metrics(user_id)
+        if not metrics:
+            return jsonify({"error": "User not found"}), 404
+        data = simulate_retirement_outcomes(
+            metrics,
+            n_paths=request.args.get('paths', 20000, type=int),
+            seed=request.args.get('seed', 42, type=int),
+        )
+        return jsonify(data)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
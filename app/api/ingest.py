@@ -0,0 +1,74 @@
+# backend/app/api/ingest.py
+import hmac
+import io
+import json
+import os
+
+from flask import Blueprint, jsonify, request
+from app.services.ingestion_service import DEFAULT_CHUNK_ROWS, detect_format, ingest_stream
+
+ingest_bp = Blueprint('ingest', __name__)
+
+# 上游系统推送数据使用的令牌；未设置时批量写入接口关闭
+TOKEN_ENV = 'PENSION_INGEST_TOKEN'
+MAX_CHUNK_ROWS = 100_000
+NDJSON_MIMETYPES = {'application/x-ndjson', 'application/ndjson', 'application/jsonl', 'application/x-jsonlines'}
+
+
+def _authorized() -> bool:
+    expected = os.environ.get(TOKEN_ENV, '')
+    header = request.headers.get('Authorization', '')
+    token = header[7:] if header.startswith('Bearer ') else ''
+    # 定长比较，不因前缀匹配长度泄露令牌信息
+    return bool(expected) and hmac.compare_digest(token.encode(), expected.encode())
+
+
+def _request_format(filename: str = None) -> str:
+    fmt = request.args.get('format')
+    if fmt:
+        return fmt.lower()
+    mimetype = request.mimetype or ''
+    if mimetype == 'application/json':
+        return 'json'
+    if mimetype in NDJSON_MIMETYPES:
+        return 'ndjson'
+    if filename:
+        return detect_format(filename)
+    return 'csv'
+
+
+def _json_array_stream():
+    """application/json 请求体须为对象数组，逐项转为 NDJSON 行（非对象的元素按行报告错误）。"""
+    data = request.get_json(force=True, silent=True)
+    if not isinstance(data, list):
+        return None
+    return io.BytesIO(b'\n'.join(json.dumps(item, ensure_ascii=False).encode('utf-8') for item in data))
+
+
+@ingest_bp.route('/users/bulk', methods=['POST'])
+def bulk_upsert_users():
+    if not os.environ.get(TOKEN_ENV):
+        return jsonify({"error": "Bulk ingestion is disabled"}), 403
+    if not _authorized():
+        return jsonify({"error": "Unauthorized"}), 401
+    try:
+        chunk_rows = request.args.get('chunk_rows', DEFAULT_CHUNK_ROWS, type=int)
+        if not 0 < chunk_rows <= MAX_CHUNK_ROWS:
+            return jsonify({"error": f"chunk_rows must be between 1 and {MAX_CHUNK_ROWS}"}), 400
+        upload = request.files.get('file') if request.mimetype == 'multipart/form-data' else None
+        stream = upload.stream if upload else request.stream
+        fmt = _request_format(upload.filename if upload else None)
+        if fmt == 'json' and not upload:
+            stream = _json_array_stream()
+            if stream is None:
+                return jsonify({"error": "JSON body must be an array of user objects"}), 400
+            fmt = 'ndjson'
+        if fmt not in ('csv', 'ndjson'):
+            return jsonify({"error": f"Unsupported format: {fmt}"}), 415
+        # 请求体按行流式读取，逐块校验并写入；不合格的行在报告中列出，不影响其余行
+        report = ingest_stream(stream, fmt, chunk_rows)
+        report['errorsTruncated'] = report['rejected'] > len({e['line'] for e in report['errors']})
+        return jsonify(report)
+    except Exception as e:
+        print(f"Error in bulk_upsert_users: {e}")
+        return jsonify({"error": str(e)}), 500
@@ -0,0 +1,13 @@
+# backend/app/api/metrics.py
+from flask import Blueprint, Response
+from app.services.metrics_service import render_metrics
+
+metrics_bp = Blueprint('metrics', __name__)
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    try:
+        return Response(render_metrics(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+    except Exception as e:
+        print(f"Error in get_metrics: {e}")
+        return Response(f"# error: {e}\n", status=500, mimetype='text/plain')
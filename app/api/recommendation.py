@@ -1,10 +1,13 @@
 # backend/app/api/recommendation.py
-from flask import Blueprint, jsonify
+from flask import Blueprint, jsonify, request
 from app.services.recommendation_service import (
     generate_personalized_recommendations,
     get_recommendation_progress,
-    update_recommendation_progress
+    update_recommendation_progress,
+    update_recommendation_progress_batch,
+    count_plan_tasks
 )
+from app.services.progress_service import validate_updates
 from app.services.analysis_service import get_user_profile
 from app.services.data_service import get_latest_metrics
 
@@ -30,7 +33,12 @@ def get_recommendations(user_id):
 @recommendation_bp.route('/recommendation/progress/<int:user_id>', methods=['GET'])
 def get_progress(user_id):
     try:
-        progress = get_recommendation_progress(user_id)
+        total_tasks = None
+        metrics = get_latest_metrics(user_id)
+        if metrics:
+            plan = generate_personalized_recommendations(get_user_profile(metrics), metrics)
+            total_tasks = count_plan_tasks(plan)
+        progress = get_recommendation_progress(user_id, total_tasks)
         return jsonify(progress)
     except Exception as e:
         print(f"Error in get_progress: {e}")
@@ -39,9 +47,33 @@ def get_progress(user_id):
 @recommendation_bp.route('/recommendation/progress/<int:user_id>/<task_id>', methods=['PUT'])
 def update_progress(user_id, task_id):
     try:
-        # 简化处理，实际应从请求体获取completed状态
-        success = update_recommendation_progress(user_id, task_id, True)
+        data = request.get_json(silent=True) or {}
+        completed = data.get('completed', True)
+        if not isinstance(completed, bool):
+            return jsonify({"error": "'completed' must be a boolean"}), 400
+        success = update_recommendation_progress(user_id, task_id, completed, data.get('date'))
         return jsonify({"success": success})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         print(f"Error in update_progress: {e}")
-        return jsonify({"error": str(e)}), 500
\ No newline at end of file
+        return jsonify({"error": str(e)}), 500
+
+@recommendation_bp.route('/recommendation/progress/<int:user_id>/batch', methods=['POST'])
+def update_progress_batch(user_id):
+    try:
+        data = request.get_json(silent=True) or {}
+        updates = data.get('updates')
+        if not isinstance(updates, list):
+            return jsonify({"error": "'updates' must be a list"}), 400
+        errors = validate_updates(updates)
+        if errors:
+            # 逐项报告不合格的更新，整批不写入
+            return jsonify({"error": "Invalid updates", "errors": errors}), 400
+        updated = update_recommendation_progress_batch(user_id, updates)
+        return jsonify({"success": True, "updated": updated})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"Error in update_progress_batch: {e}")
+        return jsonify({"error": str(e)}), 500
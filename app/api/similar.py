@@ -0,0 +1,17 @@
+# backend/app/api/similar.py
+from flask import Blueprint, jsonify, request
+from app.services.similarity_service import find_similar_users, DEFAULT_NEIGHBORS
+
+similar_bp = Blueprint('similar', __name__)
+
+@similar_bp.route('/similar/<int:user_id>', methods=['GET'])
+def get_similar_users(user_id):
+    try:
+        k = request.args.get('k', DEFAULT_NEIGHBORS, type=int)
+        data = find_similar_users(user_id, k)
+        if data is None:
+            return jsonify({"error": "User not found"}), 404
+        return jsonify(data)
+    except Exception as e:
+        print(f"Error in get_similar_users: {e}")
+        return jsonify({"error": str(e)}), 500
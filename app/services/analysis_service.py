@@ -1,39 +1,38 @@
-from .data_service import get_latest_metrics, calculate_pension_score, predict_future_pension, pension_risk_assessment
+from .data_service import (
+    get_latest_metrics, calculate_pension_score, predict_future_trend_nn,
+    pension_risk_assessment, get_consumption_features, CONSUMPTION_CATEGORIES,
+)
 from .nlp_service import generate_tags
+from .portfolio_service import optimize_allocation
 from sklearn.cluster import KMeans
 from sklearn.preprocessing import StandardScaler
-import pandas as pd
 import numpy as np
-import os
+import threading
+from . import data_service
+from .metrics_service import record_model_training
+from .schema_service import numeric_matrix
+from .timing_service import timed
 
+@timed("consumption")
 def analyze_consumption_behavior(metrics):
     """
     分析用户的消费行为模式
     """
-    consumption_categories = [
-        '餐饮消费', '衣物消费', '住房消费', '交通消费', '娱乐消费', '教育培训消费',
-        '医疗保健消费', '健身运动消费', '旅行度假消费', '数字产品消费', '宠物消费',
-        '图书影音消费', '美容护肤消费', '线上购物消费', '线下购物消费', '奢侈品消费',
-        '家庭日用品消费', '母婴消费', '绿色环保消费', '慈善捐赠消费'
-    ]
-
-    total_consumption = sum([metrics.get(cat, 0) for cat in consumption_categories])
-    monthly_income = metrics.get('月总流入', 1)  # 避免除零
+    features = get_consumption_features(metrics)
+    total_consumption = features['total']
 
     # 计算各消费类别的占比
     consumption_breakdown = []
-    for category in consumption_categories:
-        amount = metrics.get(category, 0)
-        percentage = (amount / total_consumption * 100) if total_consumption > 0 else 0
+    for category in CONSUMPTION_CATEGORIES:
         consumption_breakdown.append({
             'category': category,
-            'amount': amount,
-            'percentage': round(percentage, 1)
+            'amount': features['amounts'][category],
+            'percentage': round(features['shares'][category] * 100, 1)
         })
 
     # 消费行为洞察
     insights = []
-    consumption_rate = total_consumption / monthly_income
+    consumption_rate = features['consumption_rate']
 
     if consumption_rate > 0.9:
         insights.append("消费支出过高，建议控制预算")
@@ -41,13 +40,11 @@ def analyze_consumption_behavior(metrics):
         insights.append("储蓄率良好，消费控制得当")
 
     # 分析奢侈品消费占比
-    luxury_spending = metrics.get('奢侈品消费', 0) + metrics.get('美容护肤消费', 0)
-    if luxury_spending / total_consumption > 0.2:
+    if features['luxury_ratio'] > 0.2:
         insights.append("奢侈品消费偏高，建议优化支出结构")
 
     # 分析投资相关消费
-    investment_education = metrics.get('教育培训消费', 0)
-    if investment_education < total_consumption * 0.05:
+    if features['education_ratio'] < 0.05:
         insights.append("建议增加金融知识学习投入")
 
     return {
@@ -57,15 +54,53 @@ def analyze_consumption_behavior(metrics):
         'insights': insights
     }
 
+@timed("allocation")
 def generate_asset_allocation(metrics):
     """
     基于用户数据生成资产配置建议
+    优先按风险目标在有效前沿上插值求解，资本市场假设不可用时回退到规则配置表
     """
     age = metrics.get('年龄', 40)
     risk_preference = metrics.get('风险偏好', '平衡')
     monthly_income = metrics.get('月总流入', 10000)
     total_assets = metrics.get('总资产', 100000)
 
+    try:
+        optimized = optimize_allocation(age, risk_preference)
+        risk_level = optimized['riskLevel']
+        allocation = optimized['weights']
+        expected_return = round(optimized['expectedReturn'], 4)
+        expected_volatility = round(optimized['expectedVolatility'], 4)
+    except Exception as e:
+        print(f"Portfolio optimization error: {e}")
+        risk_level, allocation = _rule_based_allocation(age, risk_preference)
+        expected_return = None
+        expected_volatility = None
+
+    # 转换为具体金额
+    detailed_allocation = []
+    for asset_type, percentage in allocation.items():
+        amount = total_assets * percentage
+        detailed_allocation.append({
+            'assetType': asset_type,
+            'percentage': round(percentage * 100, 1),
+            'amount': round(amount, 0),
+            'recommendation': f"建议配置{round(percentage * 100, 1)}%的{asset_type}"
+        })
+
+    return {
+        'riskLevel': risk_level,
+        'totalAssets': total_assets,
+        'allocation': detailed_allocation,
+        'expectedReturn': expected_return,
+        'expectedVolatility': expected_volatility,
+        'monthlyInvestment': round(monthly_income * 0.2, 0)  # 建议每月投资20%的收入
+    }
+
+def _rule_based_allocation(age, risk_preference):
+    """
+    规则配置表：按年龄和风险偏好选择三档固定配置
+    """
     # 基础配置建议
     base_allocation = {
         '保守型': {
@@ -102,71 +137,99 @@ def generate_asset_allocation(metrics):
     elif risk_preference == '保守':
         risk_level = '保守型'
 
-    allocation = base_allocation[risk_level]
+    return risk_level, base_allocation[risk_level]
+
+# 聚类使用的画像特征 - 使用更多维度进行更准确的聚类
+CLUSTER_FEATURES = [
+    '年龄', '月工资收入', '经营性收入', '被动收入', '月总流入', '月总流出', '储蓄率',
+    '活期存款', '理财产品', '股票基金', '房产估值', '总资产', '净资产',
+    '信用卡欠款', '房贷余额', '其他贷款', '总负债', '负债率',
+    '养老金账户余额', '缴纳年限', '住房公积金余额', '商业保险年缴', '保险保额',
+    '计划退休年龄', '目标养老金', '期望收益率下限', '期望收益率上限',
+    '平台月访问次数', '策略采纳率', '交互问答次数', '个性化设置次数', '反馈积极度', '信任评分',
+    # 消费行为维度
+    '餐饮消费', '衣物消费', '住房消费', '交通消费', '娱乐消费', '教育培训消费',
+    '医疗保健消费', '健身运动消费', '旅行度假消费', '数字产品消费', '宠物消费',
+    '图书影音消费', '美容护肤消费', '线上购物消费', '线下购物消费', '奢侈品消费',
+    '家庭日用品消费', '母婴消费', '绿色环保消费', '慈善捐赠消费'
+]
+
+CLUSTER_NAMES = {
+    0: "高收入保守型",
+    1: "中产平衡型",
+    2: "年轻进取型",
+    3: "高负债风险型",
+    4: "退休保障型"
+}
+
+_profile_model = None
+_profile_model_lock = threading.Lock()
+
+def get_profile_model():
+    """
+    返回画像聚类模型（标准化器 + K-Means）。
+    基于已加载的用户表训练一次并缓存，用户表被整体替换（表代数变化）后自动重新训练。
+    """
+    global _profile_model
+    generation = data_service.get_table_generation()
+    model = _profile_model
+    if model is None or model['generation'] != generation:
+        with _profile_model_lock:
+            model = _profile_model
+            if model is None or model['generation'] != generation:
+                frame = data_service.df
+                cluster_data = numeric_matrix(frame, CLUSTER_FEATURES)
+                means = np.nanmean(cluster_data, axis=0)
+                cluster_data = np.where(np.isnan(cluster_data), means, cluster_data)
+                scaler = StandardScaler()
+                cluster_data_scaled = scaler.fit_transform(cluster_data)
+
+                # 训练K-Means模型
+                kmeans = KMeans(n_clusters=5, random_state=42, n_init=10)
+                kmeans.fit(cluster_data_scaled)
+                record_model_training('profile_kmeans')
+                model = {'generation': generation, 'scaler': scaler, 'kmeans': kmeans, 'means': means}
+                _profile_model = model
+    return model
+
+def standardize_profiles(rows, model=None):
+    """
+    将画像特征矩阵（n × 53，缺失值为 NaN）按训练集均值补全并标准化。
+    """
+    model = model or get_profile_model()
+    rows = np.asarray(rows, dtype=np.float64)
+    rows = np.where(np.isnan(rows), model['means'], rows)
+    return model['scaler'].transform(rows)
 
-    # 转换为具体金额
-    detailed_allocation = []
-    for asset_type, percentage in allocation.items():
-        amount = total_assets * percentage
-        detailed_allocation.append({
-            'assetType': asset_type,
-            'percentage': round(percentage * 100, 1),
-            'amount': round(amount, 0),
-            'recommendation': f"建议配置{round(percentage * 100, 1)}%的{asset_type}"
-        })
+def profile_vector(metrics):
+    """
+    提取单个用户的画像特征向量，缺少任一特征时抛出 KeyError。
+    """
+    missing = [f for f in CLUSTER_FEATURES if f not in metrics]
+    if missing:
+        raise KeyError(f"missing profile features: {missing[:3]}")
+    return [np.nan if metrics[f] is None else float(metrics[f]) for f in CLUSTER_FEATURES]
 
-    return {
-        'riskLevel': risk_level,
-        'totalAssets': total_assets,
-        'allocation': detailed_allocation,
-        'monthlyInvestment': round(monthly_income * 0.2, 0)  # 建议每月投资20%的收入
-    }
+def get_user_profiles_batch(frame):
+    """
+    对整张用户表批量预测画像类型，返回与行顺序一致的画像名称数组。
+    """
+    model = get_profile_model()
+    scaled = standardize_profiles(numeric_matrix(frame, CLUSTER_FEATURES), model)
+    clusters = model['kmeans'].predict(scaled)
+    return np.array([CLUSTER_NAMES.get(c, "中产平衡型") for c in clusters], dtype=object)
 
+@timed("profile")
 def get_user_profile(metrics):
     """
     使用K-Means聚类算法的结果。
     根据用户的核心指标，将其归类到不同的养老金规划亚型中。
     """
     try:
-        # 加载数据用于训练模型
-        BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        DATA_PATH = os.path.join(BASE_DIR, '..', 'data', 'pension_mock_500.csv')
-        df = pd.read_csv(DATA_PATH, dtype={'用户ID': int})
-
-        # 准备聚类数据 - 使用更多维度进行更准确的聚类
-        cluster_features = [
-            '年龄', '月工资收入', '经营性收入', '被动收入', '月总流入', '月总流出', '储蓄率',
-            '活期存款', '理财产品', '股票基金', '房产估值', '总资产', '净资产',
-            '信用卡欠款', '房贷余额', '其他贷款', '总负债', '负债率',
-            '养老金账户余额', '缴纳年限', '住房公积金余额', '商业保险年缴', '保险保额',
-            '计划退休年龄', '目标养老金', '期望收益率下限', '期望收益率上限',
-            '平台月访问次数', '策略采纳率', '交互问答次数', '个性化设置次数', '反馈积极度', '信任评分',
-            # 消费行为维度
-            '餐饮消费', '衣物消费', '住房消费', '交通消费', '娱乐消费', '教育培训消费',
-            '医疗保健消费', '健身运动消费', '旅行度假消费', '数字产品消费', '宠物消费',
-            '图书影音消费', '美容护肤消费', '线上购物消费', '线下购物消费', '奢侈品消费',
-            '家庭日用品消费', '母婴消费', '绿色环保消费', '慈善捐赠消费'
-        ]
-        cluster_data = df[cluster_features].fillna(df[cluster_features].mean())
-        scaler = StandardScaler()
-        cluster_data_scaled = scaler.fit_transform(cluster_data)
-
-        # 训练K-Means模型
-        kmeans = KMeans(n_clusters=5, random_state=42, n_init=10)
-        kmeans.fit(cluster_data_scaled)
-
-        user_data = pd.DataFrame([metrics])[cluster_features].fillna(df[cluster_features].mean())
-        user_scaled = scaler.transform(user_data)
-        cluster = kmeans.predict(user_scaled)[0]
-
-        cluster_names = {
-            0: "高收入保守型",
-            1: "中产平衡型",
-            2: "年轻进取型",
-            3: "高负债风险型",
-            4: "退休保障型"
-        }
-        return cluster_names.get(cluster, "中产平衡型")
+        model = get_profile_model()
+        user_scaled = standardize_profiles([profile_vector(metrics)], model)
+        cluster = model['kmeans'].predict(user_scaled)[0]
+        return CLUSTER_NAMES.get(cluster, "中产平衡型")
     except Exception as e:
         print(f"Clustering error: {e}")
         # 回退到简单逻辑
@@ -211,18 +274,22 @@ def get_dashboard_analysis(user_id):
     risk_assessment = pension_risk_assessment(metrics)
 
     # 5. 未来趋势预测
-    future_trend = predict_future_pension(metrics, days_ahead=28)  # 4周趋势
+    future_trend = predict_future_trend_nn(metrics, days_ahead=28)  # 4周趋势
 
     # 6. 调用NLP服务生成标签云
     tags_data = generate_tags(user_profile, simulated_log_text)
 
     # 7. 消费行为分析
     consumption_analysis = analyze_consumption_behavior(metrics)
+    total_consumption = consumption_analysis['totalConsumption']
 
     # 8. 资产配置建议
     asset_allocation = generate_asset_allocation(metrics)
 
-    # 9. 组装更丰富的前端数据包
+    # 9. 同群分位（全体用户）
+    overall_percentiles = _overall_percentiles(user_id)
+
+    # 10. 组装更丰富的前端数据包
     dashboard_data = {
         "userProfile": user_profile,
         "investmentScore": score_data['total_score'],
@@ -238,7 +305,7 @@ def get_dashboard_analysis(user_id):
             {"name": "总资产", "value": f"{metrics.get('总资产', 0):,.0f}", "status": "good" if metrics.get('总资产', 0) > 1000000 else "warning", "unit": "元"},
             {"name": "净资产", "value": f"{metrics.get('净资产', 0):,.0f}", "status": "good" if metrics.get('净资产', 0) > 500000 else "warning", "unit": "元"},
             {"name": "负债率", "value": f"{metrics.get('负债率', 0):.1%}", "status": "warning" if metrics.get('负债率', 0) > 0.5 else "good", "unit": ""},
-            {"name": "月消费总计", "value": f"{sum([metrics.get(cat, 0) for cat in ['餐饮消费', '衣物消费', '住房消费', '交通消费', '娱乐消费', '教育培训消费', '医疗保健消费', '健身运动消费', '旅行度假消费', '数字产品消费', '宠物消费', '图书影音消费', '美容护肤消费', '线上购物消费', '线下购物消费', '奢侈品消费', '家庭日用品消费', '母婴消费', '绿色环保消费', '慈善捐赠消费']]):,.0f}", "status": "warning" if sum([metrics.get(cat, 0) for cat in ['餐饮消费', '衣物消费', '住房消费', '交通消费', '娱乐消费', '教育培训消费', '医疗保健消费', '健身运动消费', '旅行度假消费', '数字产品消费', '宠物消费', '图书影音消费', '美容护肤消费', '线上购物消费', '线下购物消费', '奢侈品消费', '家庭日用品消费', '母婴消费', '绿色环保消费', '慈善捐赠消费']]) > metrics.get('月总流入', 0) * 0.8 else "good", "unit": "元"},
+            {"name": "月消费总计", "value": f"{total_consumption:,.0f}", "status": "warning" if total_consumption > metrics.get('月总流入', 0) * 0.8 else "good", "unit": "元"},
         ],
         "planSnapshot": {
             "completed": metrics.get('task_completed', 0),
@@ -247,4 +314,25 @@ def get_dashboard_analysis(user_id):
         "tagCloudData": tags_data
     }
 
-    return dashboard_data
\ No newline at end of file
+    peer_keys = {"月总收入": "income", "储蓄率": "savings_rate", "总资产": "assets", "负债率": "debt_ratio"}
+    for item in dashboard_data["keyMetrics"]:
+        key = peer_keys.get(item["name"])
+        if key is not None:
+            item["percentile"] = overall_percentiles.get(key)
+
+    return dashboard_data
+
+
+@timed("percentiles")
+def _overall_percentiles(user_id):
+    """取用户在全体用户中的各指标分位，失败时返回空字典。"""
+    try:
+        from .peer_service import get_peer_percentiles
+        result = get_peer_percentiles(user_id)
+        if result is None:
+            return {}
+        metrics = result['cohorts']['overall']['metrics']
+        return {name: item['percentile'] for name, item in metrics.items()}
+    except Exception as e:
+        print(f"Peer percentile error: {e}")
+        return {}
\ No newline at end of file
@@ -0,0 +1,199 @@
+"""
+历史回测服务
+将资产配置在本地大类资产历史收益序列上回放，支持定期再平衡与每月定投；
+所有组合在时间维度上只遍历一次，组合维度完全向量化，指标在线累积，内存与序列长度无关。
+"""
+from __future__ import annotations
+
+import os
+from typing import Dict, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+from .portfolio_service import optimize_allocation
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RETURNS_PATH = os.path.join(BASE_DIR, '..', 'data', 'asset_class_returns_mock.csv')
+
+REBALANCE_RULES = ('none', 'monthly', 'quarterly', 'semiannual', 'annual')
+
+_returns_cache: Dict[tuple, pd.DataFrame] = {}
+
+
+def load_return_series(path: str = RETURNS_PATH) -> pd.DataFrame:
+    """读取历史收益序列（CSV 或 Parquet），首列为日期，其余各列为资产类别的单期收益率。
+    结果按文件修改时间缓存。
+    """
+    key = (os.path.abspath(path), os.path.getmtime(path))
+    series = _returns_cache.get(key)
+    if series is None:
+        if path.endswith('.parquet'):
+            series = pd.read_parquet(path)
+        else:
+            series = pd.read_csv(path)
+        date_col = 'date' if 'date' in series.columns else series.columns[0]
+        series[date_col] = pd.to_datetime(series[date_col])
+        series = series.set_index(date_col).sort_index().astype(np.float64)
+        _returns_cache.clear()
+        _returns_cache[key] = series
+    return series
+
+
+def _periods_per_year(index: pd.DatetimeIndex) -> float:
+    """根据日期间隔推断年化因子（日频约 252，月频 12）。"""
+    if len(index) < 2:
+        return 12.0
+    days = np.median(np.diff(index.values).astype('timedelta64[D]').astype(float))
+    if days <= 4:
+        return 252.0
+    if days <= 10:
+        return 52.0
+    if days <= 45:
+        return 12.0
+    if days <= 120:
+        return 4.0
+    return 1.0
+
+
+def _schedule_flags(index: pd.DatetimeIndex) -> Dict[str, np.ndarray]:
+    """计算每期期末是否为月末/季末/半年末/年末，用于定投与再平衡。"""
+    nxt = index[1:]
+    cur = index[:-1]
+    month_end = np.append(nxt.month != cur.month, True)
+    quarter_end = month_end & np.isin(index.month, (3, 6, 9, 12))
+    half_end = month_end & np.isin(index.month, (6, 12))
+    year_end = month_end & (index.month == 12)
+    return {
+        'none': np.zeros(len(index), dtype=bool),
+        'monthly': month_end,
+        'quarterly': quarter_end,
+        'semiannual': half_end,
+        'annual': year_end,
+    }
+
+
+def run_backtest(
+    weights: np.ndarray,
+    returns: pd.DataFrame,
+    rebalance: Union[str, Sequence[str]] = 'quarterly',
+    monthly_contribution: Union[float, Sequence[float]] = 0.0,
+    initial: Union[float, Sequence[float]] = 100000.0,
+    risk_free_rate: float = 0.02,
+) -> pd.DataFrame:
+    """对 P 个组合同时回测。
+
+    weights: (P, A) 目标权重，列顺序与 returns 的资产列一致
+    rebalance: 单个规则或长度为 P 的规则序列（none/monthly/quarterly/semiannual/annual）
+    monthly_contribution / initial: 标量或长度为 P 的数组；定投在每月最后一期按目标权重买入
+
+    收益率与风险指标基于时间加权收益（剔除定投现金流的影响）。
+    """
+    weights = np.atleast_2d(np.asarray(weights, dtype=np.float64))
+    n_portfolios = weights.shape[0]
+    weights = weights / weights.sum(axis=1, keepdims=True)
+    rets = returns.to_numpy(dtype=np.float64)
+    n_periods = rets.shape[0]
+    ppy = _periods_per_year(returns.index)
+
+    flags = _schedule_flags(returns.index)
+    rules = [rebalance] * n_portfolios if isinstance(rebalance, str) else list(rebalance)
+    unknown = set(rules) - set(REBALANCE_RULES)
+    if unknown or len(rules) != n_portfolios:
+        raise ValueError(f"invalid rebalance rules: {sorted(unknown) or len(rules)}")
+    rule_names = sorted(set(rules))
+    rule_flags = np.vstack([flags[name] for name in rule_names])
+    rule_idx = np.array([rule_names.index(r) for r in rules])
+
+    contribution = np.broadcast_to(np.asarray(monthly_contribution, dtype=np.float64), (n_portfolios,))
+    value = np.broadcast_to(np.asarray(initial, dtype=np.float64), (n_portfolios,)).copy()
+    holdings = value[:, None] * weights
+
+    log_index = np.zeros(n_portfolios)
+    peak = np.zeros(n_portfolios)
+    max_drawdown = np.zeros(n_portfolios)
+    sum_r = np.zeros(n_portfolios)
+    sum_r2 = np.zeros(n_portfolios)
+    contributed = value.copy()
+    month_end = flags['monthly']
+
+    for t in range(n_periods):
+        holdings *= 1.0 + rets[t]
+        new_value = holdings.sum(axis=1)
+        r = np.divide(new_value - value, value, out=np.zeros(n_portfolios), where=value > 0)
+        sum_r += r
+        sum_r2 += r * r
+        log_index += np.log1p(r)
+        peak = np.maximum(peak, log_index)
+        max_drawdown = np.maximum(max_drawdown, 1.0 - np.exp(log_index - peak))
+
+        if month_end[t]:
+            holdings += contribution[:, None] * weights
+            contributed += contribution
+        mask = rule_flags[rule_idx, t]
+        if mask.any():
+            total = holdings[mask].sum(axis=1)
+            holdings[mask] = total[:, None] * weights[mask]
+        value = holdings.sum(axis=1)
+
+    years = n_periods / ppy
+    mean_r = sum_r / n_periods
+    var_r = np.maximum(sum_r2 / n_periods - mean_r ** 2, 0.0) * n_periods / max(n_periods - 1, 1)
+    volatility = np.sqrt(var_r * ppy)
+    cagr = np.expm1(log_index / years)
+    sharpe = np.divide(mean_r * ppy - risk_free_rate, volatility,
+                       out=np.zeros(n_portfolios), where=volatility > 0)
+
+    return pd.DataFrame({
+        'rebalance': rules,
+        'cagr': cagr,
+        'volatility': volatility,
+        'maxDrawdown': max_drawdown,
+        'sharpe': sharpe,
+        'finalValue': value,
+        'totalContributed': contributed,
+    })
+
+
+def backtest_grid(
+    allocations: pd.DataFrame,
+    rebalance_rules: Sequence[str] = ('none', 'quarterly', 'annual'),
+    returns: Optional[pd.DataFrame] = None,
+    **kwargs,
+) -> pd.DataFrame:
+    """对多个配置 × 多个再平衡规则的全部组合一次回测。
+    allocations 的列需包含收益序列中的全部资产类别，其余列（如用户ID）原样保留在结果中。
+    """
+    returns = load_return_series() if returns is None else returns
+    assets = list(returns.columns)
+    weights = allocations[assets].to_numpy(dtype=np.float64)
+    n_alloc, n_rules = len(allocations), len(rebalance_rules)
+    tiled = np.repeat(weights, n_rules, axis=0)
+    rules = list(rebalance_rules) * n_alloc
+    for name in ('monthly_contribution', 'initial'):
+        if name in kwargs and np.ndim(kwargs[name]) == 1:
+            kwargs[name] = np.repeat(np.asarray(kwargs[name], dtype=np.float64), n_rules)
+    result = run_backtest(tiled, returns, rebalance=rules, **kwargs)
+    meta = allocations.drop(columns=assets).iloc[np.repeat(np.arange(n_alloc), n_rules)].reset_index(drop=True)
+    return pd.concat([meta, result], axis=1)
+
+
+def backtest_user_allocation(metrics: Dict, rebalance_rules: Sequence[str] = REBALANCE_RULES) -> Dict:
+    """回测单个用户的推荐配置：初始资金为可投资资产，每月定投收入的 20%（与配置建议一致）。"""
+    returns = load_return_series()
+    allocation = optimize_allocation(metrics.get('年龄', 40), metrics.get('风险偏好', '平衡'))
+    weights = pd.DataFrame([allocation['weights']])
+    initial = sum(float(metrics.get(k, 0) or 0) for k in ('活期存款', '理财产品', '股票基金'))
+    result = backtest_grid(
+        weights, rebalance_rules, returns,
+        monthly_contribution=round(float(metrics.get('月总流入', 10000) or 0) * 0.2, 0),
+        initial=initial,
+    )
+    return {
+        'period': {
+            'start': returns.index[0].strftime('%Y-%m-%d'),
+            'end': returns.index[-1].strftime('%Y-%m-%d'),
+        },
+        'allocation': {k: round(v, 4) for k, v in allocation['weights'].items()},
+        'results': result.round(4).to_dict('records'),
+    }
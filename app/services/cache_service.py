@@ -0,0 +1,143 @@
+"""
+缓存工具服务
+提供线程安全的有界 LRU 缓存及按用户分区的 LRU 缓存，并统一登记命中率统计
+"""
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+_MISSING = object()
+
+# 全局缓存登记表：名称 -> 缓存实例，用于统一输出命中率
+_registry: Dict[str, Any] = {}
+_registry_lock = threading.Lock()
+
+
+class LRUCache:
+    """有界 LRU 缓存，带命中/未命中计数。"""
+
+    def __init__(self, maxsize: int = 1024, name: Optional[str] = None):
+        self.maxsize = max(1, int(maxsize))
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if name:
+            register_cache(name, self)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            value = self._data.get(key, _MISSING)
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def invalidate(self, predicate: Callable[[Hashable], bool]) -> int:
+        """删除所有满足条件的键，返回删除数量。"""
+        with self._lock:
+            keys = [k for k in self._data if predicate(k)]
+            for k in keys:
+                del self._data[k]
+            return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+class PartitionedLRUCache:
+    """按用户分区的 LRU 缓存：每个用户最多 max_entries 条，最多保留 max_partitions 个用户。
+    可以整体失效某个用户的全部条目。
+    """
+
+    def __init__(self, max_partitions: int = 1000, max_entries: int = 64, name: Optional[str] = None):
+        self.max_entries = max(1, int(max_entries))
+        self._partitions = LRUCache(max_partitions)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if name:
+            register_cache(name, self)
+
+    def get(self, partition: Hashable, key: Hashable, default: Any = None) -> Any:
+        cache = self._partitions.get(partition)
+        value = cache.get(key, _MISSING) if cache is not None else _MISSING
+        with self._lock:
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return value
+
+    def put(self, partition: Hashable, key: Hashable, value: Any) -> None:
+        with self._lock:
+            cache = self._partitions.get(partition)
+            if cache is None:
+                cache = LRUCache(self.max_entries)
+                self._partitions.put(partition, cache)
+        cache.put(key, value)
+
+    def invalidate_partition(self, partition: Hashable) -> None:
+        self._partitions.pop(partition)
+
+    def clear(self) -> None:
+        self._partitions.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "partitions": len(self._partitions),
+            "max_partitions": self._partitions.maxsize,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+def register_cache(name: str, cache: Any) -> None:
+    """登记缓存实例，便于统一导出命中率。"""
+    with _registry_lock:
+        _registry[name] = cache
+
+
+def get_cache_stats() -> Dict[str, Dict[str, Any]]:
+    """返回所有已登记缓存的统计信息。"""
+    with _registry_lock:
+        caches = dict(_registry)
+    return {name: cache.stats() for name, cache in caches.items()}
@@ -0,0 +1,217 @@
+"""
+对话日志离线分析
+流式读取归档的对话消息（JSONL/CSV，可为目录），分块交给进程池执行意图识别、情感分析与健康信息提取，
+用可合并的计数器汇总各类分布，结果以列式格式（Parquet，不可用时退回 CSV）输出。
+任意时刻只有固定数量的分块在内存中，内存占用与输入规模无关。
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import json
+import os
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+
+import pandas as pd
+
+from .nlp_service import (
+    HEALTH_KEYWORDS, INTENT_KEYWORDS, NEGATIVE_WORDS, POSITIVE_WORDS, STOP_WORDS,
+    token_grams, analyze_intent, analyze_sentiment, extract_health_info, normalize_message,
+)
+from .tokenizer_service import segment
+
+MESSAGE_FIELDS = ('message', 'original_message', 'text', 'content')
+# 未命中任何关键词的消息中的高频词只保留前 N 个（合并后截断，近似 Top-N）
+TOP_UNMATCHED_TERMS = 2000
+
+_KEYWORD_LISTS = {
+    **{f'intent:{name}': words for name, words in INTENT_KEYWORDS.items()},
+    'sentiment:positive': POSITIVE_WORDS,
+    'sentiment:negative': NEGATIVE_WORDS,
+    **{f'health:{name}': words for name, words in HEALTH_KEYWORDS.items()},
+}
+
+
+class ChatStats:
+    """可合并的分布计数。"""
+
+    def __init__(self):
+        self.messages = 0
+        self.intents = Counter()
+        self.sentiments = Counter()
+        self.health_signals = Counter()
+        self.health_values = Counter()
+        self.keyword_hits = Counter()
+        self.unmatched_terms = Counter()
+
+    def add(self, message: str) -> None:
+        text = normalize_message(message)
+        if not text:
+            return
+        self.messages += 1
+        intent = analyze_intent(text)
+        sentiment = analyze_sentiment(text)
+        health = extract_health_info(text) or {}
+        self.intents[intent['intent']] += 1
+        self.sentiments[sentiment['sentiment']] += 1
+        for key, value in health.items():
+            self.health_signals[key] += 1
+            self.health_values[f'{key}={value}'] += 1
+
+        grams = token_grams(text)
+        matched = False
+        for list_name, words in _KEYWORD_LISTS.items():
+            for word in words:
+                if word in grams:
+                    self.keyword_hits[f'{list_name}:{word}'] += 1
+                    matched = True
+        if not matched:
+            self.unmatched_terms.update(w for w in set(segment(text)) if len(w) > 1 and w not in STOP_WORDS)
+
+    def merge(self, other: "ChatStats") -> "ChatStats":
+        self.messages += other.messages
+        for name in ('intents', 'sentiments', 'health_signals', 'health_values', 'keyword_hits', 'unmatched_terms'):
+            getattr(self, name).update(getattr(other, name))
+        if len(self.unmatched_terms) > TOP_UNMATCHED_TERMS:
+            self.unmatched_terms = Counter(dict(self.unmatched_terms.most_common(TOP_UNMATCHED_TERMS)))
+        return self
+
+    def to_frame(self) -> pd.DataFrame:
+        """长表：dimension, key, count, share（占消息数的比例）。"""
+        rows = [('messages', 'total', self.messages)]
+        for name in ('intents', 'sentiments', 'health_signals', 'health_values', 'keyword_hits', 'unmatched_terms'):
+            rows.extend((name, key, count) for key, count in getattr(self, name).most_common())
+        frame = pd.DataFrame(rows, columns=['dimension', 'key', 'count'])
+        frame['share'] = frame['count'] / max(self.messages, 1)
+        return frame
+
+
+def _message_from_record(record: Dict) -> Optional[str]:
+    for field in MESSAGE_FIELDS:
+        value = record.get(field)
+        if isinstance(value, str) and value:
+            return value
+    return None
+
+
+def _expand_paths(paths: Sequence[str]) -> Iterator[str]:
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in sorted(files):
+                    if name.endswith(('.jsonl', '.csv')):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def _jsonl_records(lines: Iterable[str], path: str, skipped: Optional[Counter]) -> Iterator[Dict]:
+    """逐行解析 JSONL；无法解析或不是对象的行跳过，并按文件计入 skipped。"""
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        if not isinstance(record, dict):
+            if skipped is not None:
+                skipped[path] += 1
+            continue
+        yield record
+
+
+def iter_messages(paths: Sequence[str], skipped: Optional[Counter] = None) -> Iterator[str]:
+    """逐行读取消息，不整体载入文件。格式有误的 JSONL 行不中断读取，数量按文件计入 skipped。"""
+    for path in _expand_paths(paths):
+        with open(path, encoding='utf-8', newline='') as f:
+            if path.endswith('.csv'):
+                records = csv.DictReader(f)
+            else:
+                records = _jsonl_records(f, path, skipped)
+            for record in records:
+                message = _message_from_record(record)
+                if message:
+                    yield message
+
+
+def _chunks(iterable: Iterable[str], size: int) -> Iterator[List[str]]:
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _analyze_chunk(messages: List[str]) -> ChatStats:
+    stats = ChatStats()
+    for message in messages:
+        stats.add(message)
+    return stats
+
+
+def analyze_messages(messages: Iterable[str], workers: Optional[int] = None, chunk_size: int = 2000,
+                     max_in_flight: Optional[int] = None) -> ChatStats:
+    """分块并行分析。同时在途的分块数有上限，读取速度快于处理速度时读取会暂停。"""
+    total = ChatStats()
+    chunks = _chunks(messages, chunk_size)
+    if workers == 1:
+        for chunk in chunks:
+            total.merge(_analyze_chunk(chunk))
+        return total
+
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or workers * 2
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        for chunk in chunks:
+            pending.add(pool.submit(_analyze_chunk, chunk))
+            if len(pending) >= max_in_flight:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    total.merge(future.result())
+        for future in pending:
+            total.merge(future.result())
+    return total
+
+
+def write_results(frame: pd.DataFrame, output: str, fmt: str = 'auto') -> str:
+    """写出结果，fmt 为 auto 时优先 Parquet，缺少 Parquet 引擎时写 CSV。返回实际写出的路径。"""
+    base, _ = os.path.splitext(output)
+    if fmt in ('auto', 'parquet'):
+        try:
+            path = base + '.parquet'
+            frame.to_parquet(path, index=False)
+            return path
+        except ImportError:
+            if fmt == 'parquet':
+                raise
+            print("Parquet engine not available, writing CSV instead")
+    path = base + '.csv'
+    frame.to_csv(path, index=False, encoding='utf-8')
+    return path
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='批量分析归档的对话消息，统计意图/情感/健康信号分布')
+    parser.add_argument('inputs', nargs='+', help='JSONL/CSV 文件或目录')
+    parser.add_argument('--output', default='chat_analytics', help='输出文件（不含扩展名）')
+    parser.add_argument('--format', choices=('auto', 'parquet', 'csv'), default='auto')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--chunk-size', type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    skipped = Counter()
+    stats = analyze_messages(iter_messages(args.inputs, skipped), workers=args.workers, chunk_size=args.chunk_size)
+    path = write_results(stats.to_frame(), args.output, args.format)
+    print(f"Analyzed {stats.messages} messages -> {path}")
+    for name, count in skipped.items():
+        print(f"Skipped {count} malformed lines in {name}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,318 @@
 import pandas as pd
 import numpy as np
 import os
-from typing import Dict, Any
+import threading
+import time
+from typing import Dict, Any, Callable, Iterable, List
+
+from .metrics_service import record_dataset_load, record_model_training
+from .schema_service import CATEGORICAL_COLUMNS, apply_schema, derive_fields, missing_required, numeric_column
+from .storage_service import create_storage
+from .timing_service import timed
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DATA_PATH = os.path.join(BASE_DIR, '..', 'data', 'pension_mock_500.csv')
 
+# 用户表与健康指标的存储后端（PENSION_STORAGE=csv|sqlite）；CSV 模式下单个用户直接查内存中的 df
+_storage = create_storage(lambda: df)
+
+# SQLite 模式下其他进程也会写入用户表：记录内存表对应的存储版本，不一致时从存储重新加载
+# （先取版本再读表，读表期间的写入会在下一次同步时补上）。CSV 模式下为 None。
+_storage_version = _storage.users_version()
+SYNC_INTERVAL = 1.0  # 两次检查存储版本的最小间隔（秒）
+_sync_checked = 0.0
+
 try:
-    # 用户ID列包含字母前缀，需要特殊处理
-    df = pd.read_csv(DATA_PATH)
-    # 将用户ID转换为纯数字（去掉U前缀）
-    df['用户ID'] = df['用户ID'].str.replace('U', '').astype(int)
+    _load_start = time.perf_counter()
+    # 低基数文本列读为分类类型；用户ID去掉U前缀转为整数，数值列按类型定义压缩
+    df = apply_schema(_storage.load_users())
+    record_dataset_load('users', time.perf_counter() - _load_start)
 except FileNotFoundError:
     print(f"Error: Data file not found at {DATA_PATH}")
     df = pd.DataFrame()
 
+# --- 指标版本与变更通知 ---
+# 每次用户指标发生变化时版本号递增，缓存以 (用户ID, 版本号) 判断是否过期；
+# 同时通知已注册的监听器，只失效受影响用户的缓存。
+_metrics_versions: Dict[int, int] = {}
+_versions_lock = threading.Lock()
+_metrics_listeners: List[Callable[[List[int]], None]] = []
+
+
+def get_metrics_version(user_id) -> int:
+    """返回用户指标的当前版本号，从未变更过的用户为 0。"""
+    return _metrics_versions.get(int(user_id), 0)
+
+
+def register_metrics_listener(callback: Callable[[List[int]], None]) -> None:
+    """注册指标变更监听器，回调参数为发生变化的用户ID列表。"""
+    if callback not in _metrics_listeners:
+        _metrics_listeners.append(callback)
+
+
+def notify_metrics_changed(user_ids: Iterable) -> None:
+    """递增变更用户的版本号并通知所有监听器。"""
+    changed = [int(uid) for uid in user_ids]
+    if not changed:
+        return
+    # 读-改-写需在锁内完成，并发写入同一用户时版本号不会丢失递增
+    with _versions_lock:
+        for uid in changed:
+            _metrics_versions[uid] = _metrics_versions.get(uid, 0) + 1
+    for callback in list(_metrics_listeners):
+        try:
+            callback(changed)
+        except Exception as e:
+            print(f"Metrics listener error: {e}")
+
+# --- 消费特征块 ---
+# 20 类消费的合计、占比及奢侈/健康/教育/慈善比例、消费率，在加载时对全表一次性向量化计算，
+# 供消费分析、仪表盘与推荐共用；用户指标变更时只重算受影响的行。
+CONSUMPTION_CATEGORIES = [
+    '餐饮消费', '衣物消费', '住房消费', '交通消费', '娱乐消费', '教育培训消费',
+    '医疗保健消费', '健身运动消费', '旅行度假消费', '数字产品消费', '宠物消费',
+    '图书影音消费', '美容护肤消费', '线上购物消费', '线下购物消费', '奢侈品消费',
+    '家庭日用品消费', '母婴消费', '绿色环保消费', '慈善捐赠消费'
+]
+_CONSUMPTION_GROUPS = {
+    'luxury_ratio': ['奢侈品消费', '美容护肤消费'],
+    'health_ratio': ['医疗保健消费', '健身运动消费'],
+    'education_ratio': ['教育培训消费'],
+    'charity_ratio': ['慈善捐赠消费'],
+}
+_CONSUMPTION_FIELDS = ['total', 'consumption_rate'] + list(_CONSUMPTION_GROUPS)
+
+
+def _consumption_feature_matrix(amounts: np.ndarray, income: np.ndarray) -> np.ndarray:
+    total = amounts.sum(axis=1)
+    safe_total = np.where(total > 0, total, 1.0)
+    shares = np.where(total[:, None] > 0, amounts / safe_total[:, None], 0.0)
+    rate = np.divide(total, income, out=np.zeros(len(total)), where=income != 0)
+    index = {c: i for i, c in enumerate(CONSUMPTION_CATEGORIES)}
+    groups = [shares[:, [index[c] for c in cols]].sum(axis=1) for cols in _CONSUMPTION_GROUPS.values()]
+    return np.column_stack([amounts, shares, total, rate] + groups)
+
+
+def _consumption_inputs(frame: pd.DataFrame):
+    """整张表的 20 类消费金额矩阵与月总流入（缺失的金额按 0、缺失的收入按 1 计）。"""
+    amounts = np.column_stack([
+        np.nan_to_num(numeric_column(frame, c), nan=0.0)
+        if c in frame else np.zeros(len(frame))
+        for c in CONSUMPTION_CATEGORIES
+    ])
+    if '月总流入' in frame:
+        income = np.nan_to_num(numeric_column(frame, '月总流入'), nan=1.0)
+    else:
+        income = np.ones(len(frame))
+    return amounts, income
+
+
+def compute_consumption_features(frame: pd.DataFrame) -> np.ndarray:
+    """向量化计算整张表的消费特征矩阵。
+    列顺序：20 类消费金额、20 类占比、合计、消费率、奢侈/健康/教育/慈善比例。
+    """
+    return _consumption_feature_matrix(*_consumption_inputs(frame))
+
+
+def consumption_summary_frame(frame: pd.DataFrame) -> pd.DataFrame:
+    """整张表的消费汇总特征（合计、消费率及各类比例），行索引与 frame 一致。"""
+    matrix = compute_consumption_features(frame)
+    return pd.DataFrame(matrix[:, -len(_CONSUMPTION_FIELDS):], columns=_CONSUMPTION_FIELDS, index=frame.index)
+
+
+def _features_to_dict(row) -> Dict[str, Any]:
+    values = row.tolist()
+    n = len(CONSUMPTION_CATEGORIES)
+    features = dict(zip(_CONSUMPTION_FIELDS, values[2 * n:]))
+    features['amounts'] = dict(zip(CONSUMPTION_CATEGORIES, values[:n]))
+    features['shares'] = dict(zip(CONSUMPTION_CATEGORIES, values[n:2 * n]))
+    return features
+
+
+_consumption_rows: Dict[int, int] = {}
+_consumption_matrix = np.empty((0, 2 * len(CONSUMPTION_CATEGORIES) + len(_CONSUMPTION_FIELDS)))
+# 每行特征对应的月总流入，与矩阵中的消费金额一起用于判断指标字典是否与用户表一致
+_consumption_income = np.empty(0)
+
+
+def _rebuild_consumption_features() -> None:
+    global _consumption_rows, _consumption_matrix, _consumption_income
+    if df.empty:
+        _consumption_rows, _consumption_matrix, _consumption_income = {}, _consumption_matrix[:0], np.empty(0)
+        return
+    amounts, income = _consumption_inputs(df)
+    rows = {int(uid): i for i, uid in enumerate(df['用户ID'].to_numpy())}
+    _consumption_rows, _consumption_matrix, _consumption_income = \
+        rows, _consumption_feature_matrix(amounts, income), income
+
+
+def _refresh_consumption_features(user_ids: List[int]) -> None:
+    """指标变更监听：只重算受影响用户的消费特征。"""
+    if df.empty:
+        return
+    if any(uid not in _consumption_rows for uid in user_ids):
+        _rebuild_consumption_features()
+        return
+    subset = df[df['用户ID'].isin(user_ids)]
+    amounts, income = _consumption_inputs(subset)
+    features = _consumption_feature_matrix(amounts, income)
+    for uid, row, value in zip(subset['用户ID'].to_numpy(), features, income):
+        pos = _consumption_rows[int(uid)]
+        _consumption_matrix[pos], _consumption_income[pos] = row, value
+
+
+def get_consumption_features(metrics: Dict[str, Any]) -> Dict[str, Any]:
+    """返回用户的消费特征块。
+    与用户表当前取值一致的指标直接查预计算结果；修改过的指标字典（如调整消费的假设情景）
+    及其他来源的指标（如模拟数据）按字典中的取值现场计算。
+    """
+    amounts = np.nan_to_num(np.array([[float(metrics.get(c, 0) or 0) for c in CONSUMPTION_CATEGORIES]]), nan=0.0)
+    income = np.nan_to_num(np.array([float(metrics.get('月总流入', 1))]), nan=1.0)
+    uid = metrics.get('用户ID')
+    if uid is not None:
+        pos = _consumption_rows.get(int(uid))
+        if pos is not None and _consumption_income[pos] == income[0] \
+                and np.array_equal(_consumption_matrix[pos, :len(CONSUMPTION_CATEGORIES)], amounts[0]):
+            return _features_to_dict(_consumption_matrix[pos])
+    return _features_to_dict(_consumption_feature_matrix(amounts, income)[0])
+
+
+_rebuild_consumption_features()
+register_metrics_listener(_refresh_consumption_features)
+
+# --- 用户表写入 ---
+# 写入时在锁内构造新表后整体替换 df，读取方始终看到完整的快照。
+# 表代数在整表替换（或一次写入使表规模翻倍以上）时递增，画像模型、同群索引等全表结构据此重建；
+# 其余变更只通知受影响的用户。
+_table_lock = threading.Lock()
+_table_generation = 0
+
+
+def get_table_generation() -> int:
+    return _table_generation
+
+
+def replace_users(frame: pd.DataFrame) -> None:
+    """整体替换内存中的用户表（列类型按类型定义转换），不写入存储后端。"""
+    global df, _table_generation
+    frame = apply_schema(frame.copy())
+    with _table_lock:
+        df = frame
+        _table_generation += 1
+        _rebuild_consumption_features()
+
+
+def upsert_users(frame: pd.DataFrame, delete: Iterable = ()) -> Dict[str, Any]:
+    """按用户ID批量写入：已存在的用户用新值覆盖（新值缺失的列保留原值），新用户追加到表尾；
+    delete 中的用户在同一次替换中删除。合并后的行按分项重新计算汇总与比例字段。
+    缺少必填列的新用户不写入，在 rejected 中列出 {'userId', 'missing'}。
+    返回 {'inserted', 'updated', 'deleted', 'rejected'}，并通知受影响用户的缓存与索引。"""
+    global df, _table_generation, _storage_version
+    # 先同步其他进程的写入，合并基于最新的行
+    sync_from_storage(0)
+    incoming = apply_schema(frame.copy()).drop_duplicates('用户ID', keep='last') if not frame.empty else frame
+    deleted_ids = pd.Index(np.asarray(list(delete), dtype=np.int64)).difference(
+        incoming['用户ID'] if not incoming.empty else [])
+    rejected: List[Dict[str, Any]] = []
+    if incoming.empty and deleted_ids.empty:
+        return {'inserted': 0, 'updated': 0, 'deleted': 0, 'rejected': rejected}
+    with _table_lock:
+        current = df
+        removed = current['用户ID'].isin(deleted_ids).to_numpy() if not current.empty \
+            else np.zeros(0, dtype=bool)
+        deleted = int(removed.sum())
+        updated = 0
+        if not incoming.empty:
+            columns = list(current.columns) if not current.empty else list(incoming.columns)
+            incoming = incoming.set_index('用户ID').reindex(columns=[c for c in columns if c != '用户ID'])
+            is_new = ~incoming.index.isin(current['用户ID']) if not current.empty \
+                else np.ones(len(incoming), dtype=bool)
+            if is_new.any():
+                # 新用户缺少评分所需字段时整行拒绝，避免写入无法评分的用户
+                missing = missing_required(incoming[is_new])
+                incomplete = np.array([bool(m) for m in missing])
+                rejected = [{'userId': int(uid), 'missing': m}
+                            for uid, m in zip(incoming.index[is_new], missing) if m]
+                if incomplete.any():
+                    keep = np.ones(len(incoming), dtype=bool)
+                    keep[np.flatnonzero(is_new)[incomplete]] = False
+                    incoming = incoming[keep]
+        if incoming.empty:
+            if not deleted:
+                return {'inserted': 0, 'updated': 0, 'deleted': 0, 'rejected': rejected}
+            rows = current.iloc[0:0]
+            table = current[~removed].reset_index(drop=True)
+        else:
+            existing_mask = current['用户ID'].isin(incoming.index).to_numpy() if not current.empty \
+                else np.zeros(0, dtype=bool)
+            updated = int(existing_mask.sum())
+            if updated:
+                # 只有写入的这一小块转为 object 合并，全表保持原类型
+                existing = current[existing_mask].set_index('用户ID').astype(object)
+                incoming = incoming.astype(object).combine_first(existing)
+            # 汇总字段在合并之后由完整的分项重新计算，部分字段的更新不会留下过期的合计与比例
+            rows = derive_fields(incoming.reset_index().infer_objects())
+            rows = apply_schema(rows)[columns]
+            base = current[~(existing_mask | removed)] if updated or deleted else current
+            for column in CATEGORICAL_COLUMNS:
+                if column in columns and isinstance(base[column].dtype, pd.CategoricalDtype):
+                    # 新类别追加在已有类别之后，拼接后仍为分类类型
+                    categories = base[column].cat.categories
+                    categories = categories.append(rows[column].cat.categories.difference(categories))
+                    base = base.assign(**{column: base[column].cat.set_categories(categories)})
+                    rows[column] = rows[column].cat.set_categories(categories)
+            table = apply_schema(pd.concat([base, rows], ignore_index=True)) if not current.empty else rows
+        # 先写入存储后端再替换内存表，持久化顺序与内存中的写入顺序一致
+        versions = _storage.write_users(rows, deleted_ids)
+        # 写入前的版本与内存表一致时才前移；否则期间有其他进程写入，留待下一次同步重新加载
+        if versions is not None and versions[0] == _storage_version:
+            _storage_version = versions[1]
+        if len(table) > 2 * len(current):
+            _table_generation += 1
+        df = table
+    changed = list(incoming.index)
+    notify_metrics_changed(changed + [int(uid) for uid in deleted_ids])
+    return {'inserted': len(changed) - updated, 'updated': updated, 'deleted': deleted, 'rejected': rejected}
+
+
+def _changed_user_ids(old: pd.DataFrame, new: pd.DataFrame) -> List[int]:
+    """比较两张用户表，返回新增、删除或任一字段不同的用户ID。"""
+    if old.empty or new.empty or list(old.columns) != list(new.columns):
+        ids = pd.Index(old['用户ID'] if not old.empty else []).union(new['用户ID'] if not new.empty else [])
+        return [int(uid) for uid in ids]
+    old_hash = pd.Series(pd.util.hash_pandas_object(old, index=False).to_numpy(), index=old['用户ID'].to_numpy())
+    new_hash = pd.Series(pd.util.hash_pandas_object(new, index=False).to_numpy(), index=new['用户ID'].to_numpy())
+    common = old_hash.index.intersection(new_hash.index)
+    differs = common[old_hash[common].to_numpy() != new_hash[common].to_numpy()]
+    ids = old_hash.index.symmetric_difference(new_hash.index).union(differs)
+    return [int(uid) for uid in ids]
+
+
+def sync_from_storage(min_interval: float = SYNC_INTERVAL) -> bool:
+    """存储中的用户表版本与内存表不一致（其他进程写入过）时重新加载内存表，并通知发生变化的用户。
+    两次检查至少间隔 min_interval 秒；CSV 模式下不做任何事。返回是否重新加载。"""
+    global df, _table_generation, _storage_version, _sync_checked
+    now = time.monotonic()
+    if _storage_version is None or now - _sync_checked < min_interval:
+        return False
+    _sync_checked = now
+    if _storage.users_version() == _storage_version:
+        return False
+    with _table_lock:
+        version = _storage.users_version()
+        if version == _storage_version:
+            return False
+        start = time.perf_counter()
+        current = df
+        fresh = apply_schema(_storage.load_users())
+        changed = _changed_user_ids(current, fresh)
+        if len(fresh) > 2 * len(current):
+            _table_generation += 1
+        df, _storage_version = fresh, version
+        record_dataset_load('users_sync', time.perf_counter() - start)
+    notify_metrics_changed(changed)
+    return True
+
+
 import pandas as pd
 import numpy as np
 import os
@@ -23,6 +322,7 @@ from sklearn.preprocessing import StandardScaler
 from sklearn.neural_network import MLPRegressor
 from sklearn.metrics import mean_squared_error
 
+@timed("pension_model")
 def predict_future_pension(metrics):
     """
     使用XGBoost预测未来养老金积累。
@@ -60,6 +360,7 @@ def predict_future_pension(metrics):
         X_test_scaled = scaler_pred.transform(X_test)
         model = XGBRegressor(n_estimators=100, random_state=42)
         model.fit(X_train_scaled, y_train)
+        record_model_training('pension_xgb')
 
         user_data = pd.DataFrame([metrics])[features].fillna(df[features].mean())
         user_scaled = scaler_pred.transform(user_data)
@@ -73,15 +374,14 @@ def predict_future_pension(metrics):
         growth = current * (1 + 0.05) ** (65 - age) if age < 65 else current
         return max(0, growth)
 
+@timed("trend_model")
 def predict_future_trend_nn(metrics, days_ahead=30):
     """
     使用神经网络预测未来趋势
     """
     try:
         # 加载数据用于训练模型
-        BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        DATA_PATH = os.path.join(BASE_DIR, '..', 'data', 'mock_data.csv')
-        df = pd.read_csv(DATA_PATH, dtype={'user_id': int})
+        df = _storage.load_health()
 
         if df.empty:
             return [metrics.get('MMSE', 25)] * (days_ahead // 7)
@@ -111,6 +411,7 @@ def predict_future_trend_nn(metrics, days_ahead=30):
         )
 
         nn_model.fit(X_train_scaled, y_train)
+        record_model_training('trend_mlp')
 
         # 预测未来趋势
         user_data = pd.DataFrame([metrics])[features].fillna(df[features].mean())
@@ -137,6 +438,7 @@ def predict_future_trend_nn(metrics, days_ahead=30):
         current = metrics.get('养老金账户余额', 0)
         return [max(0, current * (1 + i * 0.005)) for i in range(days_ahead // 7)]
 
+@timed("risk_assessment")
 def pension_risk_assessment(metrics):
     """
     养老金风险评估，基于财务状况
@@ -163,6 +465,7 @@ def pension_risk_assessment(metrics):
 
         risk_model = XGBRegressor(n_estimators=100, random_state=42)
         risk_model.fit(X_train_scaled, y_train)
+        record_model_training('risk_xgb')
 
         # 预测用户风险
         user_data = pd.DataFrame([metrics])[features].fillna(df[features].mean())
@@ -187,94 +490,113 @@ def pension_risk_assessment(metrics):
         print(f"Risk assessment error: {e}")
         return {"risk_level": "unknown", "confidence": 0.0}
 
+@timed("metrics")
 def get_latest_metrics(user_id):
-    """从CSV中提取指定用户的最新指标。"""
-    if df.empty: return None
-    user_data = df[df['用户ID'] == int(user_id)]
-    if user_data.empty: return None
-    # 转换为Python类型，避免numpy类型
-    metrics = user_data.iloc[0].to_dict()
-    for key, value in metrics.items():
-        if hasattr(value, 'item'):  # numpy类型
-            metrics[key] = value.item()
-        elif isinstance(value, (int, float)):
-            metrics[key] = float(value) if isinstance(value, float) else int(value)
-    return metrics
+    """从存储后端提取指定用户的最新指标。"""
+    return _storage.get_user(user_id)
 
 # --- 算法辅助函数 ---
 def normalize_score(value, min_val, max_val):
-    """归一化函数，值越大分数越高"""
-    return max(0, min(100, ((value - min_val) / (max_val - min_val)) * 100))
+    """归一化函数，值越大分数越高（同时支持标量与数组）"""
+    return np.clip(((value - min_val) / (max_val - min_val)) * 100, 0, 100)
 
 def normalize_inverted_score(value, min_val, max_val):
-    """反向归一化，值越小分数越高"""
-    return max(0, min(100, (1 - (value - min_val) / (max_val - min_val)) * 100))
+    """反向归一化，值越小分数越高（同时支持标量与数组）"""
+    return np.clip((1 - (value - min_val) / (max_val - min_val)) * 100, 0, 100)
 
-# --- 精细化养老金规划评分模型 ---
-def calculate_pension_score(metrics):
+RISK_PREFERENCE_SCORES = {'保守': 20, '稳健': 50, '平衡': 70, '积极': 85, '激进': 95}
+SCORE_WEIGHTS = {'financial': 0.3, 'debt': 0.25, 'investment': 0.2, 'planning': 0.15, 'behavior': 0.1}
+
+def _score_dimensions(get, risk_score):
     """
-    根据养老金规划的五大维度，综合多个数据字段计算养老金健康分。
-    每个维度都归一化到0-100分。
+    计算五大维度得分。get(字段, 默认值) 返回标量或数组，因此单用户与整表批量共用同一套公式。
     """
     # 维度1: 财务基础 (Financial Foundation)
     # 使用 月总流入, 储蓄率, 总资产, 净资产
-    income_score = normalize_score(metrics.get('月总流入', 0), 5000, 50000)
-    savings_rate_score = normalize_score(metrics.get('储蓄率', 0), 0.1, 0.5)
-    total_assets_score = normalize_score(metrics.get('总资产', 0), 100000, 5000000)
-    net_assets_score = normalize_score(metrics.get('净资产', 0), 50000, 4000000)
+    income_score = normalize_score(get('月总流入', 0), 5000, 50000)
+    savings_rate_score = normalize_score(get('储蓄率', 0), 0.1, 0.5)
+    total_assets_score = normalize_score(get('总资产', 0), 100000, 5000000)
+    net_assets_score = normalize_score(get('净资产', 0), 50000, 4000000)
     financial_final_score = (income_score * 0.3) + (savings_rate_score * 0.3) + (total_assets_score * 0.2) + (net_assets_score * 0.2)
 
     # 维度2: 负债管理 (Debt Management)
     # 使用 负债率, 信用卡欠款, 房贷余额, 其他贷款
-    debt_ratio_score = normalize_inverted_score(metrics.get('负债率', 1), 0, 0.5)
-    credit_debt_score = normalize_inverted_score(metrics.get('信用卡欠款', 0), 0, 50000)
-    mortgage_score = normalize_inverted_score(metrics.get('房贷余额', 0), 0, 2000000)
-    other_loans_score = normalize_inverted_score(metrics.get('其他贷款', 0), 0, 500000)
+    debt_ratio_score = normalize_inverted_score(get('负债率', 1), 0, 0.5)
+    credit_debt_score = normalize_inverted_score(get('信用卡欠款', 0), 0, 50000)
+    mortgage_score = normalize_inverted_score(get('房贷余额', 0), 0, 2000000)
+    other_loans_score = normalize_inverted_score(get('其他贷款', 0), 0, 500000)
     debt_final_score = (debt_ratio_score * 0.4) + (credit_debt_score * 0.2) + (mortgage_score * 0.2) + (other_loans_score * 0.2)
 
     # 维度3: 投资配置 (Investment Allocation)
     # 使用 理财产品, 股票基金, 养老金账户余额, 商业保险年缴
-    wealth_management_score = normalize_score(metrics.get('理财产品', 0), 0, 2000000)
-    stock_fund_score = normalize_score(metrics.get('股票基金', 0), 0, 1000000)
-    pension_balance_score = normalize_score(metrics.get('养老金账户余额', 0), 0, 500000)
-    insurance_score = normalize_score(metrics.get('商业保险年缴', 0), 0, 50000)
+    wealth_management_score = normalize_score(get('理财产品', 0), 0, 2000000)
+    stock_fund_score = normalize_score(get('股票基金', 0), 0, 1000000)
+    pension_balance_score = normalize_score(get('养老金账户余额', 0), 0, 500000)
+    insurance_score = normalize_score(get('商业保险年缴', 0), 0, 50000)
     investment_final_score = (wealth_management_score * 0.3) + (stock_fund_score * 0.3) + (pension_balance_score * 0.2) + (insurance_score * 0.2)
 
     # 维度4: 风险偏好与规划 (Risk Preference & Planning)
     # 使用 风险偏好, 计划退休年龄, 目标养老金, 期望收益率
-    risk_preference_map = {'保守': 20, '稳健': 50, '平衡': 70, '积极': 85, '激进': 95}
-    risk_score = risk_preference_map.get(metrics.get('风险偏好', '平衡'), 70)
-    retirement_age_score = normalize_inverted_score(metrics.get('计划退休年龄', 65), 55, 70)  # 越早退休越好？
-    target_pension_score = normalize_score(metrics.get('目标养老金', 0), 1000000, 5000000)
-    expected_return_score = normalize_score((metrics.get('期望收益率下限', 0) + metrics.get('期望收益率上限', 0)) / 2, 0.02, 0.15)
+    retirement_age_score = normalize_inverted_score(get('计划退休年龄', 65), 55, 70)  # 越早退休越好？
+    target_pension_score = normalize_score(get('目标养老金', 0), 1000000, 5000000)
+    expected_return_score = normalize_score((get('期望收益率下限', 0) + get('期望收益率上限', 0)) / 2, 0.02, 0.15)
     planning_final_score = (risk_score * 0.3) + (retirement_age_score * 0.2) + (target_pension_score * 0.3) + (expected_return_score * 0.2)
 
     # 维度5: 行为与参与度 (Behavior & Engagement)
     # 使用 平台月访问次数, 策略采纳率, 交互问答次数, 反馈积极度, 信任评分
-    visit_score = normalize_score(metrics.get('平台月访问次数', 0), 5, 30)
-    adoption_score = normalize_score(metrics.get('策略采纳率', 0), 0.3, 1.0)
-    interaction_score = normalize_score(metrics.get('交互问答次数', 0), 5, 40)
-    feedback_score = normalize_score(metrics.get('反馈积极度', 0), 0.3, 1.0)
-    trust_score = normalize_score(metrics.get('信任评分', 0), 30, 100)
+    visit_score = normalize_score(get('平台月访问次数', 0), 5, 30)
+    adoption_score = normalize_score(get('策略采纳率', 0), 0.3, 1.0)
+    interaction_score = normalize_score(get('交互问答次数', 0), 5, 40)
+    feedback_score = normalize_score(get('反馈积极度', 0), 0.3, 1.0)
+    trust_score = normalize_score(get('信任评分', 0), 30, 100)
     behavior_final_score = (visit_score * 0.2) + (adoption_score * 0.25) + (interaction_score * 0.2) + (feedback_score * 0.15) + (trust_score * 0.2)
 
+    return financial_final_score, debt_final_score, investment_final_score, planning_final_score, behavior_final_score
+
+def _weighted_total(dimensions):
+    financial, debt, investment, planning, behavior = dimensions
+    return (financial * SCORE_WEIGHTS['financial'] +
+            debt * SCORE_WEIGHTS['debt'] +
+            investment * SCORE_WEIGHTS['investment'] +
+            planning * SCORE_WEIGHTS['planning'] +
+            behavior * SCORE_WEIGHTS['behavior'])
+
+# --- 精细化养老金规划评分模型 ---
+@timed("score")
+def calculate_pension_score(metrics):
+    """
+    根据养老金规划的五大维度，综合多个数据字段计算养老金健康分。
+    每个维度都归一化到0-100分。
+    """
+    risk_score = RISK_PREFERENCE_SCORES.get(metrics.get('风险偏好', '平衡'), 70)
+    dimensions = _score_dimensions(metrics.get, risk_score)
+
     # 总分加权
-    weights = {'financial': 0.3, 'debt': 0.25, 'investment': 0.2, 'planning': 0.15, 'behavior': 0.1}
-    total_score = (financial_final_score * weights['financial'] +
-                   debt_final_score * weights['debt'] +
-                   investment_final_score * weights['investment'] +
-                   planning_final_score * weights['planning'] +
-                   behavior_final_score * weights['behavior'])
+    total_score = _weighted_total(dimensions)
 
     return {
         "total_score": int(total_score),
         "radar_data": {
             "categories": ["财务基础", "负债管理", "投资配置", "风险规划", "行为参与"],
-            "values": [int(financial_final_score), int(debt_final_score), int(investment_final_score), int(planning_final_score), int(behavior_final_score)]
+            "values": [int(v) for v in dimensions]
         },
         "future_prediction": predict_future_pension(metrics)
     }
 
+def calculate_pension_scores_batch(frame: pd.DataFrame) -> np.ndarray:
+    """
+    对整张用户表向量化计算养老金健康总分（不含未来养老金预测），返回整数数组。
+    """
+    def get(column, default):
+        if column not in frame:
+            return default
+        return np.nan_to_num(numeric_column(frame, column), nan=default)
+
+    risk_score = frame['风险偏好'].astype(object).map(RISK_PREFERENCE_SCORES).fillna(70).to_numpy(dtype=np.float64) \
+        if '风险偏好' in frame else 70
+    total = _weighted_total(_score_dimensions(get, risk_score))
+    return np.trunc(total).astype(np.int64)
+
 
 
 def update_user_metrics(user_id: int, updates: Dict[str, Any]) -> bool:
@@ -282,42 +604,8 @@ def update_user_metrics(user_id: int, updates: Dict[str, Any]) -> bool:
     更新用户的健康指标
     """
     try:
-        BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        DATA_PATH = os.path.join(BASE_DIR, '..', 'data', 'mock_data.csv')
-        df = pd.read_csv(DATA_PATH, dtype={'user_id': int})
-
-        # 查找用户数据
-        user_mask = df['user_id'] == user_id
-        if not user_mask.any():
-            # 如果用户不存在，创建新记录
-            new_row = {
-                'user_id': user_id,
-                'age': 40,
-                'MMSE': 25,
-                'PHQ9': 5,
-                'stress_level': 3,
-                'sleep_hours': 7,
-                'daily_steps': 5000,
-                'exercise_minutes': 30,
-                'mood_score': 5,
-                'fatigue_level': 3,
-                'cognitive_symptoms': 0,
-                'alcohol_consumption': 0,
-                'sleep_quality': 3
-            }
-            # 更新新记录
-            for key, value in updates.items():
-                if key in new_row:
-                    new_row[key] = value
-            df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
-        else:
-            # 更新现有记录
-            for key, value in updates.items():
-                if key in df.columns:
-                    df.loc[user_mask, key] = value
-
-        # 保存更新后的数据
-        df.to_csv(DATA_PATH, index=False)
+        _storage.update_health(int(user_id), updates)
+        notify_metrics_changed([user_id])
         return True
     except Exception as e:
         print(f"Error updating user metrics: {e}")
@@ -12,8 +12,19 @@
 """
 from __future__ import annotations
 
+import base64
+import copy
+import math
 from typing import Dict, List, Optional, Tuple
-from .data_service import get_latest_metrics, calculate_pension_score, predict_future_pension, pension_risk_assessment
+
+import numpy as np
+
+from .cache_service import PartitionedLRUCache
+from .timing_service import timed
+from .data_service import (
+    get_latest_metrics, calculate_pension_score, predict_future_pension, pension_risk_assessment,
+    get_metrics_version, register_metrics_listener,
+)
 
 
 def _clamp(v: float, lo: float = 0.0, hi: float = 100.0) -> float:
@@ -172,6 +183,10 @@ def _what_if_config(default_risk: str = "平衡") -> Dict:
     }
 
 
+_WHAT_IF_NUMERIC_PARAMS = ("savings_increase", "investment_increase", "debt_reduction", "retirement_age_adjust")
+
+
+@timed("future_insights")
 def get_future_insights(user_id: int, params: Optional[Dict] = None) -> Optional[Dict]:
     """对外主函数：获取未来洞察数据包。
     params 可传入模拟参数（同 _intervention_effects）。
@@ -234,8 +249,91 @@ def get_future_insights(user_id: int, params: Optional[Dict] = None) -> Optional
     }
 
 
+# --- What-If 模拟结果缓存 ---
+# 滑块按 _what_if_config 的 step 吸附，参数空间小且高度重复；
+# 按用户分区缓存，键为 (指标版本, 吸附后的参数元组)，指标变更时整体失效该用户的条目。
+_simulation_memo = PartitionedLRUCache(max_partitions=2000, max_entries=256, name="future.simulate")
+
+
+def _on_metrics_changed(user_ids: List[int]) -> None:
+    for uid in user_ids:
+        _simulation_memo.invalidate_partition(uid)
+
+
+register_metrics_listener(_on_metrics_changed)
+
+
+_SIMULATE_MAX_DAYS = 365
+
+
+def _snap_value(name: str, value, cfg: Dict) -> float:
+    """校验单个滑块参数并吸附到步长网格上。
+    低于下限的值抛出 ValueError（金额为 0 时 _intervention_effects 会改用默认值，不能截断到 0）；
+    金额类参数的效应在滑块上限之前已封顶，高于上限时截断到上限，结果不变；
+    退休年龄调整的效应在 ±5 年之外仍会变化，高于上限同样抛出 ValueError。
+    """
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a number, got {value!r}") from None
+    if not np.isfinite(value) or value < cfg["min"] or (name == "retirement_age_adjust" and value > cfg["max"]):
+        raise ValueError(f"{name} must be between {cfg['min']} and {cfg['max']}")
+    steps = round((value - cfg["min"]) / cfg["step"])
+    return max(cfg["min"], min(cfg["max"], cfg["min"] + steps * cfg["step"]))
+
+
+def _snap_params(sim_params: Dict) -> Tuple[Dict, Tuple]:
+    """将模拟参数吸附到 _what_if_config 的步长网格上，返回 (吸附后参数, 缓存键)。
+    未传入的参数保持缺省，仍由 _intervention_effects 使用默认值；超出范围的参数见 _snap_value。
+    模拟天数须为 1~_SIMULATE_MAX_DAYS 的整数，越界的请求不会进入缓存。
+    """
+    config = _what_if_config()
+    params = dict(sim_params)
+    key: List = []
+    for name in _WHAT_IF_NUMERIC_PARAMS:
+        value = params.get(name)
+        if value is not None:
+            value = _snap_value(name, value, config[name])
+            params[name] = value
+        key.append(value)
+    key.append(params.get("risk_adjust"))
+    days = params.get("days", 30)
+    if isinstance(days, bool) or not isinstance(days, (int, float, str)):
+        raise ValueError(f"days must be an integer, got {days!r}")
+    try:
+        days = int(days)
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f"days must be an integer, got {days!r}") from None
+    if not 1 <= days <= _SIMULATE_MAX_DAYS:
+        raise ValueError(f"days must be between 1 and {_SIMULATE_MAX_DAYS}")
+    params["days"] = days
+    key.append(days)
+    return params, tuple(key)
+
+
+def get_simulation_cache_stats() -> Dict:
+    """返回 What-If 模拟缓存的命中率统计。"""
+    return _simulation_memo.stats()
+
+
 def simulate_future(user_id: int, sim_params: Dict) -> Optional[Dict]:
-    """What-If 模拟：根据前端传入参数返回新的曲线与画像，并添加每日进展和评分反馈。"""
+    """What-If 模拟：根据前端传入参数返回新的曲线与画像，并添加每日进展和评分反馈。
+    参数先吸附到滑块步长，再按 (用户, 指标版本, 参数) 命中缓存。
+    """
+    params, key = _snap_params(sim_params or {})
+    cache_key = (get_metrics_version(user_id),) + key
+    cached = _simulation_memo.get(int(user_id), cache_key)
+    if cached is None:
+        cached = _simulate_future(user_id, params)
+        if cached is None:
+            return None
+        _simulation_memo.put(int(user_id), cache_key, cached)
+    return copy.deepcopy(cached)
+
+
+@timed("simulate")
+def _simulate_future(user_id: int, sim_params: Dict) -> Optional[Dict]:
+    """simulate_future 的实际计算逻辑（不经过缓存）。"""
     metrics = get_latest_metrics(user_id)
     if not metrics:
         return None
@@ -287,6 +385,151 @@ def simulate_future(user_id: int, sim_params: Dict) -> Optional[Dict]:
     }
 
 
+# --- What-If 参数扫描（一次请求返回整张敏感性网格） ---
+
+_SWEEP_MAX_POINTS = 200000
+_SWEEP_MAX_MONTHS = 120
+_RISK_LEVELS = {"保守": -1.0, "稳健": 0.0, "平衡": 1.0, "积极": 2.0, "激进": 3.0}
+
+
+def _parse_axis(name: str, spec, cfg: Dict) -> Tuple[Optional[List], float, float, int]:
+    """解析坐标轴描述，返回 (显式取值或 None, 起点, 步长, 点数)；范围形式只计算点数，不生成数组。"""
+    if spec is None:
+        return [cfg["default"]], 0.0, 0.0, 1
+    if isinstance(spec, dict) and "values" in spec:
+        spec = spec["values"]
+    if isinstance(spec, (list, tuple)):
+        return list(spec), 0.0, 0.0, len(spec)
+    if name == "risk_adjust":
+        return [spec], 0.0, 0.0, 1
+    if not isinstance(spec, dict):
+        raise ValueError(f"invalid range for {name}")
+    lo = float(spec.get("min", cfg["min"]))
+    hi = float(spec.get("max", cfg["max"]))
+    step = float(spec.get("step", cfg["step"]))
+    if not (np.isfinite(lo) and np.isfinite(hi) and np.isfinite(step)) or step <= 0 or hi < lo:
+        raise ValueError(f"invalid range for {name}")
+    return None, lo, step, int(np.floor((hi - lo) / step + 1e-9)) + 1
+
+
+def _sweep_axis(name: str, parsed: Tuple[Optional[List], float, float, int], cfg: Dict) -> List:
+    """将 _parse_axis 的结果展开为坐标轴取值（调用前已检查网格规模）。
+    支持 {"min", "max", "step"}、{"values": [...]} 或直接传列表；未传则取默认值（单点）。
+    数值轴的每个取值与单点模拟一样经 _snap_value 校验并吸附到滑块步长。
+    """
+    values, lo, step, count = parsed
+    if values is None:
+        values = (lo + step * np.arange(count)).tolist()
+    if not values:
+        raise ValueError(f"empty range for {name}")
+    if name == "risk_adjust":
+        unknown = [v for v in values if v not in cfg["options"]]
+        if unknown:
+            raise ValueError(f"unknown risk_adjust options: {unknown}")
+        return values
+    return [_snap_value(name, v, cfg) for v in values]
+
+
+def _intervention_effects_axes(axes: Dict[str, List], metrics: Dict) -> Dict[str, np.ndarray]:
+    """_intervention_effects 的向量化版本。
+    各参数的效应彼此独立，因此按坐标轴分别计算一维数组，再由调用方广播成网格。
+    取值为 0 时回退默认值的行为与 _intervention_effects 保持一致。
+    """
+    savings = np.asarray(axes["savings_increase"], dtype=float)
+    investment = np.asarray(axes["investment_increase"], dtype=float)
+    debt = np.asarray(axes["debt_reduction"], dtype=float)
+    retirement = np.asarray(axes["retirement_age_adjust"], dtype=float)
+    savings = np.where(savings == 0, 1000.0, savings)
+    investment = np.where(investment == 0, 500.0, investment)
+    debt = np.where(debt == 0, 200.0, debt)
+
+    current_risk = _RISK_LEVELS.get(metrics.get("风险偏好", "平衡"), 1.0)
+    new_risk = np.array([_RISK_LEVELS.get(r, 1.0) for r in axes["risk_adjust"]])
+
+    return {
+        "财务基础": 0.0 + np.minimum(10.0, (savings / 1000.0) * 2.0),
+        "投资配置": 0.0 + np.minimum(8.0, (investment / 500.0) * 1.5),
+        "负债管理": 0.0 + np.minimum(6.0, (debt / 200.0) * 1.2),
+        "退休年龄": np.maximum(-2.0, np.minimum(2.0, retirement * 0.1)),
+        "风险偏好": (new_risk - current_risk) * 0.5,
+    }
+
+
+def _potential_curves_grid(current_score: float, baseline_slope: float, total_delta: np.ndarray,
+                           months: int = 12) -> np.ndarray:
+    """_potential_curve 的向量化版本，返回形状为 total_delta.shape + (months,) 的 uint8 数组。"""
+    v = float(current_score) + np.minimum(6.0, total_delta * 0.5)
+    slope = baseline_slope + ((total_delta / months) + 0.3)
+    out = np.empty(total_delta.shape + (months,), dtype=np.uint8)
+    for m in range(months):
+        v = np.clip(v + slope, 0.0, 100.0)
+        out[..., m] = np.rint(v)
+    return out
+
+
+@timed("sweep")
+def sweep_future(user_id: int, ranges: Optional[Dict] = None, months: int = 12,
+                 encoding: str = "base64") -> Optional[Dict]:
+    """What-If 参数扫描：一次计算整张参数网格上的潜能曲线，供前端本地拖动滑块时直接查表。
+
+    ranges 中每个参数可为 {"min","max","step"}、{"values":[...]} 或列表，
+    未出现的参数固定为默认值。返回的 potentialCurves 是按 axes 顺序（C 顺序）展开的
+    uint8 张量，形状为 shape；encoding="base64" 时为 base64 字符串，否则为嵌套列表。
+    """
+    if not 1 <= months <= _SWEEP_MAX_MONTHS:
+        raise ValueError(f"months must be between 1 and {_SWEEP_MAX_MONTHS}")
+    metrics = get_latest_metrics(user_id)
+    if not metrics:
+        return None
+
+    ranges = ranges or {}
+    config = _what_if_config(str(metrics.get("风险偏好", "平衡")))
+    names = _WHAT_IF_NUMERIC_PARAMS + ("risk_adjust",)
+    parsed = {name: _parse_axis(name, ranges.get(name), config[name]) for name in names}
+    shape = tuple(parsed[name][3] for name in names)
+    # 先用各轴点数（Python 整数，不会溢出）检查网格规模，再生成任何数组
+    if math.prod(shape) * months > _SWEEP_MAX_POINTS * 12:
+        raise ValueError(f"sweep grid too large: {shape}")
+    axes = {name: _sweep_axis(name, parsed[name], config[name]) for name in names}
+
+    score_data = calculate_pension_score(metrics)
+    current_score = float(score_data.get("total_score", 70))
+    risk = _pension_risk_index(metrics)
+    baseline_vals = _baseline_curve(current_score, risk, months)
+    baseline_slope = (baseline_vals[-1] - current_score) / months
+
+    effects = _intervention_effects_axes(axes, metrics)
+    s, i, d, r, k = np.ix_(effects["财务基础"], effects["投资配置"], effects["负债管理"],
+                           effects["退休年龄"], effects["风险偏好"])
+    # 累加顺序与 _intervention_effects 中 by_dim 的求和顺序一致，保证与单点模拟逐位相同
+    total_delta = (((s + d) + i) + ((0.0 + r) + k)) + 0.0
+    curves = _potential_curves_grid(current_score, baseline_slope, total_delta, months)
+
+    if encoding == "base64":
+        payload = base64.b64encode(curves.tobytes(order="C")).decode("ascii")
+    else:
+        payload = curves.tolist()
+
+    return {
+        "userId": int(user_id),
+        "currentScore": int(round(current_score)),
+        "horizonMonths": months,
+        "baselineCurve": baseline_vals,
+        "axes": {name: axes[name] for name in names},
+        "shape": list(shape) + [months],
+        "dtype": "uint8",
+        "encoding": encoding if encoding == "base64" else "list",
+        "potentialCurves": payload,
+        "axisDeltas": {
+            "savings_increase": np.round(effects["财务基础"], 2).tolist(),
+            "investment_increase": np.round(effects["投资配置"], 2).tolist(),
+            "debt_reduction": np.round(effects["负债管理"], 2).tolist(),
+            "retirement_age_adjust": np.round(effects["退休年龄"], 2).tolist(),
+            "risk_adjust": np.round(effects["风险偏好"], 2).tolist(),
+        },
+    }
+
+
 def _generate_feedback(score_increase: float, by_dim: Dict[str, float], days: int) -> str:
     """生成正反馈消息。"""
     if score_increase >= 10:
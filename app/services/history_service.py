@@ -0,0 +1,258 @@
+"""
+对话历史服务
+每个用户的对话记录以追加方式写入本地分段 JSONL 文件（data/chat_history/<用户ID>/<起始序号>.jsonl），
+内存中只为活跃用户保留最近若干轮的环形缓冲区；写盘由后台线程完成，不阻塞对话响应。
+"""
+from __future__ import annotations
+
+import atexit
+import json
+import os
+import queue
+import threading
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_HISTORY_DIR = os.path.join(BASE_DIR, '..', 'data', 'chat_history')
+
+RING_SIZE = 50               # 每个活跃用户在内存中保留的最近轮数
+MAX_ACTIVE_USERS = 1000      # 内存中最多保留的活跃用户数
+SEGMENT_MAX_RECORDS = 1000   # 单个分段文件的最大记录数
+QUEUE_MAX = 10000            # 待写盘队列上限，超出时丢弃写盘（内存中仍保留）
+MAX_PAGE_SIZE = 100
+
+
+class _UserState:
+    __slots__ = ('next_id', 'recent', 'segment_start', 'segment_count')
+
+    def __init__(self, next_id: int, recent: List[Dict], segment_start: int, segment_count: int):
+        self.next_id = next_id
+        self.recent = deque(recent, maxlen=RING_SIZE)
+        self.segment_start = segment_start
+        self.segment_count = segment_count
+
+
+class ChatHistoryStore:
+    """按用户分段的追加写对话日志 + 活跃用户环形缓冲区。"""
+
+    def __init__(self, directory: str = DEFAULT_HISTORY_DIR):
+        self.directory = directory
+        self._users: "OrderedDict[int, _UserState]" = OrderedDict()
+        self._lock = threading.Lock()
+        # 已分配序号但尚未写盘的最大序号，防止用户状态被淘汰后重新加载时序号重复
+        self._pending_max: Dict[int, int] = {}
+        # 每个用户已入队、已写盘的记录数 [入队数, 写盘数]，全部写完后移除；读取时只等待本用户的记录落盘
+        self._queued: Dict[int, List[int]] = {}
+        self._written = threading.Condition(self._lock)
+        self._queue: "queue.Queue" = queue.Queue(maxsize=QUEUE_MAX)
+        self.dropped = 0
+        self._writer = threading.Thread(target=self._write_loop, name='chat-history-writer', daemon=True)
+        self._writer.start()
+
+    # ---------- 文件布局 ----------
+    def _user_dir(self, user_id: int) -> str:
+        return os.path.join(self.directory, str(int(user_id)))
+
+    def _segments(self, user_id: int) -> List[int]:
+        """返回该用户所有分段的起始序号（升序）。"""
+        try:
+            names = os.listdir(self._user_dir(user_id))
+        except FileNotFoundError:
+            return []
+        return sorted(int(n[:-6]) for n in names if n.endswith('.jsonl') and n[:-6].isdigit())
+
+    def _segment_path(self, user_id: int, start: int) -> str:
+        return os.path.join(self._user_dir(user_id), f"{start:012d}.jsonl")
+
+    def _read_segment(self, user_id: int, start: int) -> List[Dict]:
+        records = []
+        try:
+            with open(self._segment_path(user_id, start), encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        try:
+                            records.append(json.loads(line))
+                        except ValueError:
+                            # 进程中断可能留下不完整的最后一行，跳过
+                            continue
+        except FileNotFoundError:
+            pass
+        return records
+
+    # ---------- 用户状态 ----------
+    def _state(self, user_id: int) -> _UserState:
+        """取活跃用户状态（调用方持有锁），不在内存中时从最后一个分段恢复。"""
+        state = self._users.get(user_id)
+        if state is not None:
+            self._users.move_to_end(user_id)
+            return state
+
+        segments = self._segments(user_id)
+        records = self._read_segment(user_id, segments[-1]) if segments else []
+        last_id = max((r.get('id', 0) for r in records), default=segments[-1] - 1 if segments else 0)
+        last_id = max(last_id, self._pending_max.get(user_id, 0))
+        state = _UserState(
+            next_id=last_id + 1,
+            recent=records[-RING_SIZE:],
+            segment_start=segments[-1] if segments else 1,
+            segment_count=len(records),
+        )
+        self._users[user_id] = state
+        while len(self._users) > MAX_ACTIVE_USERS:
+            self._users.popitem(last=False)
+        return state
+
+    # ---------- 写入 ----------
+    def append(self, user_id: int, record: Dict) -> Dict:
+        """追加一条对话记录，立即返回带序号的记录；写盘在后台完成。"""
+        user_id = int(user_id)
+        with self._lock:
+            state = self._state(user_id)
+            entry = dict(record, id=state.next_id)
+            state.next_id += 1
+            if state.segment_count >= SEGMENT_MAX_RECORDS:
+                state.segment_start, state.segment_count = entry['id'], 0
+            state.segment_count += 1
+            state.recent.append(entry)
+            segment = state.segment_start
+            self._pending_max[user_id] = entry['id']
+            self._queued.setdefault(user_id, [0, 0])[0] += 1
+        try:
+            self._queue.put_nowait((user_id, segment, entry))
+        except queue.Full:
+            self._mark_written([user_id])
+            self.dropped += 1
+            print(f"Chat history queue full, dropping persistence for user {user_id}")
+        return entry
+
+    def _write_loop(self) -> None:
+        while True:
+            item = self._queue.get()
+            batch = [item]
+            # 合并积压的记录，按分段文件一次性写入
+            while len(batch) < 500:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write_batch(batch)
+            except Exception as e:
+                print(f"Chat history write error: {e}")
+            finally:
+                self._mark_written([user_id for user_id, _, _ in batch])
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _mark_written(self, user_ids: List[int]) -> None:
+        """记录这些用户的记录已处理完（写盘成功、失败或被丢弃），唤醒等待的读取。"""
+        with self._written:
+            for user_id in user_ids:
+                counts = self._queued.get(user_id)
+                if counts is None:
+                    continue
+                counts[1] += 1
+                if counts[1] >= counts[0]:
+                    del self._queued[user_id]
+            self._written.notify_all()
+
+    def _write_batch(self, batch) -> None:
+        grouped: "OrderedDict[tuple, List[Dict]]" = OrderedDict()
+        for user_id, segment, entry in batch:
+            grouped.setdefault((user_id, segment), []).append(entry)
+        for (user_id, segment), entries in grouped.items():
+            os.makedirs(self._user_dir(user_id), exist_ok=True)
+            with open(self._segment_path(user_id, segment), 'a', encoding='utf-8') as f:
+                f.write(''.join(json.dumps(e, ensure_ascii=False) + '\n' for e in entries))
+            with self._lock:
+                if self._pending_max.get(user_id, 0) <= entries[-1]['id']:
+                    self._pending_max.pop(user_id, None)
+
+    def flush(self) -> None:
+        """等待所有待写记录落盘。"""
+        self._queue.join()
+
+    def flush_user(self, user_id: int) -> None:
+        """等待该用户在调用时已入队的记录落盘，不等待其他用户的积压写入。"""
+        with self._written:
+            counts = self._queued.get(int(user_id))
+            if counts is None:
+                return
+            target = counts[0]
+            # 计数被移除（全部写完）后即使同一用户又有新记录入队，也是新的计数对象
+            self._written.wait_for(lambda: self._queued.get(int(user_id)) is not counts or counts[1] >= target)
+
+    # ---------- 读取 ----------
+    def get_history(self, user_id: int, cursor: Optional[int] = None, limit: int = 20) -> Dict:
+        """按时间倒序分页读取，cursor 为上一页返回的 next_cursor（只返回 id 小于它的记录）。"""
+        user_id = int(user_id)
+        limit = int(min(max(1, limit), MAX_PAGE_SIZE))
+        with self._lock:
+            state = self._state(user_id)
+            recent = list(state.recent)
+            upper = state.next_id if cursor is None else min(int(cursor), state.next_id)
+
+        page = [r for r in reversed(recent) if r['id'] < upper][:limit]
+        # 环形缓冲区中的记录序号连续，更早的记录（< older_than）需从分段文件补齐
+        older_than = min(upper, recent[0]['id']) if recent else upper
+        if len(page) < limit and older_than > 1:
+            self.flush_user(user_id)
+            page.extend(self._read_before(user_id, older_than, limit - len(page)))
+
+        next_cursor = page[-1]['id'] if page and page[-1]['id'] > 1 else None
+        return {'history': page, 'next_cursor': next_cursor}
+
+    def _read_before(self, user_id: int, upper: int, count: int) -> List[Dict]:
+        """从分段文件中倒序读取 id < upper 的最多 count 条记录。"""
+        result: List[Dict] = []
+        for start in reversed(self._segments(user_id)):
+            if start >= upper:
+                continue
+            records = [r for r in self._read_segment(user_id, start) if r.get('id', 0) < upper]
+            result.extend(reversed(records))
+            if len(result) >= count:
+                break
+        return result[:count]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'active_users': len(self._users),
+                'max_active_users': MAX_ACTIVE_USERS,
+                'ring_size': RING_SIZE,
+                'pending_writes': self._queue.qsize(),
+                'dropped': self.dropped,
+            }
+
+
+_store: Optional[ChatHistoryStore] = None
+_store_lock = threading.Lock()
+
+
+def get_history_store() -> ChatHistoryStore:
+    """全局对话历史存储，目录可通过环境变量 PENSION_CHAT_HISTORY_DIR 指定。"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ChatHistoryStore(os.environ.get('PENSION_CHAT_HISTORY_DIR', DEFAULT_HISTORY_DIR))
+                atexit.register(_store.flush)
+    return _store
+
+
+def record_message(user_id: int, result: Dict) -> Dict:
+    """记录一轮已处理的对话（process_user_message 的结果）。"""
+    return get_history_store().append(user_id, {
+        'message': result.get('original_message'),
+        'response': result.get('response'),
+        'timestamp': result.get('timestamp'),
+        'intent': (result.get('intent') or {}).get('intent'),
+        'sentiment': (result.get('sentiment') or {}).get('sentiment'),
+        'health_info': result.get('health_info'),
+    })
+
+
+def get_chat_history(user_id: int, cursor: Optional[int] = None, limit: int = 20) -> Dict:
+    return get_history_store().get_history(user_id, cursor, limit)
@@ -0,0 +1,356 @@
+"""
+用户数据分块导入
+流式读取大体量的用户 CSV / NDJSON 导出文件，每次只处理一个分块：逐列向量化校验类型与取值范围，
+规范化 'U' 前缀的用户ID并补全汇总比例字段，然后写入服务层用户表（及其索引与缓存）。
+每个分块写入后记录已处理到的字节位置，中断后可从断点继续。
+"""
+from __future__ import annotations
+
+import argparse
+import io
+import json
+import os
+import tempfile
+import time
+from typing import IO, Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .schema_service import ID_COLUMN, derive_fields, missing_required, normalize_user_ids
+
+DEFAULT_CHUNK_ROWS = 50_000
+# 报告中保留的错误条数上限（完整错误可写入 errors_path）
+MAX_REPORTED_ERRORS = 1000
+
+# 列 -> (最小值, 最大值)，None 表示不限
+RANGE_RULES: Dict[str, Tuple[Optional[float], Optional[float]]] = {
+    '年龄': (16, 120),
+    '缴纳年限': (0, 60),
+    '计划退休年龄': (40, 80),
+    '储蓄率': (-10, 1),
+    '负债率': (0, 100),
+    '期望收益率下限': (0, 1),
+    '期望收益率上限': (0, 1),
+    '策略采纳率': (0, 1),
+    '反馈积极度': (0, 1),
+    '信任评分': (0, 100),
+    '平台月访问次数': (0, None),
+    '交互问答次数': (0, None),
+    '个性化设置次数': (0, None),
+}
+# 不可为负的金额列
+NON_NEGATIVE_COLUMNS = (
+    '月工资收入', '经营性收入', '被动收入', '月总流入', '月总流出',
+    '活期存款', '理财产品', '股票基金', '房产估值', '总资产',
+    '信用卡欠款', '房贷余额', '其他贷款', '总负债',
+    '养老金账户余额', '住房公积金余额', '商业保险年缴', '保险保额', '目标养老金',
+    '餐饮消费', '衣物消费', '住房消费', '交通消费', '娱乐消费', '教育培训消费',
+    '医疗保健消费', '健身运动消费', '旅行度假消费', '数字产品消费', '宠物消费',
+    '图书影音消费', '美容护肤消费', '线上购物消费', '线下购物消费', '奢侈品消费',
+    '家庭日用品消费', '母婴消费', '绿色环保消费', '慈善捐赠消费',
+)
+NUMERIC_COLUMNS = tuple(dict.fromkeys(list(RANGE_RULES) + list(NON_NEGATIVE_COLUMNS) + ['净资产']))
+ALLOWED_VALUES = {
+    '性别': {'男', '女'},
+    '风险偏好': {'保守', '稳健', '平衡', '积极', '激进'},
+    '健康状况': {'优', '良', '一般', '差'},
+}
+_ID_PATTERN = r'^[Uu]?\d+$'
+
+
+# --- 分块读取 ---
+
+def detect_format(name: str) -> str:
+    return 'ndjson' if name.lower().endswith(('.ndjson', '.jsonl', '.json')) else 'csv'
+
+
+def iter_chunks(stream: IO[bytes], fmt: str, chunk_rows: int = DEFAULT_CHUNK_ROWS,
+                header: Optional[bytes] = None, first_line: int = 1
+                ) -> Iterator[Tuple[pd.DataFrame, List[Dict], int, int]]:
+    """从二进制流中逐块读取，产出 (分块, 解析错误, 下一块的首行行号, 本块结束后的流内字节数)。
+
+    分块的行索引为源文件行号（空行跳过但计入行号）。CSV 的表头在流开头读取（从断点续读时由 header 传入）；
+    所有列先按字符串读入，由校验步骤统一转换。字节数只在整行边界上累计，可直接作为续读的偏移量。
+    """
+    consumed = 0
+    line_no = first_line
+    if fmt == 'csv' and header is None:
+        header = stream.readline()
+        consumed += len(header)
+        line_no += 1
+    while True:
+        lines, numbers = [], []
+        size = 0
+        for raw in stream:
+            size += len(raw)
+            if raw.strip():
+                lines.append(raw)
+                numbers.append(line_no)
+            line_no += 1
+            if len(lines) >= chunk_rows:
+                break
+        if not lines:
+            return
+        consumed += size
+        if fmt == 'csv':
+            frame = pd.read_csv(io.BytesIO(header + b''.join(lines)), dtype=str, keep_default_na=False,
+                                na_values=[''])
+            frame.index = np.asarray(numbers[:len(frame)], dtype=np.int64)
+            yield frame, [], line_no, consumed
+        else:
+            records, errors, index = [], [], []
+            for number, raw in zip(numbers, lines):
+                try:
+                    record = json.loads(raw)
+                    if not isinstance(record, dict):
+                        raise ValueError("not a JSON object")
+                    records.append(record)
+                    index.append(number)
+                except ValueError as e:
+                    errors.append({'line': number, 'userId': None, 'column': None,
+                                   'error': f"invalid JSON: {e}"})
+            frame = pd.DataFrame.from_records(records)
+            frame.index = np.asarray(index, dtype=np.int64)
+            yield frame, errors, line_no, consumed
+
+
+# --- 校验与规范化 ---
+
+def validate_chunk(frame: pd.DataFrame) -> Tuple[pd.DataFrame, List[Dict]]:
+    """向量化校验一个分块，返回 (合格的行, 错误列表)。行索引为源文件行号。
+
+    每条错误包含行号、原始用户ID、列名与原因；有任一错误的行整体剔除，其余行不受影响。
+    """
+    errors: List[Dict] = []
+    bad = np.zeros(len(frame), dtype=bool)
+    if frame.empty:
+        return frame, errors
+    raw_ids = frame[ID_COLUMN].astype(str).str.strip() if ID_COLUMN in frame else pd.Series('', index=frame.index)
+
+    def flag(mask: np.ndarray, column: Optional[str], message: str) -> None:
+        nonlocal bad
+        for pos in np.flatnonzero(mask):
+            errors.append({'line': int(frame.index[pos]), 'userId': raw_ids.iat[pos], 'column': column,
+                           'error': message})
+        bad |= mask
+
+    if ID_COLUMN not in frame:
+        flag(np.ones(len(frame), dtype=bool), ID_COLUMN, "missing user ID column")
+        return frame.iloc[0:0], errors
+    flag(~raw_ids.str.match(_ID_PATTERN).to_numpy(), ID_COLUMN, "invalid user ID")
+
+    numeric = {}
+    for column in NUMERIC_COLUMNS:
+        if column not in frame:
+            continue
+        original = frame[column]
+        values = pd.to_numeric(original, errors='coerce')
+        flag((values.isna() & original.notna()).to_numpy(), column, "not a number")
+        numeric[column] = values
+        lo, hi = RANGE_RULES.get(column, (0, None) if column in NON_NEGATIVE_COLUMNS else (None, None))
+        arr = values.to_numpy(dtype=np.float64)
+        with np.errstate(invalid='ignore'):
+            if lo is not None:
+                flag(arr < lo, column, f"below minimum {lo}")
+            if hi is not None:
+                flag(arr > hi, column, f"above maximum {hi}")
+
+    for column, allowed in ALLOWED_VALUES.items():
+        if column in frame:
+            values = frame[column]
+            flag((values.notna() & ~values.isin(allowed)).to_numpy(), column, "unexpected value")
+
+    valid = frame.loc[~bad].copy()
+    for column, values in numeric.items():
+        valid[column] = values.loc[~bad]
+    # 其余数值列（不在校验规则中）也转为数字，无法解析的置空
+    for column in valid.columns:
+        if column != ID_COLUMN and column not in numeric and column not in ALLOWED_VALUES:
+            converted = pd.to_numeric(valid[column], errors='coerce')
+            if converted.notna().sum() == valid[column].notna().sum():
+                valid[column] = converted
+    return valid, errors
+
+
+def normalize_chunk(frame: pd.DataFrame) -> pd.DataFrame:
+    """规范化用户ID（去掉 U 前缀转为整数），补全缺失的汇总与比例字段。"""
+    frame[ID_COLUMN] = normalize_user_ids(frame[ID_COLUMN])
+    return derive_fields(frame, only_missing=True)
+
+
+# --- 断点 ---
+
+def _default_checkpoint(path: str) -> str:
+    return path + '.ingest.json'
+
+
+def _load_checkpoint(path: str, checkpoint: str) -> Optional[Dict]:
+    try:
+        with open(checkpoint, encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    # 源文件被截短或换成了其他文件时不能续读
+    if state.get('source') != os.path.abspath(path) or state.get('offset', 0) > os.path.getsize(path):
+        return None
+    return state
+
+
+def _save_checkpoint(checkpoint: str, state: Dict) -> None:
+    directory = os.path.dirname(os.path.abspath(checkpoint))
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp, checkpoint)
+
+
+# --- 导入 ---
+
+def _default_sink(frame: pd.DataFrame) -> Dict[str, int]:
+    from .data_service import upsert_users
+    return upsert_users(frame)
+
+
+def ingest_stream(stream: IO[bytes], fmt: str, chunk_rows: int = DEFAULT_CHUNK_ROWS,
+                  sink: Callable[[pd.DataFrame], Dict[str, int]] = None,
+                  on_chunk: Optional[Callable[[Dict], None]] = None, header: Optional[bytes] = None,
+                  first_line: int = 1, errors_file: Optional[IO[str]] = None) -> Dict[str, Any]:
+    """逐块校验、规范化并写入 sink（默认写入服务层用户表），返回汇总报告。
+
+    on_chunk 在每个分块写入后调用，参数包含累计计数、流内字节偏移与下一行行号，可用于进度显示与断点记录。
+    """
+    sink = sink or _default_sink
+    report: Dict[str, Any] = {'rows': 0, 'accepted': 0, 'rejected': 0, 'inserted': 0, 'updated': 0,
+                              'chunks': 0, 'errors': []}
+    for frame, parse_errors, next_line, consumed in iter_chunks(stream, fmt, chunk_rows, header, first_line):
+        valid, errors = validate_chunk(frame)
+        errors = parse_errors + errors
+        accepted = len(valid)
+        if not valid.empty:
+            raw_ids = valid[ID_COLUMN].astype(str).str.strip()
+            normalized = normalize_chunk(valid)
+            result = sink(normalized)
+            report['inserted'] += result.get('inserted', 0)
+            report['updated'] += result.get('updated', 0)
+            # sink 拒绝的新用户（缺少必填列）按行号报告
+            rejected = result.get('rejected') or []
+            if rejected:
+                lines = pd.Series(normalized.index, index=normalized[ID_COLUMN].to_numpy())
+                lines = lines[~lines.index.duplicated(keep='last')]
+                for item in rejected:
+                    line = int(lines[item['userId']])
+                    errors.append({'line': line, 'userId': raw_ids[line], 'column': ', '.join(item['missing']),
+                                   'error': "missing required columns for new user"})
+                accepted -= len(rejected)
+        rejected_lines = {e['line'] for e in errors}
+        report['rows'] += len(frame) + len(parse_errors)
+        report['accepted'] += accepted
+        report['rejected'] += len(rejected_lines)
+        report['chunks'] += 1
+        room = MAX_REPORTED_ERRORS - len(report['errors'])
+        if room > 0:
+            report['errors'].extend(errors[:room])
+        if errors_file is not None:
+            for error in errors:
+                errors_file.write(json.dumps(error, ensure_ascii=False) + '\n')
+        if on_chunk:
+            on_chunk({**{k: v for k, v in report.items() if k != 'errors'}, 'offset': consumed, 'line': next_line})
+    return report
+
+
+def ingest_file(path: str, chunk_rows: int = DEFAULT_CHUNK_ROWS, resume: bool = True,
+                checkpoint: Optional[str] = None, errors_path: Optional[str] = None,
+                sink: Callable[[pd.DataFrame], Dict[str, int]] = None,
+                progress: Optional[Callable[[Dict], None]] = None) -> Dict[str, Any]:
+    """导入一个 CSV / NDJSON 文件。每个分块写入后更新断点文件，resume=True 时从上次的位置继续；
+    全部完成后删除断点文件。峰值内存只与 chunk_rows 有关。"""
+    fmt = detect_format(path)
+    checkpoint = checkpoint or _default_checkpoint(path)
+    total_bytes = os.path.getsize(path)
+    state = _load_checkpoint(path, checkpoint) if resume else None
+    started = time.monotonic()
+
+    with open(path, 'rb') as stream:
+        header = None
+        base = {'offset': 0, 'line': 1, 'rows': 0, 'accepted': 0, 'rejected': 0, 'inserted': 0,
+                'updated': 0, 'chunks': 0}
+        if state:
+            base.update({k: state[k] for k in base if k in state})
+            if fmt == 'csv':
+                header = stream.readline()
+            stream.seek(base['offset'])
+        start_offset = base['offset']
+
+        def on_chunk(done: Dict) -> None:
+            current = {k: base[k] + done[k] for k in ('rows', 'accepted', 'rejected', 'inserted', 'updated', 'chunks')}
+            current['line'] = done['line']
+            current['offset'] = start_offset + done['offset']
+            _save_checkpoint(checkpoint, {'source': os.path.abspath(path), **current})
+            if progress:
+                elapsed = time.monotonic() - started
+                progress({**current, 'total_bytes': total_bytes,
+                          'fraction': current['offset'] / total_bytes if total_bytes else 1.0,
+                          'rows_per_second': round(done['rows'] / elapsed, 1) if elapsed else None})
+
+        errors_file = open(errors_path, 'a', encoding='utf-8') if errors_path else None
+        try:
+            report = ingest_stream(stream, fmt, chunk_rows, sink, on_chunk, header,
+                                   first_line=base['line'], errors_file=errors_file)
+        finally:
+            if errors_file is not None:
+                errors_file.close()
+
+    for key in ('rows', 'accepted', 'rejected', 'inserted', 'updated', 'chunks'):
+        report[key] += base[key]
+    report['resumed_from'] = start_offset
+    report['seconds'] = round(time.monotonic() - started, 3)
+    if os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    return report
+
+
+class CsvSink:
+    """把规范化后的行追加写入 CSV（命令行模式用于产出可直接加载的干净数据）。"""
+
+    def __init__(self, path: str, append: bool = False):
+        self.path = path
+        self._header = not (append and os.path.exists(path) and os.path.getsize(path) > 0)
+        if self._header:
+            open(path, 'w').close()
+
+    def __call__(self, frame: pd.DataFrame) -> Dict[str, Any]:
+        # 输出文件中的每一行都是新用户，同样要求必填列齐全
+        missing = missing_required(frame)
+        complete = np.array([not m for m in missing], dtype=bool)
+        rejected = [{'userId': int(uid), 'missing': m} for uid, m in zip(frame[ID_COLUMN], missing) if m]
+        frame = derive_fields(frame[complete].copy())
+        frame[ID_COLUMN] = 'U' + frame[ID_COLUMN].astype(str).str.zfill(6)
+        frame.to_csv(self.path, mode='a', header=self._header, index=False, encoding='utf-8')
+        self._header = False
+        return {'inserted': len(frame), 'updated': 0, 'rejected': rejected}
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='分块校验并导入用户数据（CSV / NDJSON）')
+    parser.add_argument('input', help='CSV 或 NDJSON 文件')
+    parser.add_argument('--output', required=True, help='校验、规范化后的 CSV 输出路径')
+    parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS)
+    parser.add_argument('--errors', help='逐行错误输出（NDJSON）')
+    parser.add_argument('--no-resume', action='store_true', help='忽略断点，从头导入')
+    args = parser.parse_args(argv)
+
+    def report_progress(p: Dict) -> None:
+        print(f"{p['fraction']:.1%}  rows {p['rows']}  accepted {p['accepted']}  rejected {p['rejected']}  "
+              f"({p['rows_per_second']} rows/s)", flush=True)
+
+    state = None if args.no_resume else _load_checkpoint(args.input, _default_checkpoint(args.input))
+    sink = CsvSink(args.output, append=state is not None)
+    report = ingest_file(args.input, args.chunk_rows, resume=not args.no_resume, errors_path=args.errors,
+                         sink=sink, progress=report_progress)
+    report.pop('errors')
+    print(json.dumps(report, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
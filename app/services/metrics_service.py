@@ -0,0 +1,250 @@
+"""
+运行指标服务
+以 Prometheus 文本格式导出请求延迟直方图、在途请求数、分阶段耗时、模型训练次数、数据集加载耗时与缓存命中率。
+每个指标按线程分片累加：记录时只写本线程的分片，无需加锁；导出时再汇总所有分片。
+"""
+from __future__ import annotations
+
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .cache_service import get_cache_stats
+from .timing_service import register_stage_observer
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 被计量的蓝图，其余请求归入 other
+BLUEPRINTS = ('dashboard', 'future', 'recommendation', 'assistant', 'knowledge', 'similar')
+
+
+class _ShardedValues:
+    """按线程分片的一组浮点累加值。线程结束后其分片并入 retired，避免线程频繁创建时分片无限增长。"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards: List[Tuple[threading.Thread, List[float]]] = []
+        self._retired = [0.0] * size
+
+    def mine(self) -> List[float]:
+        values = getattr(self._local, 'values', None)
+        if values is None:
+            values = [0.0] * self.size
+            with self._lock:
+                self._shards.append((threading.current_thread(), values))
+            self._local.values = values
+        return values
+
+    def snapshot(self) -> List[float]:
+        with self._lock:
+            alive = []
+            for thread, values in self._shards:
+                if thread.is_alive():
+                    alive.append((thread, values))
+                else:
+                    self._retired = [a + b for a, b in zip(self._retired, values)]
+            self._shards = alive
+            total = list(self._retired)
+            for _, values in alive:
+                total = [a + b for a, b in zip(total, values)]
+        return total
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], _ShardedValues] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _values_size(self) -> int:
+        return 1
+
+    def _child(self, labels: Tuple[str, ...]) -> _ShardedValues:
+        child = self._children.get(labels)
+        if child is None:
+            with self._lock:
+                child = self._children.get(labels)
+                if child is None:
+                    child = _ShardedValues(self._values_size())
+                    self._children[labels] = child
+        return child
+
+    def _label_text(self, labels: Tuple[str, ...], extra: Optional[Tuple[str, str]] = None) -> str:
+        pairs = list(zip(self.labelnames, labels))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ''
+        escaped = (v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+        return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+    def expose(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labels, child in sorted(self._children.items()):
+            lines.extend(self._sample_lines(labels, child.snapshot()))
+        return lines
+
+    def _sample_lines(self, labels, values) -> List[str]:
+        return [f"{self.name}{self._label_text(labels)} {_format(values[0])}"]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        self._child(labels).mine()[0] += amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        self._child(labels).mine()[0] += amount
+
+    def dec(self, *labels: str, amount: float = 1.0) -> None:
+        self._child(labels).mine()[0] -= amount
+
+
+class LastValueGauge(_Metric):
+    """记录最近一次设置的值（如数据集加载耗时），设置频率低，直接加锁。"""
+    kind = 'gauge'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, *labels: str, value: float) -> None:
+        with self._lock:
+            self._values[labels] = float(value)
+
+    def expose(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        lines.extend(f"{self.name}{self._label_text(labels)} {_format(v)}" for labels, v in items)
+        return lines
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _values_size(self) -> int:
+        # 各桶计数（含 +Inf）、总和、次数
+        return len(self.buckets) + 3
+
+    def observe(self, *labels: str, value: float) -> None:
+        values = self._child(labels).mine()
+        values[bisect_left(self.buckets, value)] += 1
+        values[-2] += value
+        values[-1] += 1
+
+    def _sample_lines(self, labels, values) -> List[str]:
+        lines = []
+        cumulative = 0.0
+        for bound, count in zip(self.buckets + (float('inf'),), values):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else _format(bound)
+            lines.append(f"{self.name}_bucket{self._label_text(labels, ('le', le))} {_format(cumulative)}")
+        lines.append(f"{self.name}_sum{self._label_text(labels)} {_format(values[-2])}")
+        lines.append(f"{self.name}_count{self._label_text(labels)} {_format(values[-1])}")
+        return lines
+
+
+def _format(value: float) -> str:
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+_registry: List[_Metric] = []
+
+REQUEST_LATENCY = Histogram('pension_http_request_duration_seconds', 'HTTP request latency by blueprint',
+                            ('blueprint', 'method'))
+REQUESTS_TOTAL = Counter('pension_http_requests_total', 'HTTP requests by blueprint and status class',
+                         ('blueprint', 'status'))
+IN_FLIGHT = Gauge('pension_http_requests_in_flight', 'HTTP requests currently being served', ('blueprint',))
+STAGE_LATENCY = Histogram('pension_stage_duration_seconds', 'Service stage duration (model inference etc.)',
+                          ('stage',))
+MODEL_TRAININGS = Counter('pension_model_trainings_total', 'Model (re)training count', ('model',))
+DATASET_LOAD = LastValueGauge('pension_dataset_load_seconds', 'Duration of the most recent dataset load',
+                              ('dataset',))
+
+
+def record_model_training(model: str) -> None:
+    MODEL_TRAININGS.inc(model)
+
+
+def record_dataset_load(dataset: str, seconds: float) -> None:
+    DATASET_LOAD.set(dataset, value=seconds)
+
+
+register_stage_observer(lambda stage, seconds: STAGE_LATENCY.observe(stage, value=seconds))
+
+
+def _cache_lines() -> List[str]:
+    stats = get_cache_stats()
+    lines = []
+    for metric, kind, doc, key in (
+        ('pension_cache_hits_total', 'counter', 'Cache hits', 'hits'),
+        ('pension_cache_misses_total', 'counter', 'Cache misses', 'misses'),
+        ('pension_cache_hit_ratio', 'gauge', 'Cache hit ratio since start', 'hit_rate'),
+    ):
+        lines.append(f"# HELP {metric} {doc}")
+        lines.append(f"# TYPE {metric} {kind}")
+        for name, values in sorted(stats.items()):
+            lines.append(f'{metric}{{cache="{name}"}} {_format(values.get(key, 0))}')
+    return lines
+
+
+def render_metrics() -> str:
+    """导出全部指标（Prometheus 文本格式 0.0.4）。"""
+    lines: List[str] = []
+    for metric in _registry:
+        lines.extend(metric.expose())
+    lines.extend(_cache_lines())
+    return '\n'.join(lines) + '\n'
+
+
+def init_app(app) -> None:
+    """为 Flask 应用记录请求延迟、请求数与在途请求数。"""
+    from flask import g, request
+
+    def blueprint_label() -> str:
+        return request.blueprint if request.blueprint in BLUEPRINTS else 'other'
+
+    @app.before_request
+    def _start_metrics():
+        g.metrics_blueprint = blueprint_label()
+        g.metrics_start = time.perf_counter()
+        IN_FLIGHT.inc(g.metrics_blueprint)
+
+    @app.after_request
+    def _count_response(response):
+        blueprint = g.get('metrics_blueprint')
+        if blueprint is not None:
+            REQUESTS_TOTAL.inc(blueprint, f"{response.status_code // 100}xx")
+            g.metrics_counted = True
+        return response
+
+    @app.teardown_request
+    def _finish_metrics(exc):
+        blueprint = g.pop('metrics_blueprint', None)
+        if blueprint is None:
+            return
+        IN_FLIGHT.dec(blueprint)
+        REQUEST_LATENCY.observe(blueprint, request.method, value=time.perf_counter() - g.pop('metrics_start'))
+        # 未处理的异常通常已由错误响应经 after_request 计数；异常直接向上抛出（未生成响应）时才在此计数
+        if exc is not None and not g.pop('metrics_counted', False):
+            REQUESTS_TOTAL.inc(blueprint, '5xx')
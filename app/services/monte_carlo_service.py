@@ -0,0 +1,175 @@
+"""
+蒙特卡洛退休结果模拟服务
+基于用户的储蓄能力、期望收益率区间与计划退休年龄，批量模拟收益路径，
+给出达到目标养老金的概率以及各年份的分位数区间。
+"""
+from __future__ import annotations
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_SEED = 42
+DEFAULT_PERCENTILES = (5, 25, 50, 75, 95)
+MAX_PATHS = 200000
+
+# 期望收益率上下限视为年化收益的 90% 置信区间
+_Z_90 = 1.6448536269514722
+
+
+def _simulation_inputs(metrics: Dict) -> Dict[str, float]:
+    """从用户指标推导模拟参数。"""
+    age = float(metrics.get('年龄', 40) or 40)
+    retire_age = float(metrics.get('计划退休年龄', 65) or 65)
+    inflow = float(metrics.get('月总流入', 0) or 0)
+    savings_rate = float(metrics.get('储蓄率', 0) or 0)
+    low = float(metrics.get('期望收益率下限', 0.03) or 0.03)
+    high = float(metrics.get('期望收益率上限', 0.08) or 0.08)
+    if high < low:
+        low, high = high, low
+    return {
+        'years': int(max(0, round(retire_age - age))),
+        'contribution': max(0.0, inflow * savings_rate),
+        'initial': max(0.0, float(metrics.get('养老金账户余额', 0) or 0)),
+        'target': float(metrics.get('目标养老金', 0) or 0),
+        'expected_return': (low + high) / 2,
+        'volatility': (high - low) / (2 * _Z_90),
+        'age': age,
+    }
+
+
+def _simulate_chunk(inputs: Dict[str, float], n_paths: int, rng: np.random.Generator) -> np.ndarray:
+    """模拟一批路径，返回形状 (n_paths, years) 的年末余额（float32）。
+    按月复利：月度对数收益服从正态分布，每月末追加定投。
+    """
+    years = inputs['years']
+    mu_m = np.log1p(inputs['expected_return']) / 12
+    sigma_m = inputs['volatility'] / np.sqrt(12)
+    drift = mu_m - 0.5 * sigma_m ** 2
+
+    wealth = np.full(n_paths, inputs['initial'], dtype=np.float64)
+    yearly = np.empty((n_paths, years), dtype=np.float32)
+    for year in range(years):
+        growth = np.exp(drift + sigma_m * rng.standard_normal((12, n_paths)))
+        for month in range(12):
+            wealth *= growth[month]
+            wealth += inputs['contribution']
+        yearly[:, year] = wealth
+    return yearly
+
+
+def simulate_retirement_outcomes(
+    metrics: Dict,
+    n_paths: int = 20000,
+    seed: Optional[int] = DEFAULT_SEED,
+    chunk_size: int = 5000,
+    percentiles: Sequence[float] = DEFAULT_PERCENTILES,
+) -> Dict:
+    """对单个用户做蒙特卡洛退休模拟。
+
+    每个分块使用由 (seed, 用户ID, 分块序号) 派生的独立随机流，结果在参数相同时可复现；
+    分块控制随机数组的峰值内存，只保留每条路径的年末余额用于计算分位数区间。
+    """
+    n_paths = int(min(max(1, n_paths), MAX_PATHS))
+    chunk_size = int(max(1, chunk_size))
+    inputs = _simulation_inputs(metrics)
+    years = inputs['years']
+    user_id = int(metrics.get('用户ID', 0) or 0)
+
+    if years == 0:
+        yearly = np.full((n_paths, 1), inputs['initial'], dtype=np.float32)
+    else:
+        yearly = np.empty((n_paths, years), dtype=np.float32)
+        entropy = DEFAULT_SEED if seed is None else int(seed)
+        for index, start in enumerate(range(0, n_paths, chunk_size)):
+            size = min(chunk_size, n_paths - start)
+            rng = np.random.default_rng(np.random.SeedSequence([entropy, user_id, index]))
+            yearly[start:start + size] = _simulate_chunk(inputs, size, rng)
+
+    final = yearly[:, -1]
+    bands = np.percentile(yearly, percentiles, axis=0)
+    final_pct = np.percentile(final, percentiles)
+    start_age = int(round(inputs['age']))
+
+    return {
+        'userId': user_id,
+        'nPaths': n_paths,
+        'seed': seed,
+        'years': years,
+        'targetPension': round(inputs['target'], 2),
+        'monthlyContribution': round(inputs['contribution'], 2),
+        'expectedReturn': round(inputs['expected_return'], 4),
+        'volatility': round(inputs['volatility'], 4),
+        'successProbability': round(float(np.mean(final >= inputs['target'])), 4),
+        'finalPercentiles': {f"p{int(p)}": round(float(v), 2) for p, v in zip(percentiles, final_pct)},
+        'percentileBands': {
+            'ages': [start_age + i + 1 for i in range(yearly.shape[1])],
+            **{f"p{int(p)}": np.round(band, 2).tolist() for p, band in zip(percentiles, bands)},
+        },
+    }
+
+
+def _summarize_users(records: List[Dict], n_paths: int, seed: Optional[int], chunk_size: int) -> List[Dict]:
+    """进程池任务：模拟一批用户，只返回汇总结果以减少进程间传输。"""
+    rows = []
+    for metrics in records:
+        result = simulate_retirement_outcomes(metrics, n_paths=n_paths, seed=seed, chunk_size=chunk_size)
+        row = {'用户ID': result['userId'], 'successProbability': result['successProbability']}
+        row.update(result['finalPercentiles'])
+        rows.append(row)
+    return rows
+
+
+def _batches(frame: pd.DataFrame, batch_size: int) -> Iterable[List[Dict]]:
+    for start in range(0, len(frame), batch_size):
+        yield frame.iloc[start:start + batch_size].to_dict('records')
+
+
+def simulate_all_users(
+    frame: Optional[pd.DataFrame] = None,
+    n_paths: int = 10000,
+    seed: Optional[int] = DEFAULT_SEED,
+    chunk_size: int = 5000,
+    workers: Optional[int] = None,
+    batch_size: int = 50,
+) -> pd.DataFrame:
+    """对全部用户批量模拟，按用户批次分发到进程池。
+    每个用户的随机流只取决于 (seed, 用户ID)，因此结果与进程数和批次划分无关。
+    """
+    if frame is None:
+        from .data_service import df as frame
+    if frame.empty:
+        return pd.DataFrame()
+
+    batches = _batches(frame, batch_size)
+    if workers == 1:
+        results = [_summarize_users(b, n_paths, seed, chunk_size) for b in batches]
+    else:
+        task = partial(_summarize_users, n_paths=n_paths, seed=seed, chunk_size=chunk_size)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(task, batches))
+    return pd.DataFrame([row for rows in results for row in rows])
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='对全部用户运行蒙特卡洛退休模拟')
+    parser.add_argument('--paths', type=int, default=10000, help='每个用户的模拟路径数')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--output', default='monte_carlo_summary.csv')
+    args = parser.parse_args(argv)
+
+    summary = simulate_all_users(n_paths=args.paths, seed=args.seed,
+                                 chunk_size=args.chunk_size, workers=args.workers)
+    summary.to_csv(args.output, index=False)
+    print(f"Simulated {len(summary)} users -> {args.output}")
+
+
+if __name__ == '__main__':
+    main()
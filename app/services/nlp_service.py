@@ -1,7 +1,19 @@
 from sklearn.feature_extraction.text import TfidfVectorizer
+import copy
 import re
+import unicodedata
+from datetime import datetime, timezone
 from typing import Dict, List, Any
 
+from .cache_service import LRUCache
+from .history_service import record_message
+from .session_service import get_session_context, update_session_context
+from .timing_service import timed
+from .tokenizer_service import ngrams, register_words, segment
+
+# 与用户画像无关的消息分析结果缓存，键为规范化后的消息文本
+_analysis_cache = LRUCache(4096, name="nlp.analysis")
+
 # 模拟一个简单的停用词表
 STOP_WORDS = ['的', '了', '很', '我', '有点', '今天', '感觉', '觉得', '想', '要', '会', '能', '可以']
 
@@ -19,15 +31,52 @@ INTENT_KEYWORDS = {
 POSITIVE_WORDS = ['开心', '快乐', '好', '棒', '优秀', '进步', '改善', '自信', '放松', '满意']
 NEGATIVE_WORDS = ['难过', '焦虑', '担心', '压力', '疲劳', '痛苦', '困难', '糟糕', '沮丧', '紧张']
 
+# 健康信息提取关键词
+HEALTH_KEYWORDS = {
+    'fatigue': ['累', '疲劳', '疲惫', '没力气', '困', '乏力', '虚弱'],
+    'energy': ['精神好', '精力充沛', '有活力', '清醒', '兴奋'],
+    'dizziness': ['头晕', '眩晕', '头痛', '记忆力差', '注意力不集中', '思维混乱'],
+    'alcohol': ['喝酒', '饮酒', '喝了酒', '喝酒了', '醉', '宿醉'],
+    'exercise': ['运动', '锻炼', '跑步', '健身', '瑜伽', '散步', '骑车', '游泳'],
+    'poor_sleep': ['睡不着', '失眠', '睡眠不好', '睡得浅', '做梦多'],
+    'good_sleep': ['睡得好', '睡眠质量好', '休息充分'],
+    'stress': ['压力大', '焦虑', '紧张', '担心', '烦躁', '不安'],
+    'relaxed': ['放松', '平静', '舒适', '安心'],
+    'good_mood': ['开心', '快乐', '满意', '兴奋'],
+    'bad_mood': ['难过', '沮丧', '失望', '生气', '郁闷'],
+}
+
+# 关键词并入分词词典，保证按词边界匹配（如"困难"不会命中"困"）
+register_words(
+    STOP_WORDS + POSITIVE_WORDS + NEGATIVE_WORDS
+    + [w for words in INTENT_KEYWORDS.values() for w in words]
+    + [w for words in HEALTH_KEYWORDS.values() for w in words]
+)
+
+def token_grams(text: str) -> set:
+    """
+    可匹配关键词的片段集合：相邻词拼出的片段，以及各词不短于两个字的前缀（如"记忆力"可命中"记忆"）。
+    单字关键词只能与完整的词相同才算命中
+    """
+    tokens = segment(text.lower())
+    grams = ngrams(tokens)
+    for token in tokens:
+        grams.update(token[:k] for k in range(2, len(token)))
+    return grams
+
+def _tag_terms(text: str) -> List[str]:
+    """标签候选词：去掉停用词与单字词"""
+    return [w for w in segment(text.lower()) if len(w) > 1 and w not in STOP_WORDS]
+
 def analyze_intent(text: str) -> Dict[str, Any]:
     """
     简单的意图识别
     """
-    text_lower = text.lower()
+    grams = token_grams(text)
 
     intent_scores = {}
     for intent, keywords in INTENT_KEYWORDS.items():
-        score = sum(1 for keyword in keywords if keyword in text_lower)
+        score = sum(1 for keyword in keywords if keyword in grams)
         if score > 0:
             intent_scores[intent] = score
 
@@ -47,12 +96,13 @@ def analyze_sentiment(text: str) -> Dict[str, Any]:
     """
     简单的情感分析
     """
-    text_lower = text.lower()
+    tokens = segment(text.lower())
+    grams = token_grams(text)
 
-    positive_score = sum(1 for word in POSITIVE_WORDS if word in text_lower)
-    negative_score = sum(1 for word in NEGATIVE_WORDS if word in text_lower)
+    positive_score = sum(1 for word in POSITIVE_WORDS if word in grams)
+    negative_score = sum(1 for word in NEGATIVE_WORDS if word in grams)
 
-    total_words = len(text.split())
+    total_words = len(tokens)
     if total_words == 0:
         return {'sentiment': 'neutral', 'score': 0.0}
 
@@ -77,6 +127,7 @@ def analyze_sentiment(text: str) -> Dict[str, Any]:
         'negative_words': negative_score
     }
 
+@timed("response")
 def generate_response(intent: str, sentiment: str, user_profile: str, context: Dict[str, Any] = None, health_info: Dict[str, Any] = None) -> str:
     """
     基于意图、情感、健康信息和用户画像生成智能回复
@@ -138,20 +189,61 @@ def generate_response(intent: str, sentiment: str, user_profile: str, context: D
         if personalized_tips:
             response += "\n\n" + " ".join(personalized_tips[:2])  # 最多显示2条建议
 
+    # 基于会话上下文（之前几轮）补充趋势提示
+    if context:
+        trend_tip = _context_tip(intent, sentiment, context, health_info)
+        if trend_tip:
+            response += "\n\n" + trend_tip
+
     return response
 
+def _context_tip(intent: str, sentiment: str, context: Dict[str, Any], health_info: Dict[str, Any] = None) -> str:
+    """
+    根据最近几轮的情感、意图与健康信号趋势给出一条提示
+    """
+    health_info = health_info or {}
+    trends = context.get('health_trends', {})
+
+    # 连续多轮情绪低落
+    if sentiment == 'negative' and context.get('negative_streak', 0) >= 2:
+        return "最近几次交流中您的情绪都比较低落，如果这种状态持续，建议和家人朋友或专业人士聊一聊。"
+
+    # 反复提到症状
+    if intent == 'symptom_report' and context.get('intent_counts', {}).get('symptom_report', 0) >= 2:
+        return "您已经多次提到身体不适，建议尽快安排一次体检，把症状的变化记录下来带给医生参考。"
+
+    # 本轮未提及但近期压力/疲劳持续偏高
+    if 'stress_level' not in health_info and trends.get('stress_level', 0) > 5:
+        return "您近期的压力水平一直偏高，记得给自己留出放松的时间。"
+    if 'fatigue_level' not in health_info and trends.get('fatigue_level', 0) > 5:
+        return "您近期多次提到疲劳，注意保证睡眠和规律作息。"
+
+    # 情绪由低落转好
+    recent = context.get('recent_sentiments', [])
+    if sentiment == 'positive' and recent and recent[-1] == 'negative':
+        return "很高兴看到您的心情比之前好了一些！"
+
+    return ""
+
+@timed("tags")
 def generate_tags(user_profile, text):
     """
     增强版NLP标签生成。
     以用户画像为主标签，并从文本中提取关键词。
     """
-    tag_list = [{"text": user_profile, "value": 1000}]
+    return [{"text": user_profile, "value": 1000}] + _keyword_tags(text)
+
+def _keyword_tags(text):
+    """
+    用TF-IDF从文本中提取关键词标签（与用户画像无关）
+    """
+    tag_list = []
 
     if not text:
         return tag_list
 
     try:
-        vectorizer = TfidfVectorizer(stop_words=STOP_WORDS, max_features=10)
+        vectorizer = TfidfVectorizer(analyzer=_tag_terms, max_features=10)
         tfidf_matrix = vectorizer.fit_transform([text])
         feature_names = vectorizer.get_feature_names_out()
         scores = tfidf_matrix.toarray()[0]
@@ -171,80 +263,114 @@ def extract_health_info(text: str) -> Dict[str, Any]:
     """
     从用户消息中提取健康相关信息，用于更新用户画像
     """
-    text_lower = text.lower()
+    grams = token_grams(text)
     health_updates = {}
 
-    # 疲劳和精力水平
-    fatigue_keywords = ['累', '疲劳', '疲惫', '没力气', '困', '乏力', '虚弱']
-    energy_keywords = ['精神好', '精力充沛', '有活力', '清醒', '兴奋']
+    def mentions(group):
+        return any(keyword in grams for keyword in HEALTH_KEYWORDS[group])
 
-    if any(keyword in text_lower for keyword in fatigue_keywords):
+    # 疲劳和精力水平
+    if mentions('fatigue'):
         health_updates['fatigue_level'] = min(health_updates.get('fatigue_level', 0) + 2, 10)
-    if any(keyword in text_lower for keyword in energy_keywords):
+    if mentions('energy'):
         health_updates['fatigue_level'] = max(health_updates.get('fatigue_level', 5) - 2, 0)
 
     # 头晕和认知症状
-    dizziness_keywords = ['头晕', '眩晕', '头痛', '记忆力差', '注意力不集中', '思维混乱']
-    if any(keyword in text_lower for keyword in dizziness_keywords):
+    if mentions('dizziness'):
         health_updates['cognitive_symptoms'] = min(health_updates.get('cognitive_symptoms', 0) + 1, 5)
 
     # 饮酒
-    alcohol_keywords = ['喝酒', '饮酒', '喝了酒', '喝酒了', '醉', '宿醉']
-    if any(keyword in text_lower for keyword in alcohol_keywords):
+    if mentions('alcohol'):
         health_updates['alcohol_consumption'] = min(health_updates.get('alcohol_consumption', 0) + 1, 7)  # 过去7天饮酒天数
 
     # 运动
-    exercise_keywords = ['运动', '锻炼', '跑步', '健身', '瑜伽', '散步', '骑车', '游泳']
-    if any(keyword in text_lower for keyword in exercise_keywords):
+    if mentions('exercise'):
         health_updates['exercise_minutes'] = health_updates.get('exercise_minutes', 0) + 30  # 假设每次提到增加30分钟
 
     # 睡眠质量
-    sleep_keywords = ['睡不着', '失眠', '睡眠不好', '睡得浅', '做梦多']
-    good_sleep_keywords = ['睡得好', '睡眠质量好', '休息充分']
-    if any(keyword in text_lower for keyword in sleep_keywords):
+    if mentions('poor_sleep'):
         health_updates['sleep_quality'] = max(health_updates.get('sleep_quality', 3) - 1, 1)
-    if any(keyword in text_lower for keyword in good_sleep_keywords):
+    if mentions('good_sleep'):
         health_updates['sleep_quality'] = min(health_updates.get('sleep_quality', 3) + 1, 5)
 
     # 压力水平
-    stress_keywords = ['压力大', '焦虑', '紧张', '担心', '烦躁', '不安']
-    relaxed_keywords = ['放松', '平静', '舒适', '安心']
-    if any(keyword in text_lower for keyword in stress_keywords):
+    if mentions('stress'):
         health_updates['stress_level'] = min(health_updates.get('stress_level', 3) + 1, 10)
-    if any(keyword in text_lower for keyword in relaxed_keywords):
+    if mentions('relaxed'):
         health_updates['stress_level'] = max(health_updates.get('stress_level', 3) - 1, 0)
 
     # 情绪状态
-    mood_keywords = ['开心', '快乐', '满意', '兴奋']
-    bad_mood_keywords = ['难过', '沮丧', '失望', '生气', '郁闷']
-    if any(keyword in text_lower for keyword in mood_keywords):
+    if mentions('good_mood'):
         health_updates['mood_score'] = min(health_updates.get('mood_score', 5) + 1, 10)
-    if any(keyword in text_lower for keyword in bad_mood_keywords):
+    if mentions('bad_mood'):
         health_updates['mood_score'] = max(health_updates.get('mood_score', 5) - 1, 0)
 
     return health_updates if health_updates else None
 
-def process_user_message(message: str, user_profile: str) -> Dict[str, Any]:
+def normalize_message(message: str) -> str:
+    """
+    规范化消息文本（全角转半角、小写、合并空白），作为分析缓存的键
+    """
+    return " ".join(unicodedata.normalize('NFKC', message or '').lower().split())
+
+@timed("nlp_analysis")
+def analyze_message(message: str) -> Dict[str, Any]:
+    """
+    与用户画像无关的消息分析（意图、情感、健康信息、关键词标签），按规范化文本缓存
+    """
+    key = normalize_message(message)
+    analysis = _analysis_cache.get(key)
+    if analysis is None:
+        analysis = {
+            'intent': analyze_intent(key),
+            'sentiment': analyze_sentiment(key),
+            'health_info': extract_health_info(key),
+            'keyword_tags': _keyword_tags(key),
+        }
+        _analysis_cache.put(key, analysis)
+    # 返回副本，调用方修改结果不影响缓存
+    return copy.deepcopy(analysis)
+
+def get_analysis_cache_stats() -> Dict[str, Any]:
+    """消息分析缓存的命中率统计"""
+    return _analysis_cache.stats()
+
+def process_user_message(message: str, user_profile: str, user_id: int = None) -> Dict[str, Any]:
     """
     处理用户消息，返回完整的分析结果
+    传入 user_id 时，结合该用户的会话上下文生成回复，并将本轮对话写入会话上下文与对话历史
     """
-    intent_analysis = analyze_intent(message)
-    sentiment_analysis = analyze_sentiment(message)
-    health_info = extract_health_info(message)
+    analysis = analyze_message(message)
+    intent_analysis = analysis['intent']
+    sentiment_analysis = analysis['sentiment']
+    health_info = analysis['health_info']
+
+    # 之前几轮的会话上下文（不含本轮）
+    context = get_session_context(user_id) if user_id is not None else None
 
     response = generate_response(
         intent_analysis['intent'],
         sentiment_analysis['sentiment'],
         user_profile,
+        context=context,
         health_info=health_info
     )
 
-    return {
+    result = {
         'original_message': message,
         'intent': intent_analysis,
         'sentiment': sentiment_analysis,
         'response': response,
-        'tags': generate_tags(user_profile, message),
+        'tags': [{"text": user_profile, "value": 1000}] + analysis['keyword_tags'],
         'health_info': health_info,
-        'timestamp': '2024-01-01T00:00:00Z'  # 实际应用中应使用当前时间
-    }
\ No newline at end of file
+        'timestamp': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+    }
+
+    if user_id is not None:
+        update_session_context(user_id, intent_analysis['intent'], sentiment_analysis['sentiment'], health_info)
+        try:
+            result['message_id'] = record_message(user_id, result)['id']
+        except Exception as e:
+            print(f"Chat history error: {e}")
+
+    return result
\ No newline at end of file
@@ -0,0 +1,219 @@
+"""
+同群分位服务
+按全体、年龄段、城市、画像类型分组，预先对收入、储蓄率、资产、负债率、评分排序，
+单次分位查询只需一次二分查找；用户指标变更时只移动该用户在各有序数组中的位置。
+"""
+from __future__ import annotations
+
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from . import data_service
+from .analysis_service import get_user_profiles_batch
+from .data_service import calculate_pension_scores_batch, register_metrics_listener
+from .schema_service import numeric_column
+
+# 对外指标名 -> (数据列, 是否越高越好)；score 由评分模型批量计算
+PEER_METRICS = {
+    'income': ('月总流入', True),
+    'savings_rate': ('储蓄率', True),
+    'assets': ('总资产', True),
+    'debt_ratio': ('负债率', False),
+    'score': (None, True),
+}
+COHORTS = ('overall', 'age_band', 'city', 'persona')
+
+# 分组人数超过该阈值时改用分位数草图（固定数量的分位点）代替完整有序数组
+SKETCH_THRESHOLD = 200000
+SKETCH_POINTS = 1001
+# 一次变更的用户数超过该值且超过索引规模的 10% 时丢弃索引、下次查询重建
+REBUILD_MIN_CHANGES = 1000
+
+
+def age_band(age) -> str:
+    """按 10 岁划分年龄段，如 '30-39'。"""
+    start = int(age) // 10 * 10
+    return f"{start}-{start + 9}"
+
+
+class _Distribution:
+    """单个分组内单个指标的分布：精确有序数组，或大分组下的分位数草图。"""
+
+    def __init__(self, values: np.ndarray):
+        values = np.sort(values[~np.isnan(values)])
+        self.size = len(values)
+        if self.size > SKETCH_THRESHOLD:
+            self.sorted = None
+            self.sketch = np.quantile(values, np.linspace(0, 1, SKETCH_POINTS))
+        else:
+            self.sorted = values
+            self.sketch = None
+
+    def percentile(self, value: float) -> Optional[float]:
+        """返回低于该值的同群比例（0~100，并列取中位秩）。"""
+        if self.size == 0 or value is None or np.isnan(value):
+            return None
+        if self.sketch is not None:
+            lo = np.searchsorted(self.sketch, value, side='left')
+            hi = np.searchsorted(self.sketch, value, side='right')
+            return float((lo + hi) / 2 / len(self.sketch) * 100)
+        lo = np.searchsorted(self.sorted, value, side='left')
+        hi = np.searchsorted(self.sorted, value, side='right')
+        return float((lo + hi) / 2 / self.size * 100)
+
+    def replace(self, old: Optional[float], new: Optional[float]) -> None:
+        """增量更新：删除旧值、插入新值。草图模式下分布变化可忽略，不做更新。"""
+        if self.sorted is None:
+            return
+        if old is not None and not np.isnan(old):
+            pos = np.searchsorted(self.sorted, old)
+            if pos < len(self.sorted) and self.sorted[pos] == old:
+                self.sorted = np.delete(self.sorted, pos)
+        if new is not None and not np.isnan(new):
+            self.sorted = np.insert(self.sorted, np.searchsorted(self.sorted, new), new)
+        self.size = len(self.sorted)
+
+
+class PeerIndex:
+    """同群分位索引。"""
+
+    def __init__(self, frame: pd.DataFrame):
+        self._lock = threading.Lock()
+        self.generation = 0
+        self.users: Dict[int, Dict] = {}
+        self.groups: Dict[tuple, Dict[str, _Distribution]] = {}
+        if frame.empty:
+            return
+
+        table = self._user_table(frame)
+        for cohort in COHORTS:
+            for key, group in table.groupby(cohort, sort=False):
+                self.groups[(cohort, key)] = {
+                    name: _Distribution(group[name].to_numpy(dtype=np.float64)) for name in PEER_METRICS
+                }
+        for record in table.to_dict('records'):
+            self.users[int(record.pop('用户ID'))] = record
+
+    @staticmethod
+    def _user_table(frame: pd.DataFrame) -> pd.DataFrame:
+        table = pd.DataFrame({'用户ID': frame['用户ID'].to_numpy()})
+        for name, (column, _) in PEER_METRICS.items():
+            if column is not None:
+                table[name] = numeric_column(frame, column)
+        table['score'] = calculate_pension_scores_batch(frame).astype(np.float64)
+        table['overall'] = '全部'
+        table['age_band'] = [age_band(a) for a in frame['年龄'].to_numpy()]
+        table['city'] = frame['所在城市'].astype(str).to_numpy()
+        table['persona'] = get_user_profiles_batch(frame)
+        return table
+
+    def update(self, frame: pd.DataFrame) -> None:
+        """对变更用户增量调整其所在分组的有序数组（支持换组与新增用户）。"""
+        if frame.empty:
+            return
+        table = self._user_table(frame)
+        with self._lock:
+            for record in table.to_dict('records'):
+                uid = int(record.pop('用户ID'))
+                old = self.users.get(uid)
+                for cohort in COHORTS:
+                    old_group = self.groups.get((cohort, old[cohort])) if old else None
+                    new_group = self.groups.setdefault(
+                        (cohort, record[cohort]),
+                        {name: _Distribution(np.empty(0)) for name in PEER_METRICS},
+                    )
+                    for name in PEER_METRICS:
+                        if old_group is new_group:
+                            new_group[name].replace(old[name], record[name])
+                        else:
+                            if old_group is not None:
+                                old_group[name].replace(old[name], None)
+                            new_group[name].replace(None, record[name])
+                self.users[uid] = record
+
+    def remove(self, user_ids: List[int]) -> None:
+        """从所在分组的有序数组中删除已移除的用户。"""
+        with self._lock:
+            for uid in user_ids:
+                old = self.users.pop(int(uid), None)
+                if old is None:
+                    continue
+                for cohort in COHORTS:
+                    group = self.groups[(cohort, old[cohort])]
+                    for name in PEER_METRICS:
+                        group[name].replace(old[name], None)
+
+    def percentiles(self, user_id: int) -> Optional[Dict]:
+        record = self.users.get(int(user_id))
+        if record is None:
+            return None
+        result = {}
+        for cohort in COHORTS:
+            group = self.groups[(cohort, record[cohort])]
+            result[cohort] = {
+                'key': record[cohort],
+                'size': group['score'].size,
+                'metrics': {
+                    name: {
+                        'value': _round(record[name], 4),
+                        'percentile': _round(group[name].percentile(record[name])),
+                        'higherIsBetter': higher,
+                    }
+                    for name, (_, higher) in PEER_METRICS.items()
+                },
+            }
+        return result
+
+
+def _round(value: Optional[float], digits: int = 1) -> Optional[float]:
+    if value is None or np.isnan(value):
+        return None
+    return round(float(value), digits)
+
+
+_peer_index: Optional[PeerIndex] = None
+_peer_index_lock = threading.Lock()
+
+
+def get_peer_index() -> PeerIndex:
+    """懒加载全局同群索引；用户表整体替换后重建。"""
+    global _peer_index
+    generation = data_service.get_table_generation()
+    index = _peer_index
+    if index is None or index.generation != generation:
+        with _peer_index_lock:
+            index = _peer_index
+            if index is None or index.generation != generation:
+                index = PeerIndex(data_service.df)
+                index.generation = generation
+                _peer_index = index
+    return index
+
+
+def _on_metrics_changed(user_ids: List[int]) -> None:
+    global _peer_index
+    if _peer_index is None:
+        return
+    if len(user_ids) > max(REBUILD_MIN_CHANGES, len(_peer_index.users) // 10):
+        # 大批量变更时逐个插入有序数组不如下次查询时整体重建
+        _peer_index = None
+        return
+    frame = data_service.df
+    changed = frame[frame['用户ID'].isin(user_ids)]
+    _peer_index.update(changed)
+    # 不在表中的用户已被删除
+    _peer_index.remove(list(set(user_ids) - set(changed['用户ID'].tolist())))
+
+
+register_metrics_listener(_on_metrics_changed)
+
+
+def get_peer_percentiles(user_id: int) -> Optional[Dict]:
+    """返回用户在全体、同年龄段、同城市、同画像人群中的各指标分位。"""
+    percentiles = get_peer_index().percentiles(user_id)
+    if percentiles is None:
+        return None
+    return {'userId': int(user_id), 'cohorts': percentiles}
@@ -0,0 +1,178 @@
+"""
+资产配置优化服务
+基于本地资本市场假设做均值-方差优化，预先计算并缓存有效前沿；
+单个用户的配置只需按风险目标在前沿上插值，支持对大批用户一次性求解。
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import minimize
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CMA_PATH = os.path.join(BASE_DIR, '..', 'data', 'capital_market_assumptions.json')
+
+# 风险偏好对应的基础风险系数（0 为前沿最低波动点，1 为最高收益点）
+RISK_PREFERENCE_LEVELS = {'保守': 0.15, '稳健': 0.35, '平衡': 0.55, '积极': 0.75, '激进': 0.95}
+# 年龄每偏离 45 岁一年，风险系数调整 1%（越年轻越进取）
+AGE_PIVOT = 45
+AGE_SLOPE = 0.01
+
+_frontier_cache: Dict[tuple, Dict] = {}
+_frontier_lock = threading.Lock()
+
+
+def load_capital_market_assumptions(path: str = CMA_PATH) -> Dict:
+    """读取资本市场假设，并计算协方差矩阵。"""
+    with open(path, encoding='utf-8') as f:
+        cma = json.load(f)
+    vols = np.asarray(cma['volatilities'], dtype=float)
+    corr = np.asarray(cma['correlations'], dtype=float)
+    cma['mu'] = np.asarray(cma['expected_returns'], dtype=float)
+    cma['cov'] = corr * np.outer(vols, vols)
+    cma.setdefault('min_weights', [0.0] * len(vols))
+    cma.setdefault('max_weights', [1.0] * len(vols))
+    return cma
+
+
+def _min_variance(cov: np.ndarray, bounds, constraints, x0: np.ndarray) -> np.ndarray:
+    result = minimize(lambda w: w @ cov @ w, x0, jac=lambda w: 2 * cov @ w,
+                      method='SLSQP', bounds=bounds, constraints=constraints,
+                      options={'ftol': 1e-12, 'maxiter': 500})
+    if not result.success:
+        raise RuntimeError(f"frontier optimization failed: {result.message}")
+    weights = np.clip(result.x, 0.0, None)
+    return weights / weights.sum()
+
+
+def compute_efficient_frontier(cma: Dict) -> Dict:
+    """在权重上下限约束下计算有效前沿。
+    从最小方差组合到最高可达收益，等距取目标收益并求最小方差权重。
+    """
+    mu, cov = cma['mu'], cma['cov']
+    n = len(mu)
+    bounds = list(zip(cma['min_weights'], cma['max_weights']))
+    budget = {'type': 'eq', 'fun': lambda w: w.sum() - 1.0}
+    x0 = np.full(n, 1.0 / n)
+
+    w_min = _min_variance(cov, bounds, [budget], x0)
+    # 最高收益组合：按收益从高到低依次填满上限
+    w_max = np.asarray(cma['min_weights'], dtype=float).copy()
+    remaining = 1.0 - w_max.sum()
+    for i in np.argsort(-mu):
+        add = min(cma['max_weights'][i] - w_max[i], remaining)
+        w_max[i] += add
+        remaining -= add
+
+    targets = np.linspace(mu @ w_min, mu @ w_max, int(cma.get('frontier_points', 60)))
+    weights = [w_min]
+    for target in targets[1:-1]:
+        target_constraint = {'type': 'eq', 'fun': lambda w, t=target: mu @ w - t}
+        weights.append(_min_variance(cov, bounds, [budget, target_constraint], weights[-1]))
+    weights.append(w_max)
+    weights = np.vstack(weights)
+
+    vols = np.sqrt(np.einsum('ij,jk,ik->i', weights, cov, weights))
+    # 数值误差可能导致波动率轻微非单调，插值前保证单调递增
+    vols = np.maximum.accumulate(vols)
+    return {
+        'assets': list(cma['assets']),
+        'mu': mu,
+        'cov': cov,
+        'weights': weights,
+        'returns': weights @ mu,
+        'volatilities': vols,
+        'risk_free_rate': float(cma.get('risk_free_rate', 0.0)),
+    }
+
+
+def get_efficient_frontier(path: str = CMA_PATH) -> Dict:
+    """返回缓存的有效前沿；假设文件修改后自动重新计算。"""
+    key = (os.path.abspath(path), os.path.getmtime(path))
+    frontier = _frontier_cache.get(key)
+    if frontier is None:
+        with _frontier_lock:
+            frontier = _frontier_cache.get(key)
+            if frontier is None:
+                frontier = compute_efficient_frontier(load_capital_market_assumptions(path))
+                _frontier_cache.clear()
+                _frontier_cache[key] = frontier
+    return frontier
+
+
+def risk_targets(ages: Sequence[float], preferences: Sequence[str]) -> np.ndarray:
+    """由年龄与风险偏好计算 0~1 的风险系数（向量化）。"""
+    ages = np.asarray(ages, dtype=float)
+    base = (pd.Series(preferences, dtype=object).map(RISK_PREFERENCE_LEVELS)
+            .fillna(RISK_PREFERENCE_LEVELS['平衡']).to_numpy(dtype=float))
+    return np.clip(base + (AGE_PIVOT - ages) * AGE_SLOPE, 0.0, 1.0)
+
+
+def risk_level_label(risk: float) -> str:
+    if risk < 0.4:
+        return '保守型'
+    if risk < 0.7:
+        return '平衡型'
+    return '进取型'
+
+
+def optimize_allocations(ages: Sequence[float], preferences: Sequence[str],
+                         frontier: Optional[Dict] = None) -> Dict[str, np.ndarray]:
+    """批量求解：按风险系数在前沿波动率区间上取目标波动率，并对各资产权重线性插值。"""
+    frontier = frontier or get_efficient_frontier()
+    risk = risk_targets(ages, preferences)
+    vols = frontier['volatilities']
+    target_vol = vols[0] + risk * (vols[-1] - vols[0])
+    weights = np.column_stack([np.interp(target_vol, vols, frontier['weights'][:, j])
+                               for j in range(len(frontier['assets']))])
+    return {
+        'risk': risk,
+        'weights': weights,
+        'expected_return': weights @ frontier['mu'],
+        'volatility': np.sqrt(np.einsum('ij,jk,ik->i', weights, frontier['cov'], weights)),
+    }
+
+
+def optimize_allocation(age: float, risk_preference: str) -> Dict:
+    """单个用户的前沿配置。"""
+    frontier = get_efficient_frontier()
+    result = optimize_allocations([age], [risk_preference], frontier)
+    risk = float(result['risk'][0])
+    return {
+        'riskLevel': risk_level_label(risk),
+        'riskTarget': round(risk, 3),
+        'weights': dict(zip(frontier['assets'], result['weights'][0].tolist())),
+        'expectedReturn': float(result['expected_return'][0]),
+        'expectedVolatility': float(result['volatility'][0]),
+    }
+
+
+def generate_asset_allocations_batch(frame: pd.DataFrame) -> pd.DataFrame:
+    """对整张用户表一次性求解配置，返回每个用户的各资产权重与风险指标。"""
+    frontier = get_efficient_frontier()
+    result = optimize_allocations(frame['年龄'].to_numpy(), frame['风险偏好'].astype(str).to_numpy(), frontier)
+    out = pd.DataFrame(result['weights'], columns=frontier['assets'], index=frame.index)
+    out.insert(0, '用户ID', frame['用户ID'].to_numpy())
+    out['riskTarget'] = result['risk']
+    out['riskLevel'] = [risk_level_label(r) for r in result['risk']]
+    out['expectedReturn'] = result['expected_return']
+    out['expectedVolatility'] = result['volatility']
+    return out
+
+
+def frontier_summary() -> List[Dict]:
+    """输出前沿上的各点，便于前端绘制。"""
+    frontier = get_efficient_frontier()
+    return [
+        {
+            'expectedReturn': round(float(r), 4),
+            'volatility': round(float(v), 4),
+            'weights': {a: round(float(w), 4) for a, w in zip(frontier['assets'], ws)},
+        }
+        for r, v, ws in zip(frontier['returns'], frontier['volatilities'], frontier['weights'])
+    ]
@@ -0,0 +1,197 @@
+"""
+任务进度存储服务
+在本地 SQLite 中按 (用户, 任务) 保存逐日完成情况的位图：第 0 位为 anchor_day 当天，第 i 位为其前 i 天。
+连续天数、完成率与近 7 天进度全部由位运算得到，无需逐行扫描历史记录。
+"""
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_DB_PATH = os.path.join(BASE_DIR, '..', 'data', 'task_progress.db')
+
+# 只保留最近 HISTORY_DAYS 天的记录
+HISTORY_DAYS = 400
+_HISTORY_MASK = (1 << HISTORY_DAYS) - 1
+_BITMAP_BYTES = (HISTORY_DAYS + 7) // 8
+
+_local = threading.local()
+
+
+def _db_path() -> str:
+    return os.environ.get('PENSION_PROGRESS_DB', DEFAULT_DB_PATH)
+
+
+def _connection() -> sqlite3.Connection:
+    """每个线程复用一个连接；数据库路径变化（如测试中切换）时重新连接。"""
+    path = _db_path()
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.path != path:
+        conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS task_progress ('
+            ' user_id INTEGER NOT NULL,'
+            ' task_id TEXT NOT NULL,'
+            ' anchor_day INTEGER NOT NULL,'
+            ' bits BLOB NOT NULL,'
+            ' PRIMARY KEY (user_id, task_id)'
+            ') WITHOUT ROWID'
+        )
+        _local.conn, _local.path = conn, path
+    return conn
+
+
+def _to_day(value: Union[None, str, date]) -> int:
+    if value is None:
+        return date.today().toordinal()
+    if isinstance(value, date):
+        return value.toordinal()
+    return date.fromisoformat(str(value)).toordinal()
+
+
+def _encode(bits: int) -> bytes:
+    return bits.to_bytes(_BITMAP_BYTES, 'little')
+
+
+def _decode(blob: bytes) -> int:
+    return int.from_bytes(blob, 'little')
+
+
+def _align(bits: int, anchor_day: int, day: int) -> int:
+    """把以 anchor_day 为第 0 位的位图对齐到以 day 为第 0 位。"""
+    if day >= anchor_day:
+        return (bits << (day - anchor_day)) & _HISTORY_MASK
+    return bits >> (anchor_day - day)
+
+
+def validate_updates(updates: Iterable) -> List[Dict]:
+    """逐项校验批量更新，返回错误列表 [{'index', 'error'}]（index 为该项在批次中的位置），全部合格时为空。
+    日期不能晚于今天：未来的日期会把位图锚点移到那一天，左移时丢掉已有的历史记录。
+    """
+    errors = []
+    today = date.today().toordinal()
+    for index, item in enumerate(updates):
+        if not isinstance(item, dict):
+            errors.append({'index': index, 'error': "update must be an object"})
+        elif not item.get('task_id'):
+            errors.append({'index': index, 'error': "update requires a task_id"})
+        elif not isinstance(item.get('completed', True), bool):
+            # 只接受布尔值，字符串 "false"/"0" 不能被当作已完成
+            errors.append({'index': index, 'error': f"completed must be a boolean: {item.get('completed')!r}"})
+        else:
+            try:
+                day = _to_day(item.get('date'))
+            except (TypeError, ValueError):
+                errors.append({'index': index, 'error': f"invalid date: {item.get('date')}"})
+                continue
+            if day > today:
+                errors.append({'index': index, 'error': f"date is in the future: {item.get('date')}"})
+    return errors
+
+
+def record_progress(user_id: int, updates: Iterable[Dict]) -> int:
+    """批量记录任务完成状态。
+
+    updates 中每项包含 task_id、completed（布尔值，默认 True）与可选的 date（ISO 日期，默认今天，不能晚于今天）。
+    有不合格的项时整批不写入并抛出 ValueError（见 validate_updates）。
+    同一批次在一个事务内完成读改写，返回写入的 (用户, 任务) 数量。
+    """
+    updates = list(updates)
+    errors = validate_updates(updates)
+    if errors:
+        raise ValueError(f"update {errors[0]['index']}: {errors[0]['error']}")
+    parsed: List[Tuple[str, int, bool]] = [
+        (str(item['task_id']), _to_day(item.get('date')), item.get('completed', True)) for item in updates
+    ]
+    if not parsed:
+        return 0
+
+    conn = _connection()
+    user_id = int(user_id)
+    task_ids = sorted({task_id for task_id, _, _ in parsed})
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        placeholders = ','.join('?' * len(task_ids))
+        rows = conn.execute(
+            f'SELECT task_id, anchor_day, bits FROM task_progress WHERE user_id = ? AND task_id IN ({placeholders})',
+            [user_id, *task_ids],
+        ).fetchall()
+        state = {task_id: (anchor, _decode(blob)) for task_id, anchor, blob in rows}
+
+        for task_id, day, completed in parsed:
+            anchor, bits = state.get(task_id, (day, 0))
+            if day > anchor:
+                bits, anchor = _align(bits, anchor, day), day
+            offset = anchor - day
+            if offset < HISTORY_DAYS:
+                bits = bits | (1 << offset) if completed else bits & ~(1 << offset)
+            state[task_id] = (anchor, bits)
+
+        conn.executemany(
+            'INSERT INTO task_progress (user_id, task_id, anchor_day, bits) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT(user_id, task_id) DO UPDATE SET anchor_day = excluded.anchor_day, bits = excluded.bits',
+            [(user_id, task_id, state[task_id][0], _encode(state[task_id][1])) for task_id in task_ids],
+        )
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    return len(task_ids)
+
+
+def _load_bitmaps(user_id: int, day: int) -> Dict[str, int]:
+    rows = _connection().execute(
+        'SELECT task_id, anchor_day, bits FROM task_progress WHERE user_id = ?', (int(user_id),)
+    ).fetchall()
+    return {task_id: _align(_decode(blob), anchor, day) for task_id, anchor, blob in rows}
+
+
+def _trailing_ones(bits: int) -> int:
+    return ((bits ^ (bits + 1)) >> 1).bit_length()
+
+
+def _longest_run(bits: int) -> int:
+    """最长连续 1 的长度：每次与自身左移一位相与，最长连续段缩短 1。"""
+    run = 0
+    while bits:
+        bits &= bits << 1
+        run += 1
+    return run
+
+
+def get_progress(user_id: int, total_tasks: Optional[int] = None, today: Union[None, str, date] = None) -> Dict:
+    """计算用户的任务进度。
+
+    total_tasks 为当前计划中的任务数（缺省为已记录过的任务数）；
+    current_streak 在今天尚未完成任何任务时从昨天起算。
+    """
+    day = _to_day(today)
+    bitmaps = _load_bitmaps(user_id, day)
+    total = int(total_tasks) if total_tasks else max(len(bitmaps), 1)
+
+    any_day = 0
+    for bits in bitmaps.values():
+        any_day |= bits
+    completed_today = sum(bits & 1 for bits in bitmaps.values())
+    current_streak = _trailing_ones(any_day) if any_day & 1 else _trailing_ones(any_day >> 1)
+
+    # 近 7 天（由远到近）每天的完成比例
+    weekly = []
+    for offset in range(6, -1, -1):
+        done = sum((bits >> offset) & 1 for bits in bitmaps.values())
+        weekly.append(round(min(done, total) / total * 100, 1))
+
+    return {
+        "total_tasks": total,
+        "completed_tasks": completed_today,
+        "completion_rate": round(min(completed_today, total) / total * 100, 1),
+        "current_streak": current_streak,
+        "best_streak": _longest_run(any_day),
+        "weekly_progress": weekly,
+    }
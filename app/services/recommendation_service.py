@@ -3,79 +3,71 @@
 基于用户画像和财务指标生成个性化投资计划和消费建议
 """
 
-import random
-from typing import List, Dict, Any
+import copy
+import operator
+import zlib
+from typing import List, Dict, Any, Optional, Tuple
 
-def generate_consumption_recommendations(metrics):
-    """
-    基于消费行为数据生成个性化消费建议
-    """
-    recommendations = []
-
-    # 消费行为分析
-    total_consumption = sum([
-        metrics.get('餐饮消费', 0), metrics.get('衣物消费', 0), metrics.get('住房消费', 0),
-        metrics.get('交通消费', 0), metrics.get('娱乐消费', 0), metrics.get('教育培训消费', 0),
-        metrics.get('医疗保健消费', 0), metrics.get('健身运动消费', 0), metrics.get('旅行度假消费', 0),
-        metrics.get('数字产品消费', 0), metrics.get('宠物消费', 0), metrics.get('图书影音消费', 0),
-        metrics.get('美容护肤消费', 0), metrics.get('线上购物消费', 0), metrics.get('线下购物消费', 0),
-        metrics.get('奢侈品消费', 0), metrics.get('家庭日用品消费', 0), metrics.get('母婴消费', 0),
-        metrics.get('绿色环保消费', 0), metrics.get('慈善捐赠消费', 0)
-    ])
-
-    monthly_income = metrics.get('月总流入', 1)
-    consumption_rate = total_consumption / monthly_income
+import numpy as np
+import pandas as pd
 
-    # 消费控制建议
-    if consumption_rate > 0.9:
-        recommendations.append({
-            "category": "消费控制",
-            "priority": "high",
-            "content": "月消费支出过高，已超过收入的90%，建议立即制定严格的消费预算",
-            "action": "制定月度消费预算，控制非必要支出"
-        })
+from . import data_service, progress_service
+from .analysis_service import get_user_profiles_batch
+from .cache_service import LRUCache
+from .data_service import get_consumption_features, consumption_summary_frame
+from .schema_service import numeric_column
 
+# 消费建议规则：(消费特征, 比较方式, 阈值, 建议)
+CONSUMPTION_RULES = [
+    ('consumption_rate', operator.gt, 0.9, {
+        "category": "消费控制",
+        "priority": "high",
+        "content": "月消费支出过高，已超过收入的90%，建议立即制定严格的消费预算",
+        "action": "制定月度消费预算，控制非必要支出"
+    }),
     # 奢侈品消费分析
-    luxury_spending = metrics.get('奢侈品消费', 0) + metrics.get('美容护肤消费', 0)
-    if luxury_spending > total_consumption * 0.15:
-        recommendations.append({
-            "category": "消费优化",
-            "priority": "medium",
-            "content": "奢侈品消费占比过高，建议优化支出结构，将更多资金用于投资",
-            "action": "减少奢侈品消费，将节省的资金投入理财产品"
-        })
-
+    ('luxury_ratio', operator.gt, 0.15, {
+        "category": "消费优化",
+        "priority": "medium",
+        "content": "奢侈品消费占比过高，建议优化支出结构，将更多资金用于投资",
+        "action": "减少奢侈品消费，将节省的资金投入理财产品"
+    }),
     # 教育投资分析
-    education_spending = metrics.get('教育培训消费', 0)
-    if education_spending < total_consumption * 0.05:
-        recommendations.append({
-            "category": "教育投资",
-            "priority": "medium",
-            "content": "金融知识学习投入不足，建议增加教育培训消费以提升投资技能",
-            "action": "每月安排一定预算用于金融课程学习"
-        })
-
+    ('education_ratio', operator.lt, 0.05, {
+        "category": "教育投资",
+        "priority": "medium",
+        "content": "金融知识学习投入不足，建议增加教育培训消费以提升投资技能",
+        "action": "每月安排一定预算用于金融课程学习"
+    }),
     # 健康消费分析
-    health_spending = metrics.get('医疗保健消费', 0) + metrics.get('健身运动消费', 0)
-    if health_spending < total_consumption * 0.08:
-        recommendations.append({
-            "category": "健康投资",
-            "priority": "low",
-            "content": "健康消费偏低，建议增加健身和医疗保健支出",
-            "action": "制定健康消费计划，定期体检和健身"
-        })
-
+    ('health_ratio', operator.lt, 0.08, {
+        "category": "健康投资",
+        "priority": "low",
+        "content": "健康消费偏低，建议增加健身和医疗保健支出",
+        "action": "制定健康消费计划，定期体检和健身"
+    }),
     # 慈善捐赠分析
-    charity_spending = metrics.get('慈善捐赠消费', 0)
-    if charity_spending < total_consumption * 0.02:
-        recommendations.append({
-            "category": "社会责任",
-            "priority": "low",
-            "content": "慈善捐赠偏低，建议适当增加公益支出",
-            "action": "制定年度慈善捐赠计划，支持社会公益事业"
-        })
+    ('charity_ratio', operator.lt, 0.02, {
+        "category": "社会责任",
+        "priority": "low",
+        "content": "慈善捐赠偏低，建议适当增加公益支出",
+        "action": "制定年度慈善捐赠计划，支持社会公益事业"
+    }),
+]
 
-    return recommendations
+def _consumption_flags(features) -> Tuple[bool, ...]:
+    return tuple(bool(op(features[name], threshold)) for name, op, threshold, _ in CONSUMPTION_RULES)
+
+def _consumption_recommendations(flags: Tuple[bool, ...]) -> List[Dict[str, str]]:
+    return [dict(rec) for flag, (_, _, _, rec) in zip(flags, CONSUMPTION_RULES) if flag]
+
+def generate_consumption_recommendations(metrics):
+    """
+    基于消费行为数据生成个性化消费建议
+    """
+    # 消费行为分析（共用预计算的消费特征块）
+    features = get_consumption_features(metrics)
+    return _consumption_recommendations(_consumption_flags(features))
 
 # 预定义的推荐模板，根据用户画像定制
 RECOMMENDATION_TEMPLATES = {
@@ -186,6 +178,41 @@ RECOMMENDATION_TEMPLATES = {
     }
 }
 
+# 指标调整规则：(指标, 缺省值, 比较方式, 阈值)，顺序与 _apply_metric_adjustments 一致
+METRIC_RULES = [
+    ('负债率', 0.2, operator.gt, 0.5),
+    ('储蓄率', 0.2, operator.lt, 0.1),
+    ('总资产', 100000, operator.lt, 50000),
+    ('年龄', 30, operator.gt, 50),
+]
+
+DIFFICULTY_LEVELS = ("easy", "medium", "hard")
+
+# 推荐结果只取决于 (画像, 指标分档, 消费分档)，按该键缓存
+_plan_cache = LRUCache(1024, name="recommendation.plans")
+
+def _metric_flags(metrics: Dict[str, Any]) -> Tuple[bool, ...]:
+    return tuple(bool(op(metrics.get(name, default), threshold)) for name, default, op, threshold in METRIC_RULES)
+
+def _normalize_profile(user_profile: str) -> str:
+    return user_profile if user_profile in RECOMMENDATION_TEMPLATES else "中产平衡型"  # 默认类型
+
+def _build_recommendations(user_profile: str, metric_flags: Tuple[bool, ...],
+                           consumption_flags: Tuple[bool, ...]) -> Dict[str, Any]:
+    cache_key = (user_profile, metric_flags, consumption_flags)
+    result = _plan_cache.get(cache_key)
+    if result is None:
+        adjusted_recommendations = _apply_metric_adjustments(RECOMMENDATION_TEMPLATES[user_profile], metric_flags)
+        result = {
+            "user_profile": user_profile,
+            "recommendations": _add_priority_and_tracking(adjusted_recommendations),
+            "consumption_recommendations": _consumption_recommendations(consumption_flags),
+            "generated_at": "2024-01-01T00:00:00Z",  # 实际应用中应使用当前时间
+            "valid_period": "7天"  # 推荐有效期
+        }
+        _plan_cache.put(cache_key, result)
+    return result
+
 def generate_personalized_recommendations(user_profile: str, metrics: Dict[str, Any]) -> Dict[str, Any]:
     """
     基于用户画像和当前指标生成个性化推荐
@@ -197,61 +224,83 @@ def generate_personalized_recommendations(user_profile: str, metrics: Dict[str,
     Returns:
         包含每日行动、周目标、长期计划的推荐字典
     """
-    if user_profile not in RECOMMENDATION_TEMPLATES:
-        user_profile = "中产平衡型"  # 默认类型
-
-    base_recommendations = RECOMMENDATION_TEMPLATES[user_profile]
+    user_profile = _normalize_profile(user_profile)
+    features = get_consumption_features(metrics)
+    result = _build_recommendations(user_profile, _metric_flags(metrics), _consumption_flags(features))
+    # 返回副本，调用方修改结果不影响缓存
+    return copy.deepcopy(result)
 
-    # 根据具体指标调整推荐
-    adjusted_recommendations = _adjust_recommendations_based_on_metrics(
-        base_recommendations.copy(), metrics
-    )
-
-    # 生成消费行为推荐
-    consumption_recommendations = generate_consumption_recommendations(metrics)
+def generate_recommendations_batch(frame: Optional[pd.DataFrame] = None) -> Dict[int, Dict[str, Any]]:
+    """
+    一次性为整张用户表生成推荐：画像、指标分档与消费分档均向量化计算，
+    相同分档组合只生成一次。返回 用户ID -> 推荐字典；每个组合复制一份缓存结果，
+    相同组合的用户共享这份副本，调用方修改结果不影响缓存。
+    """
+    frame = data_service.df if frame is None else frame
+    if frame.empty:
+        return {}
 
-    # 添加优先级和进度跟踪
-    recommendations_with_priority = _add_priority_and_tracking(adjusted_recommendations)
+    personas = get_user_profiles_batch(frame)
+    metric_flags = np.column_stack([
+        op(numeric_column(frame, name), threshold)
+        if name in frame else np.full(len(frame), op(default, threshold))
+        for name, default, op, threshold in METRIC_RULES
+    ])
+    summary = consumption_summary_frame(frame)
+    consumption_flags = np.column_stack([
+        op(summary[name].to_numpy(), threshold) for name, op, threshold, _ in CONSUMPTION_RULES
+    ])
 
-    return {
-        "user_profile": user_profile,
-        "recommendations": recommendations_with_priority,
-        "consumption_recommendations": consumption_recommendations,
-        "generated_at": "2024-01-01T00:00:00Z",  # 实际应用中应使用当前时间
-        "valid_period": "7天"  # 推荐有效期
-    }
+    plans, copies = {}, {}
+    for user_id, persona, m_flags, c_flags in zip(frame['用户ID'].to_numpy(), personas,
+                                                  metric_flags.tolist(), consumption_flags.tolist()):
+        key = (_normalize_profile(persona), tuple(m_flags), tuple(c_flags))
+        if key not in copies:
+            copies[key] = copy.deepcopy(_build_recommendations(*key))
+        plans[int(user_id)] = copies[key]
+    return plans
 
 def _adjust_recommendations_based_on_metrics(recommendations: Dict[str, List[str]],
                                            metrics: Dict[str, Any]) -> Dict[str, List[str]]:
     """
-    根据具体财务指标调整推荐内容
+    根据具体财务指标调整推荐内容（返回新字典，不修改传入的模板）
     """
+    return _apply_metric_adjustments(recommendations, _metric_flags(metrics))
+
+def _apply_metric_adjustments(recommendations: Dict[str, List[str]],
+                              flags: Tuple[bool, ...]) -> Dict[str, List[str]]:
+    high_debt, low_savings, low_assets, near_retirement = flags
+    recommendations = {category: list(actions) for category, actions in recommendations.items()}
+
     # 基于负债率调整债务相关推荐
-    debt_ratio = metrics.get('负债率', 0.2)
-    if debt_ratio > 0.5:
+    if high_debt:
         # 添加更多债务管理
         recommendations["daily_actions"].append("制定详细债务偿还计划")
         recommendations["weekly_goals"].append("增加债务偿还频率")
 
     # 基于储蓄率调整储蓄相关推荐
-    savings_rate = metrics.get('储蓄率', 0.2)
-    if savings_rate < 0.1:
+    if low_savings:
         recommendations["daily_actions"].insert(0, "立即增加储蓄比例")
         recommendations["weekly_goals"].insert(0, "制定储蓄目标")
 
     # 基于总资产调整投资相关推荐
-    total_assets = metrics.get('总资产', 100000)
-    if total_assets < 50000:
+    if low_assets:
         recommendations["daily_actions"].insert(0, "优先积累资产")
 
     # 基于年龄调整退休相关推荐
-    age = metrics.get('年龄', 30)
-    if age > 50:
+    if near_retirement:
         recommendations["daily_actions"].append("加速退休规划")
         recommendations["weekly_goals"].append("评估退休准备度")
 
     return recommendations
 
+def _task_metadata(content: str) -> Tuple[str, int]:
+    """
+    由任务内容的稳定哈希得到难度与预计耗时（5~60 分钟），同一任务在任何进程中结果一致
+    """
+    digest = zlib.crc32(content.encode('utf-8'))
+    return DIFFICULTY_LEVELS[digest % 3], 5 + (digest // 3) % 56
+
 def _add_priority_and_tracking(recommendations: Dict[str, List[str]]) -> Dict[str, Any]:
     """
     为推荐添加优先级和进度跟踪信息
@@ -261,37 +310,41 @@ def _add_priority_and_tracking(recommendations: Dict[str, List[str]]) -> Dict[st
     for category, actions in recommendations.items():
         result[category] = []
         for i, action in enumerate(actions):
+            difficulty, estimated_time = _task_metadata(action)
             result[category].append({
                 "id": f"{category}_{i}",
                 "content": action,
                 "priority": "high" if i < 2 else "medium" if i < 4 else "low",
                 "completed": False,
                 "progress": 0,
-                "difficulty": random.choice(["easy", "medium", "hard"]),
-                "estimated_time": random.randint(5, 60)  # 分钟
+                "difficulty": difficulty,
+                "estimated_time": estimated_time  # 分钟
             })
 
     return result
 
-def get_recommendation_progress(user_id: int) -> Dict[str, Any]:
+def get_recommendation_progress(user_id: int, total_tasks: Optional[int] = None) -> Dict[str, Any]:
     """
-    获取用户的推荐完成进度
-    实际应用中应从数据库获取
+    获取用户的推荐完成进度（来自本地任务进度存储）
     """
-    # 模拟数据
-    return {
-        "total_tasks": 15,
-        "completed_tasks": 7,
-        "completion_rate": 46.7,
-        "current_streak": 3,
-        "best_streak": 7,
-        "weekly_progress": [30, 40, 35, 50, 45, 60, 47]
-    }
+    return progress_service.get_progress(user_id, total_tasks)
 
-def update_recommendation_progress(user_id: int, task_id: str, completed: bool) -> bool:
+def update_recommendation_progress(user_id: int, task_id: str, completed: bool,
+                                   day: Optional[str] = None) -> bool:
     """
     更新推荐任务的完成状态
-    实际应用中应更新数据库
     """
-    # 模拟更新
-    return True
\ No newline at end of file
+    progress_service.record_progress(user_id, [{"task_id": task_id, "completed": completed, "date": day}])
+    return True
+
+def update_recommendation_progress_batch(user_id: int, updates: List[Dict[str, Any]]) -> int:
+    """
+    批量更新任务完成状态，返回更新的任务数
+    """
+    return progress_service.record_progress(user_id, updates)
+
+def count_plan_tasks(recommendations: Dict[str, Any]) -> int:
+    """
+    计划中的任务总数（每日行动、周目标与长期计划）
+    """
+    return sum(len(items) for items in recommendations["recommendations"].values())
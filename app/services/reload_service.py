@@ -0,0 +1,212 @@
+"""
+用户数据热加载
+后台线程轮询数据文件的修改时间与大小，变化时再比较内容摘要；确认文件内容变化后分块读取，
+按用户ID比较每行的哈希，只把新增、修改的行写入用户表，并删除文件中已移除的用户。
+写入在一次整体替换中完成，只通知发生变化的用户。
+用户表存于 SQLite 时数据源是数据库：每个请求前检查库中用户表的版本，其他进程写入后重新加载内存表。
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from . import data_service
+from .ingestion_service import normalize_chunk, validate_chunk
+from .metrics_service import record_dataset_load
+from .schema_service import ID_COLUMN, numeric_column
+from .storage_service import configured_backend
+
+DEFAULT_INTERVAL = 5.0
+SCAN_CHUNK_ROWS = 100_000
+# 轮询间隔（秒），0 表示关闭热加载
+INTERVAL_ENV = 'PENSION_DATA_RELOAD_INTERVAL'
+
+
+def file_digest(path: str, block_size: int = 1 << 20) -> str:
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def drop_unchanged(changed: pd.DataFrame, current: pd.DataFrame) -> pd.DataFrame:
+    """去掉与当前用户表取值完全相同的行（如只是数字格式不同），只保留新用户与实际有变化的用户。"""
+    if changed.empty or current.empty:
+        return changed
+    table = current.set_index(ID_COLUMN)
+    present = changed[ID_COLUMN].isin(table.index).to_numpy()
+    if not present.any():
+        return changed
+    rows = changed[present]
+    existing = table.loc[rows[ID_COLUMN].to_numpy()]
+    same = np.ones(len(rows), dtype=bool)
+    for column in rows.columns:
+        if column == ID_COLUMN or column not in existing.columns:
+            continue
+        if pd.api.types.is_numeric_dtype(existing[column]):
+            old = numeric_column(existing, column)
+            new = pd.to_numeric(rows[column], errors='coerce').to_numpy(dtype=np.float64)
+            same &= np.isclose(old, new, rtol=0, atol=1e-9) | (np.isnan(old) & np.isnan(new))
+        else:
+            old = existing[column].astype(object).to_numpy()
+            new = rows[column].astype(object).to_numpy()
+            same &= (old == new) | (pd.isna(old) & pd.isna(new))
+    keep = np.ones(len(changed), dtype=bool)
+    keep[np.flatnonzero(present)[same]] = False
+    return changed[keep]
+
+
+class DatasetWatcher:
+    """轮询单个用户数据文件，变化时把差异行增量写入 data_service 的用户表。
+
+    比较的基准是上一次读取的文件内容（每个用户一行的哈希），而不是当前用户表，
+    因此通过批量接口写入、但文件中没有变化的用户不会被文件中的旧值覆盖。
+    """
+
+    def __init__(self, path: str = data_service.DATA_PATH, interval: float = DEFAULT_INTERVAL,
+                 chunk_rows: int = SCAN_CHUNK_ROWS):
+        self.path = path
+        self.interval = interval
+        self.chunk_rows = chunk_rows
+        self._stat = None
+        self._digest = None
+        self._row_hashes = pd.Series(dtype=np.uint64)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _file_stat(self):
+        stat = os.stat(self.path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def _scan(self):
+        """分块读取文件（全部按字符串读入），返回 (每个用户的行哈希, 与上次相比有变化的行)。"""
+        hashes, changed = [], []
+        previous = self._row_hashes
+        reader = pd.read_csv(self.path, dtype=str, keep_default_na=False, na_values=[''],
+                             chunksize=self.chunk_rows)
+        for chunk in reader:
+            # 行索引换成源文件行号（第 1 行为表头）
+            chunk.index = chunk.index + 2
+            ids = pd.to_numeric(chunk[ID_COLUMN].str.strip().str.lstrip('Uu'), errors='coerce')
+            row_hashes = pd.util.hash_pandas_object(chunk, index=False)
+            known = ids.notna()
+            hashes.append(pd.Series(row_hashes[known].to_numpy(), index=ids[known].astype(np.int64).to_numpy()))
+            old = previous.reindex(ids[known].astype(np.int64).to_numpy()).to_numpy()
+            differs = np.ones(len(chunk), dtype=bool)
+            differs[known.to_numpy()] = old != row_hashes[known].to_numpy()
+            if differs.any():
+                changed.append(chunk[differs])
+        hashes = pd.concat(hashes) if hashes else pd.Series(dtype=np.uint64)
+        changed = pd.concat(changed) if changed else pd.DataFrame()
+        return hashes[~hashes.index.duplicated(keep='last')], changed
+
+    def snapshot(self) -> None:
+        """记录文件当前内容作为比较基准（不写入用户表）。"""
+        with self._lock:
+            self._stat = self._file_stat()
+            self._digest = file_digest(self.path)
+            self._row_hashes = pd.Series(dtype=np.uint64)
+            self._row_hashes, _ = self._scan()
+
+    def check(self) -> Optional[Dict]:
+        """轮询一次；文件内容有变化时增量写入并返回变更统计，否则返回 None。"""
+        with self._lock:
+            try:
+                stat = self._file_stat()
+            except FileNotFoundError:
+                return None
+            if stat == self._stat:
+                return None
+            digest = file_digest(self.path)
+            self._stat = stat
+            if digest == self._digest:
+                return None
+
+            start = time.perf_counter()
+            hashes, changed = self._scan()
+            errors = []
+            if not changed.empty:
+                changed, errors = validate_chunk(changed)
+                if not changed.empty:
+                    changed = drop_unchanged(normalize_chunk(changed), data_service.df)
+            for error in errors[:10]:
+                print(f"Dataset reload skipped line {error['line']}: {error['column']} {error['error']}")
+            deleted = self._row_hashes.index.difference(hashes.index)
+            result = data_service.upsert_users(changed, delete=deleted)
+            # 未通过校验的行按其（有误的）内容记入基准：修正后哈希改变会被重新读取，
+            # 之后从文件中删除该行时也能识别为删除
+            rejected = len({e['line'] for e in errors}) + len(result['rejected'])
+            self._digest = digest
+            self._row_hashes = hashes
+            record_dataset_load('users_reload', time.perf_counter() - start)
+            return {**result, 'rejected': rejected}
+
+    def _run(self) -> None:
+        try:
+            self.snapshot()
+        except Exception as e:
+            print(f"Dataset watcher error: {e}")
+        while not self._stop.wait(self.interval):
+            try:
+                report = self.check()
+                if report:
+                    print(f"Reloaded {self.path}: {report}")
+            except Exception as e:
+                print(f"Dataset watcher error: {e}")
+
+    def start(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='dataset-watcher', daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+_watcher: Optional[DatasetWatcher] = None
+_watcher_pid: Optional[int] = None
+_watcher_lock = threading.Lock()
+
+
+def init_app(app) -> None:
+    """在处理请求的进程中延迟启动数据文件监视（预分叉部署时父进程不启动线程），
+    并在请求前同步存储中其他进程写入的用户（SQLite 模式，至多每 SYNC_INTERVAL 秒检查一次）。"""
+
+    @app.before_request
+    def _sync_users():
+        if _watcher_pid != os.getpid():
+            start_watcher()
+        try:
+            data_service.sync_from_storage()
+        except Exception as e:
+            print(f"User table sync error: {e}")
+
+
+def start_watcher() -> Optional[DatasetWatcher]:
+    """按环境变量启动当前进程的数据文件监视，每个进程只启动一次；
+    用户表存于 SQLite 时数据文件不是数据源，不启动。"""
+    global _watcher, _watcher_pid
+    with _watcher_lock:
+        pid = os.getpid()
+        if _watcher_pid == pid:
+            return _watcher
+        # fork 出的子进程不沿用父进程的监视对象（线程不会随 fork 复制）
+        _watcher, _watcher_pid = None, pid
+        interval = float(os.environ.get(INTERVAL_ENV, DEFAULT_INTERVAL))
+        if interval <= 0 or configured_backend() != 'csv':
+            return None
+        _watcher = DatasetWatcher(interval=interval)
+        _watcher.start()
+        return _watcher
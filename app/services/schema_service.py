@@ -0,0 +1,171 @@
+"""
+用户表类型定义
+为用户表各列指定紧凑的存储类型：低基数文本列用分类类型，小量级金额与比例用 float32，计数用 int32；
+金额量级较大、float32 无法精确表示到分的列保持 float64。并提供按列统计内存占用的工具。
+"""
+from __future__ import annotations
+
+from typing import Any, Dict, List
+
+import numpy as np
+import pandas as pd
+
+ID_COLUMN = '用户ID'
+
+CATEGORICAL_COLUMNS = ('性别', '所在城市', '职业', '教育程度', '婚姻状况', '风险偏好', '健康状况')
+
+# 汇总字段由分项计算
+INCOME_PARTS = ('月工资收入', '经营性收入', '被动收入')
+ASSET_PARTS = ('活期存款', '理财产品', '股票基金', '房产估值')
+DEBT_PARTS = ('信用卡欠款', '房贷余额', '其他贷款')
+DERIVED_COLUMNS = ('月总流入', '总资产', '总负债', '净资产', '负债率', '储蓄率')
+
+# 新增用户必须提供的列：评分与同群分组直接使用这些字段（汇总字段由分项计算，不要求提供）
+REQUIRED_COLUMNS = (
+    ('年龄',) + INCOME_PARTS + ('月总流出',) + ASSET_PARTS + DEBT_PARTS + (
+        '养老金账户余额', '商业保险年缴', '风险偏好', '计划退休年龄', '目标养老金', '期望收益率下限', '期望收益率上限',
+        '平台月访问次数', '策略采纳率', '交互问答次数', '反馈积极度', '信任评分',
+    )
+)
+
+INT32_COLUMNS = ('年龄', '缴纳年限', '计划退休年龄', '平台月访问次数', '交互问答次数', '个性化设置次数')
+
+# float32 候选列 -> 小数位数；实际载入时再检查量级，超出 float32 精度的列保留 float64
+FLOAT32_COLUMNS = {
+    '月工资收入': 2, '经营性收入': 2, '被动收入': 2,
+    '储蓄率': 2, '负债率': 2, '期望收益率下限': 3, '期望收益率上限': 3,
+    '策略采纳率': 2, '反馈积极度': 2, '信任评分': 2,
+    '餐饮消费': 2, '衣物消费': 2, '住房消费': 2, '交通消费': 2, '娱乐消费': 2, '教育培训消费': 2,
+    '医疗保健消费': 2, '健身运动消费': 2, '旅行度假消费': 2, '数字产品消费': 2, '宠物消费': 2,
+    '图书影音消费': 2, '美容护肤消费': 2, '线上购物消费': 2, '线下购物消费': 2, '奢侈品消费': 2,
+    '家庭日用品消费': 2, '母婴消费': 2, '绿色环保消费': 2, '慈善捐赠消费': 2,
+}
+
+# 相邻 float32 的间隔约为 |x| * 2^-23，不超过半个最小单位时按小数位数输出可还原原值
+_FLOAT32_MANTISSA = 2.0 ** 23
+
+
+def float32_safe(values: np.ndarray, decimals: int) -> bool:
+    """判断该列存为 float32 后能否无损还原到 decimals 位小数。"""
+    finite = values[np.isfinite(values)]
+    if finite.size == 0:
+        return True
+    return float(np.abs(finite).max()) <= 0.5 * 10.0 ** -decimals * _FLOAT32_MANTISSA
+
+
+def derive_fields(frame: pd.DataFrame, only_missing: bool = False) -> pd.DataFrame:
+    """由分项计算汇总字段（月总流入、总资产、总负债、净资产、负债率、储蓄率），并保证期望收益率下限不高于上限。
+    only_missing=True 时只填补缺失的汇总字段，已有值保持不变；缺少分项的字段跳过。原地修改并返回。"""
+    def assign(column, values):
+        if only_missing and column in frame:
+            frame[column] = frame[column].where(frame[column].notna(), values)
+        else:
+            frame[column] = values
+
+    def total(parts):
+        return frame[list(parts)].apply(pd.to_numeric, errors='coerce').sum(axis=1, min_count=len(parts)).round(2)
+
+    def ratio(numerator, denominator):
+        return (numerator / denominator.where(denominator > 0)).round(2)
+
+    if all(c in frame for c in INCOME_PARTS):
+        assign('月总流入', total(INCOME_PARTS))
+    if all(c in frame for c in ASSET_PARTS):
+        assign('总资产', total(ASSET_PARTS))
+    if all(c in frame for c in DEBT_PARTS):
+        assign('总负债', total(DEBT_PARTS))
+    if '总资产' in frame and '总负债' in frame:
+        assign('净资产', (frame['总资产'] - frame['总负债']).round(2))
+        assign('负债率', ratio(frame['总负债'], frame['总资产']).fillna(0))
+    if '月总流入' in frame and '月总流出' in frame:
+        assign('储蓄率', ratio(frame['月总流入'] - pd.to_numeric(frame['月总流出'], errors='coerce'),
+                             frame['月总流入']).fillna(0))
+    if '期望收益率下限' in frame and '期望收益率上限' in frame:
+        bounds = frame[['期望收益率下限', '期望收益率上限']]
+        frame['期望收益率下限'], frame['期望收益率上限'] = bounds.min(axis=1), bounds.max(axis=1)
+    return frame
+
+
+def missing_required(frame: pd.DataFrame) -> List[List[str]]:
+    """逐行列出缺失（列不存在或值为空）的必填列。"""
+    missing = pd.DataFrame({c: frame[c].isna() if c in frame else True for c in REQUIRED_COLUMNS},
+                           index=frame.index)
+    names = np.array(REQUIRED_COLUMNS, dtype=object)
+    return [list(names[row]) for row in missing.to_numpy(dtype=bool)]
+
+
+def normalize_user_ids(ids: pd.Series) -> pd.Series:
+    """'U000001' 形式或数字形式的用户ID统一转为整数。"""
+    if pd.api.types.is_numeric_dtype(ids):
+        return ids.astype(np.int64)
+    return ids.astype(str).str.strip().str.lstrip('Uu').astype(np.int64)
+
+
+def apply_schema(frame: pd.DataFrame) -> pd.DataFrame:
+    """按用户表类型定义转换列类型（原地修改并返回）；不在定义中的列保持原类型。"""
+    if ID_COLUMN in frame:
+        ids = normalize_user_ids(frame[ID_COLUMN])
+        frame[ID_COLUMN] = ids.astype(np.int32) if ids.max() < np.iinfo(np.int32).max else ids
+    for column in CATEGORICAL_COLUMNS:
+        if column in frame:
+            frame[column] = frame[column].astype('category')
+    for column in INT32_COLUMNS:
+        if column in frame and not frame[column].isna().any():
+            frame[column] = pd.to_numeric(frame[column], errors='coerce').astype(np.int32)
+    for column, decimals in FLOAT32_COLUMNS.items():
+        if column in frame:
+            values = pd.to_numeric(frame[column], errors='coerce').to_numpy(dtype=np.float64)
+            frame[column] = values.astype(np.float32) if float32_safe(values, decimals) else values
+    return frame
+
+
+def numeric_column(frame: pd.DataFrame, column: str) -> np.ndarray:
+    """取数值列为 float64 数组（无法解析的值为 NaN）；float32 列按定义的小数位还原，与逐个用户取值的结果一致。"""
+    series = frame[column]
+    values = pd.to_numeric(series, errors='coerce').to_numpy(dtype=np.float64)
+    if series.dtype == np.float32:
+        values = np.round(values, FLOAT32_COLUMNS.get(column, 6))
+    return values
+
+
+def numeric_matrix(frame: pd.DataFrame, columns) -> np.ndarray:
+    """多列数值矩阵（n × len(columns)），规则同 numeric_column。"""
+    if not len(columns):
+        return np.empty((len(frame), 0))
+    return np.column_stack([numeric_column(frame, c) for c in columns])
+
+
+def to_python(value: Any, column: str = None) -> Any:
+    """把表中取出的单个值转为 Python 类型；float32 列按定义的小数位还原（如 16690.14 而非 16690.140625）。"""
+    if hasattr(value, 'item'):
+        value = value.item()
+    decimals = FLOAT32_COLUMNS.get(column)
+    if decimals is not None and isinstance(value, float):
+        return round(value, decimals)
+    return value
+
+
+def memory_report(frame: pd.DataFrame) -> Dict[str, Any]:
+    """按列统计内存占用（含字符串对象本身），并与默认类型载入时的占用对比。"""
+    columns = []
+    total = 0
+    baseline_total = 0
+    for column in frame.columns:
+        series = frame[column]
+        used = int(series.memory_usage(index=False, deep=True))
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            baseline = int(series.astype(object).memory_usage(index=False, deep=True))
+        elif pd.api.types.is_numeric_dtype(series):
+            baseline = len(series) * 8
+        else:
+            baseline = used
+        columns.append({'column': column, 'dtype': str(series.dtype), 'bytes': used, 'default_bytes': baseline})
+        total += used
+        baseline_total += baseline
+    return {
+        'rows': len(frame),
+        'total_bytes': total,
+        'default_total_bytes': baseline_total,
+        'reduction': round(baseline_total / total, 2) if total else None,
+        'columns': sorted(columns, key=lambda c: -c['bytes']),
+    }
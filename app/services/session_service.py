@@ -0,0 +1,120 @@
+"""
+对话上下文服务
+为每个用户在内存中维护会话上下文：最近 N 轮的意图与情感，以及健康信号的滑动平均。
+会话数有硬上限（LRU 淘汰），空闲超时的会话自动清除。
+"""
+from __future__ import annotations
+
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from typing import Any, Dict, Optional
+
+MAX_SESSIONS = 5000        # 同时保留的会话数上限
+SESSION_TTL = 30 * 60      # 空闲超过该秒数的会话被清除
+HISTORY_TURNS = 10         # 每个会话保留的最近轮数
+HEALTH_ALPHA = 0.5         # 健康信号指数滑动平均的权重
+
+
+class _Session:
+    __slots__ = ('intents', 'sentiments', 'health', 'turns', 'last_seen')
+
+    def __init__(self):
+        self.intents = deque(maxlen=HISTORY_TURNS)
+        self.sentiments = deque(maxlen=HISTORY_TURNS)
+        self.health: Dict[str, float] = {}
+        self.turns = 0
+        self.last_seen = time.monotonic()
+
+
+class SessionContextCache:
+    """按用户的会话上下文，LRU + 空闲超时。"""
+
+    def __init__(self, max_sessions: int = MAX_SESSIONS, ttl: float = SESSION_TTL):
+        self.max_sessions = max(1, int(max_sessions))
+        self.ttl = ttl
+        self._sessions: "OrderedDict[int, _Session]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def _evict_idle(self, now: float) -> None:
+        # 按最近访问排序，最旧的在前，遇到未超时的即可停止
+        while self._sessions:
+            user_id, session = next(iter(self._sessions.items()))
+            if now - session.last_seen <= self.ttl:
+                break
+            del self._sessions[user_id]
+            self.evictions += 1
+
+    def get_context(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """返回会话上下文快照，无会话或已过期时返回 None。"""
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            session = self._sessions.get(int(user_id))
+            if session is None:
+                return None
+            negative_streak = 0
+            for sentiment in reversed(session.sentiments):
+                if sentiment != 'negative':
+                    break
+                negative_streak += 1
+            return {
+                'turns': session.turns,
+                'recent_intents': list(session.intents),
+                'recent_sentiments': list(session.sentiments),
+                'intent_counts': dict(Counter(session.intents)),
+                'negative_streak': negative_streak,
+                'health_trends': {k: round(v, 2) for k, v in session.health.items()},
+            }
+
+    def update(self, user_id: int, intent: str, sentiment: str,
+               health_info: Optional[Dict[str, Any]] = None) -> None:
+        """记录一轮对话。"""
+        now = time.monotonic()
+        user_id = int(user_id)
+        with self._lock:
+            self._evict_idle(now)
+            session = self._sessions.get(user_id)
+            if session is None:
+                session = _Session()
+                self._sessions[user_id] = session
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+                    self.evictions += 1
+            else:
+                self._sessions.move_to_end(user_id)
+            session.last_seen = now
+            session.turns += 1
+            session.intents.append(intent)
+            session.sentiments.append(sentiment)
+            for key, value in (health_info or {}).items():
+                if isinstance(value, (int, float)):
+                    previous = session.health.get(key)
+                    session.health[key] = float(value) if previous is None else \
+                        HEALTH_ALPHA * float(value) + (1 - HEALTH_ALPHA) * previous
+
+    def clear(self) -> None:
+        with self._lock:
+            self._sessions.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'max_sessions': self.max_sessions,
+                'ttl_seconds': self.ttl,
+                'evictions': self.evictions,
+            }
+
+
+_sessions = SessionContextCache()
+
+
+def get_session_context(user_id: int) -> Optional[Dict[str, Any]]:
+    return _sessions.get_context(user_id)
+
+
+def update_session_context(user_id: int, intent: str, sentiment: str,
+                           health_info: Optional[Dict[str, Any]] = None) -> None:
+    _sessions.update(user_id, intent, sentiment, health_info)
@@ -0,0 +1,191 @@
+"""
+相似用户服务
+在标准化后的画像特征向量上建立近邻索引，查找"与你相似的用户"并汇总其结果指标。
+主索引只构建一次；用户指标变更时旧向量记为失效，新向量写入增量缓冲区，
+查询时合并两部分结果，缓冲区过大时才整体重建。
+"""
+from __future__ import annotations
+
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+from sklearn.neighbors import NearestNeighbors
+
+from . import data_service
+from .analysis_service import CLUSTER_FEATURES, get_profile_model, get_user_profiles_batch, standardize_profiles
+from .data_service import calculate_pension_scores_batch, register_metrics_listener
+from .metrics_service import record_model_training
+from .schema_service import numeric_matrix
+
+DEFAULT_NEIGHBORS = 10
+MAX_NEIGHBORS = 100
+# 增量缓冲区超过该数量（或主索引的 10%）时重建主索引
+REBUILD_THRESHOLD = 256
+
+
+class SimilarityIndex:
+    """主近邻索引 + 增量缓冲区 + 失效标记。"""
+
+    def __init__(self, user_ids: np.ndarray, vectors: np.ndarray, model: Dict):
+        self.model = model
+        self._lock = threading.RLock()
+        self._build(np.asarray(user_ids, dtype=np.int64), np.asarray(vectors, dtype=np.float64))
+
+    def _build(self, user_ids: np.ndarray, vectors: np.ndarray) -> None:
+        self.base_ids = user_ids
+        self.base_vectors = vectors
+        self.base_rows = {int(uid): i for i, uid in enumerate(user_ids)}
+        self.tombstones = np.zeros(len(user_ids), dtype=bool)
+        self.delta: Dict[int, np.ndarray] = {}
+        self.tree = NearestNeighbors(algorithm='auto').fit(vectors) if len(vectors) else None
+        record_model_training('similarity_index')
+
+    def vector(self, user_id: int) -> Optional[np.ndarray]:
+        user_id = int(user_id)
+        with self._lock:
+            if user_id in self.delta:
+                return self.delta[user_id]
+            row = self.base_rows.get(user_id)
+            if row is None or self.tombstones[row]:
+                return None
+            return self.base_vectors[row]
+
+    def upsert(self, user_ids: List[int], vectors: np.ndarray) -> None:
+        """增量更新：主索引中的旧向量标记失效，新向量写入缓冲区。"""
+        with self._lock:
+            for uid, vec in zip(user_ids, vectors):
+                uid = int(uid)
+                row = self.base_rows.get(uid)
+                if row is not None:
+                    self.tombstones[row] = True
+                self.delta[uid] = np.asarray(vec, dtype=np.float64)
+            if len(self.delta) > max(REBUILD_THRESHOLD, len(self.base_ids) // 10):
+                self._compact()
+
+    def remove(self, user_ids: List[int]) -> None:
+        """删除用户：主索引中的向量标记失效，缓冲区中的直接移除。"""
+        with self._lock:
+            for uid in user_ids:
+                uid = int(uid)
+                row = self.base_rows.get(uid)
+                if row is not None:
+                    self.tombstones[row] = True
+                self.delta.pop(uid, None)
+
+    def _compact(self) -> None:
+        """把缓冲区并入主索引并重建。"""
+        keep = ~self.tombstones
+        ids = np.concatenate([self.base_ids[keep], np.fromiter(self.delta.keys(), dtype=np.int64)])
+        vectors = np.vstack([self.base_vectors[keep]] + list(self.delta.values()))
+        self._build(ids, vectors)
+
+    def query(self, vector: np.ndarray, k: int, exclude: Optional[int] = None) -> List[tuple]:
+        """返回距离最近的 k 个 (用户ID, 距离)，按距离升序。"""
+        vector = np.asarray(vector, dtype=np.float64).reshape(1, -1)
+        with self._lock:
+            candidates = []
+            if self.tree is not None:
+                # 多取被失效/排除的数量，保证过滤后仍有 k 个有效结果
+                extra = int(self.tombstones.sum()) + 1
+                n = min(k + extra, len(self.base_ids))
+                dist, idx = self.tree.kneighbors(vector, n_neighbors=n)
+                for d, i in zip(dist[0], idx[0]):
+                    if not self.tombstones[i]:
+                        candidates.append((int(self.base_ids[i]), float(d)))
+            if self.delta:
+                ids = list(self.delta.keys())
+                dist = np.linalg.norm(np.vstack(list(self.delta.values())) - vector, axis=1)
+                candidates.extend((uid, float(d)) for uid, d in zip(ids, dist))
+        candidates = [c for c in candidates if c[0] != exclude]
+        candidates.sort(key=lambda c: (c[1], c[0]))
+        return candidates[:k]
+
+
+def _standardized(frame) -> np.ndarray:
+    return standardize_profiles(numeric_matrix(frame, CLUSTER_FEATURES))
+
+
+_index: Optional[SimilarityIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_similarity_index() -> SimilarityIndex:
+    """懒加载全局近邻索引；画像标准化模型重新训练后随之重建。"""
+    global _index
+    model = get_profile_model()
+    if _index is None or _index.model is not model:
+        with _index_lock:
+            if _index is None or _index.model is not model:
+                frame = data_service.df
+                _index = SimilarityIndex(frame['用户ID'].to_numpy(), _standardized(frame), model)
+    return _index
+
+
+def _on_metrics_changed(user_ids: List[int]) -> None:
+    index = _index
+    if index is None or index.model is not get_profile_model():
+        return
+    frame = data_service.df
+    changed = frame[frame['用户ID'].isin(user_ids)]
+    if not changed.empty:
+        index.upsert(changed['用户ID'].tolist(), _standardized(changed))
+    # 不在表中的用户已被删除
+    removed = set(user_ids) - set(changed['用户ID'].tolist())
+    if removed:
+        index.remove(list(removed))
+
+
+register_metrics_listener(_on_metrics_changed)
+
+
+def _summarize_peers(frame) -> Dict:
+    """汇总相似用户的结果指标。"""
+    if frame.empty:
+        return {}
+    scores = calculate_pension_scores_batch(frame)
+    personas = get_user_profiles_batch(frame)
+    balance = frame['养老金账户余额'].to_numpy(dtype=np.float64)
+    target = frame['目标养老金'].to_numpy(dtype=np.float64)
+    funded = np.divide(balance, target, out=np.zeros_like(balance), where=target > 0)
+    names, counts = np.unique(personas, return_counts=True)
+    return {
+        'avgScore': round(float(scores.mean()), 1),
+        'avgSavingsRate': round(float(frame['储蓄率'].mean()), 4),
+        'avgDebtRatio': round(float(frame['负债率'].mean()), 4),
+        'medianNetAssets': round(float(frame['净资产'].median()), 2),
+        'medianFundedRatio': round(float(np.median(funded)), 4),
+        'personaDistribution': {str(n): int(c) for n, c in zip(names, counts)},
+    }
+
+
+def find_similar_users(user_id: int, k: int = DEFAULT_NEIGHBORS) -> Optional[Dict]:
+    """返回与指定用户最相似的 k 个用户及其汇总结果，用户不存在时返回 None。"""
+    k = int(min(max(1, k), MAX_NEIGHBORS))
+    index = get_similarity_index()
+    vector = index.vector(user_id)
+    if vector is None:
+        return None
+    neighbors = index.query(vector, k, exclude=int(user_id))
+
+    frame = data_service.df
+    ids = [uid for uid, _ in neighbors]
+    peers = frame[frame['用户ID'].isin(ids)].set_index('用户ID').reindex(ids).reset_index()
+    scores = calculate_pension_scores_batch(peers) if not peers.empty else []
+    return {
+        'userId': int(user_id),
+        'k': k,
+        'neighbors': [
+            {
+                'userId': uid,
+                'distance': round(dist, 4),
+                'age': int(row['年龄']),
+                'city': str(row['所在城市']),
+                'score': int(score),
+                'savingsRate': round(float(row['储蓄率']), 4),
+                'netAssets': round(float(row['净资产']), 2),
+            }
+            for (uid, dist), row, score in zip(neighbors, peers.to_dict('records'), scores)
+        ],
+        'aggregate': _summarize_peers(peers),
+    }
@@ -0,0 +1,295 @@
+"""
+用户指标存储
+统一用户财务指标（用户表）与健康指标的读写入口，按环境变量 PENSION_STORAGE 选择后端：
+- csv（默认，开发用）：用户表读自 pension_mock_500.csv 并常驻内存，健康指标读写 mock_data.csv；
+- sqlite：两张表存于本地 SQLite，用户ID上建唯一索引，WAL 模式下多个读进程与一个写进程互不阻塞，
+  每个进程维护一个有上限的连接池，每条语句（或一个事务）借出一个连接、用完归还；
+  查询语句固定、参数化，由连接的语句缓存复用编译结果。
+首次使用 SQLite 时自动从两个 CSV 导入初始数据。
+用户表附带一个版本号，每次写入递增，各进程据此发现其他进程的写入并重新加载内存中的用户表。
+"""
+from __future__ import annotations
+
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from .schema_service import CATEGORICAL_COLUMNS, ID_COLUMN, normalize_user_ids, numeric_column, to_python
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+USERS_CSV_PATH = os.path.join(BASE_DIR, '..', 'data', 'pension_mock_500.csv')
+HEALTH_CSV_PATH = os.path.join(BASE_DIR, '..', 'data', 'mock_data.csv')
+DEFAULT_DB_PATH = os.path.join(BASE_DIR, '..', 'data', 'pension_metrics.db')
+
+STORAGE_ENV = 'PENSION_STORAGE'
+DB_PATH_ENV = 'PENSION_METRICS_DB'
+
+HEALTH_ID_COLUMN = 'user_id'
+# 新建健康记录时的缺省值
+HEALTH_DEFAULTS = {
+    'user_id': None,
+    'age': 40,
+    'MMSE': 25,
+    'PHQ9': 5,
+    'stress_level': 3,
+    'sleep_hours': 7,
+    'daily_steps': 5000,
+    'exercise_minutes': 30,
+    'mood_score': 5,
+    'fatigue_level': 3,
+    'cognitive_symptoms': 0,
+    'alcohol_consumption': 0,
+    'sleep_quality': 3,
+}
+IMPORT_CHUNK_ROWS = 50_000
+POOL_SIZE = 8            # 每个进程最多同时打开的 SQLite 连接数
+POOL_TIMEOUT = 30        # 连接全部借出时等待归还的秒数
+
+
+def configured_backend() -> str:
+    return os.environ.get(STORAGE_ENV, 'csv').strip().lower()
+
+
+class CsvStorage:
+    """开发用后端：用户表为内存中的 DataFrame（由 table 回调取得当前快照），健康指标整表读写 CSV。"""
+
+    name = 'csv'
+
+    def __init__(self, table: Callable[[], pd.DataFrame], users_path: str = USERS_CSV_PATH,
+                 health_path: str = HEALTH_CSV_PATH):
+        self._table = table
+        self.users_path = users_path
+        self.health_path = health_path
+        self._health_lock = threading.Lock()
+
+    def load_users(self) -> pd.DataFrame:
+        return pd.read_csv(self.users_path, dtype={c: 'category' for c in CATEGORICAL_COLUMNS})
+
+    def get_user(self, user_id: int) -> Optional[Dict[str, Any]]:
+        frame = self._table()
+        if frame.empty:
+            return None
+        user_data = frame[frame[ID_COLUMN] == int(user_id)]
+        if user_data.empty:
+            return None
+        # 转换为Python类型，避免numpy类型
+        return {key: to_python(value, key) for key, value in user_data.iloc[0].to_dict().items()}
+
+    def users_version(self) -> Optional[int]:
+        """CSV 模式下内存表即数据源，没有需要同步的版本。"""
+        return None
+
+    def write_users(self, rows: pd.DataFrame, deleted: Iterable[int] = ()) -> None:
+        """CSV 模式下用户表只在内存中更新，不回写文件。"""
+
+    def load_health(self) -> pd.DataFrame:
+        return pd.read_csv(self.health_path, dtype={HEALTH_ID_COLUMN: int})
+
+    def update_health(self, user_id: int, updates: Dict[str, Any]) -> None:
+        with self._health_lock:
+            df = self.load_health()
+            user_mask = df[HEALTH_ID_COLUMN] == user_id
+            if not user_mask.any():
+                # 如果用户不存在，创建新记录
+                new_row = {**HEALTH_DEFAULTS, HEALTH_ID_COLUMN: user_id}
+                new_row.update({k: v for k, v in updates.items() if k in new_row})
+                df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
+            else:
+                for key, value in updates.items():
+                    if key in df.columns:
+                        df.loc[user_mask, key] = value
+            df.to_csv(self.health_path, index=False)
+
+
+def _sql_type(dtype) -> str:
+    if pd.api.types.is_integer_dtype(dtype) or pd.api.types.is_bool_dtype(dtype):
+        return 'INTEGER'
+    if pd.api.types.is_float_dtype(dtype):
+        return 'REAL'
+    return 'TEXT'
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _records(frame: pd.DataFrame) -> List[tuple]:
+    """DataFrame 转为 Python 值的元组列表，缺失值为 None。"""
+    values = frame.astype(object).where(frame.notna(), None)
+    return [tuple(v.item() if isinstance(v, np.generic) else v for v in row)
+            for row in values.itertuples(index=False, name=None)]
+
+
+class SqliteStorage:
+    """SQLite 后端。"""
+
+    name = 'sqlite'
+
+    def __init__(self, path: str, users_csv: str = USERS_CSV_PATH, health_csv: str = HEALTH_CSV_PATH):
+        self.path = path
+        self.users_csv = users_csv
+        self.health_csv = health_csv
+        self._pool: Optional[queue.LifoQueue] = None
+        self._pool_pid = None
+        self._pool_lock = threading.Lock()
+        # fork 前父进程打开的连接：子进程中不能使用也不能关闭，只保留引用
+        self._inherited: List[sqlite3.Connection] = []
+        self._columns: Dict[str, List[str]] = {}
+        self._initialize()
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, cached_statements=256,
+                               check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _current_pool(self) -> queue.LifoQueue:
+        """当前进程的连接池；fork 出的子进程（多 worker 部署）重建连接池，不沿用父进程的连接。"""
+        pid = os.getpid()
+        if self._pool_pid != pid:
+            with self._pool_lock:
+                if self._pool_pid != pid:
+                    if self._pool is not None:
+                        self._inherited.extend(c for c in list(self._pool.queue) if c is not None)
+                    # 空位用 None 占位，借出时再建立连接；后进先出，优先复用已打开的连接
+                    pool = queue.LifoQueue(maxsize=POOL_SIZE)
+                    for _ in range(POOL_SIZE):
+                        pool.put_nowait(None)
+                    self._pool, self._pool_pid = pool, pid
+        return self._pool
+
+    @contextmanager
+    def _connection(self) -> Iterator[sqlite3.Connection]:
+        """从连接池借出一个连接，语句（或事务）执行完后归还。"""
+        pool = self._current_pool()
+        try:
+            conn = pool.get(timeout=POOL_TIMEOUT)
+        except queue.Empty:
+            raise sqlite3.OperationalError(f'no free SQLite connection after {POOL_TIMEOUT}s') from None
+        try:
+            if conn is None:
+                conn = self._open()
+            yield conn
+        finally:
+            pool.put_nowait(conn)
+
+    def _initialize(self) -> None:
+        """建表并在表为空时从 CSV 导入；多个进程同时启动时由写锁保证只导入一次。"""
+        with self._connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+                if 'users' not in existing:
+                    self._import_csv(conn, 'users', self.users_csv, ID_COLUMN)
+                if 'health_metrics' not in existing:
+                    self._import_csv(conn, 'health_metrics', self.health_csv, HEALTH_ID_COLUMN)
+                if 'users_version' not in existing:
+                    conn.execute('CREATE TABLE users_version (id INTEGER PRIMARY KEY CHECK (id = 0), '
+                                 'version INTEGER NOT NULL)')
+                    conn.execute('INSERT INTO users_version VALUES (0, 0)')
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            for table in ('users', 'health_metrics'):
+                self._columns[table] = [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+
+    @staticmethod
+    def _import_csv(conn: sqlite3.Connection, table: str, path: str, id_column: str) -> None:
+        created = False
+        for chunk in pd.read_csv(path, chunksize=IMPORT_CHUNK_ROWS):
+            chunk[id_column] = normalize_user_ids(chunk[id_column])
+            if not created:
+                columns = ', '.join(f'{_quote(c)} {_sql_type(chunk[c].dtype)}' for c in chunk.columns)
+                conn.execute(f'CREATE TABLE {table} ({columns})')
+                conn.execute(f'CREATE UNIQUE INDEX idx_{table}_id ON {table} ({_quote(id_column)})')
+                created = True
+            placeholders = ', '.join('?' * len(chunk.columns))
+            names = ', '.join(_quote(c) for c in chunk.columns)
+            conn.executemany(f'INSERT INTO {table} ({names}) VALUES ({placeholders})', _records(chunk))
+
+    def _select_one(self, table: str, id_column: str, user_id: int) -> Optional[Dict[str, Any]]:
+        with self._connection() as conn:
+            cursor = conn.execute(f'SELECT * FROM {table} WHERE {_quote(id_column)} = ?', (int(user_id),))
+            row = cursor.fetchone()
+            columns = [d[0] for d in cursor.description]
+        if row is None:
+            return None
+        return dict(zip(columns, row))
+
+    def load_users(self) -> pd.DataFrame:
+        with self._connection() as conn:
+            return pd.read_sql_query('SELECT * FROM users', conn)
+
+    def get_user(self, user_id: int) -> Optional[Dict[str, Any]]:
+        return self._select_one('users', ID_COLUMN, user_id)
+
+    def users_version(self) -> Optional[int]:
+        with self._connection() as conn:
+            return conn.execute('SELECT version FROM users_version').fetchone()[0]
+
+    def write_users(self, rows: pd.DataFrame, deleted: Iterable[int] = ()) -> tuple:
+        """在一个事务内写入（覆盖）整行、删除指定用户并递增用户表版本，返回 (写入前版本, 写入后版本)。"""
+        columns = [c for c in rows.columns if c in self._columns['users']]
+        names = ', '.join(_quote(c) for c in columns)
+        assignments = ', '.join(f'{_quote(c)} = excluded.{_quote(c)}' for c in columns if c != ID_COLUMN)
+        deleted = [(int(uid),) for uid in deleted]
+        rows = rows[columns].copy()
+        for column in columns:
+            if rows[column].dtype == np.float32:
+                # 按类型定义的小数位还原，不把 float32 的表示误差写入数据库
+                rows[column] = numeric_column(rows, column)
+        with self._connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if not rows.empty:
+                    conn.executemany(
+                        f'INSERT INTO users ({names}) VALUES ({", ".join("?" * len(columns))}) '
+                        f'ON CONFLICT({_quote(ID_COLUMN)}) DO UPDATE SET {assignments}',
+                        _records(rows),
+                    )
+                if deleted:
+                    conn.executemany(f'DELETE FROM users WHERE {_quote(ID_COLUMN)} = ?', deleted)
+                version = conn.execute('SELECT version FROM users_version').fetchone()[0]
+                conn.execute('UPDATE users_version SET version = ?', (version + 1,))
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        return version, version + 1
+
+    def load_health(self) -> pd.DataFrame:
+        with self._connection() as conn:
+            return pd.read_sql_query('SELECT * FROM health_metrics', conn)
+
+    def update_health(self, user_id: int, updates: Dict[str, Any]) -> None:
+        """新用户按缺省值插入；已有用户只更新给出的字段。未知字段忽略。"""
+        known = self._columns['health_metrics']
+        values = {k: v for k, v in updates.items() if k in known and k != HEALTH_ID_COLUMN}
+        row = {**{k: v for k, v in HEALTH_DEFAULTS.items() if k in known}, **values, HEALTH_ID_COLUMN: int(user_id)}
+        names = ', '.join(_quote(c) for c in row)
+        conflict = ', '.join(f'{_quote(c)} = excluded.{_quote(c)}' for c in values) if values else None
+        sql = (f'INSERT INTO health_metrics ({names}) VALUES ({", ".join("?" * len(row))}) '
+               f'ON CONFLICT({_quote(HEALTH_ID_COLUMN)}) DO ' + (f'UPDATE SET {conflict}' if conflict else 'NOTHING'))
+        with self._connection() as conn:
+            conn.execute(sql, [v.item() if isinstance(v, np.generic) else v for v in row.values()])
+
+
+def create_storage(table: Callable[[], pd.DataFrame]) -> Any:
+    """按 PENSION_STORAGE 创建后端；SQLite 不可用时回退到 CSV。table 为取得内存用户表的回调（CSV 模式使用）。"""
+    backend = configured_backend()
+    if backend == 'sqlite':
+        try:
+            return SqliteStorage(os.environ.get(DB_PATH_ENV, DEFAULT_DB_PATH))
+        except (sqlite3.Error, OSError) as e:
+            print(f"SQLite storage error: {e}, falling back to CSV")
+    elif backend != 'csv':
+        print(f"Unknown storage backend '{backend}', using CSV")
+    return CsvStorage(table)
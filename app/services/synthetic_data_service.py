@@ -0,0 +1,235 @@
+"""
+合成用户数据生成
+从样本用户表学习各列的边缘分布与列间相关性（高斯 Copula），批量生成任意规模的一致合成用户：
+汇总字段（月总流入、总资产、总负债、净资产、负债率、储蓄率）由分项重新计算，保证口径一致。
+按分块并行生成、顺序写出，内存占用只与分块大小和在途分块数有关。
+"""
+from __future__ import annotations
+
+import argparse
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+from scipy.special import ndtr, ndtri
+
+from .schema_service import DERIVED_COLUMNS, ID_COLUMN, derive_fields, numeric_column
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOURCE_PATH = os.path.join(BASE_DIR, '..', 'data', 'pension_mock_500.csv')
+
+
+def _decimals(values: np.ndarray, max_decimals: int = 4) -> int:
+    """样本值的小数位数，生成值按此取整。"""
+    for d in range(max_decimals + 1):
+        if np.allclose(values, np.round(values, d), rtol=0, atol=1e-9):
+            return d
+    return max_decimals
+
+
+class CopulaModel:
+    """高斯 Copula：每列用经验分位函数作边缘分布，列间依赖用正态得分的相关矩阵表示。
+    分类列按频数排序后视作离散有序变量，同样参与相关性建模。"""
+
+    def __init__(self, columns: List[str], numeric: Dict[str, Dict], categorical: Dict[str, Dict],
+                 cholesky: np.ndarray, order: List[str]):
+        self.columns = columns          # 参与建模的列（Copula 的维度顺序）
+        self.numeric = numeric          # 列 -> {'values': 排序后的样本, 'decimals': 小数位}
+        self.categorical = categorical  # 列 -> {'categories': 类别, 'cumulative': 累计概率}
+        self.cholesky = cholesky
+        self.order = order              # 输出列顺序（与样本表一致）
+
+    @classmethod
+    def fit(cls, frame: pd.DataFrame) -> "CopulaModel":
+        order = list(frame.columns)
+        columns = [c for c in order if c != ID_COLUMN and c not in DERIVED_COLUMNS]
+        n = len(frame)
+        numeric, categorical = {}, {}
+        scores = np.empty((n, len(columns)))
+        for j, column in enumerate(columns):
+            series = frame[column]
+            if pd.api.types.is_numeric_dtype(series):
+                values = numeric_column(frame, column)
+                values = np.where(np.isnan(values), np.nanmedian(values), values)
+                numeric[column] = {'values': np.sort(values), 'decimals': _decimals(values)}
+                ranks = pd.Series(values).rank(method='average').to_numpy()
+            else:
+                series = series.astype(object).fillna('未知')
+                counts = series.value_counts()
+                categorical[column] = {
+                    'categories': counts.index.to_numpy(dtype=object),
+                    'cumulative': np.cumsum(counts.to_numpy()) / counts.sum(),
+                }
+                codes = series.map({c: i for i, c in enumerate(counts.index)})
+                ranks = codes.rank(method='average').to_numpy()
+            scores[:, j] = ndtri(ranks / (n + 1))
+
+        corr = np.corrcoef(scores, rowvar=False)
+        # 数值误差可能使相关矩阵略非正定，截断负特征值后重新归一化
+        eigenvalues, eigenvectors = np.linalg.eigh(corr)
+        corr = eigenvectors @ np.diag(np.clip(eigenvalues, 1e-6, None)) @ eigenvectors.T
+        d = np.sqrt(np.diag(corr))
+        corr = corr / np.outer(d, d)
+        return cls(columns, numeric, categorical, np.linalg.cholesky(corr), order)
+
+    def sample(self, n: int, rng: np.random.Generator) -> pd.DataFrame:
+        """生成 n 行（不含用户ID），汇总字段已重新计算。"""
+        u = ndtr(rng.standard_normal((n, len(self.columns))) @ self.cholesky.T)
+        data = {}
+        for j, column in enumerate(self.columns):
+            if column in self.numeric:
+                spec = self.numeric[column]
+                values = spec['values']
+                x = np.interp(u[:, j] * (len(values) - 1), np.arange(len(values)), values)
+                data[column] = np.round(x, spec['decimals'])
+                if spec['decimals'] == 0:
+                    data[column] = data[column].astype(np.int64)
+            else:
+                spec = self.categorical[column]
+                idx = np.minimum(np.searchsorted(spec['cumulative'], u[:, j]), len(spec['categories']) - 1)
+                data[column] = spec['categories'][idx]
+        frame = derive_fields(pd.DataFrame(data))
+        return frame[[c for c in self.order if c in frame.columns]]
+
+
+def format_user_ids(start: int, count: int, width: int) -> np.ndarray:
+    """生成 'U000001' 形式的用户ID（与样本表相同）。"""
+    return np.char.add('U', np.char.zfill(np.arange(start, start + count).astype(str), width))
+
+
+_worker_model: Optional[CopulaModel] = None
+
+
+def _init_worker(model: CopulaModel) -> None:
+    global _worker_model
+    _worker_model = model
+
+
+def _generate_chunk(start: int, count: int, seed: int, index: int, width: int) -> pd.DataFrame:
+    # 每个分块的随机数流只由 (seed, 分块序号) 决定，结果与并行度无关
+    frame = _worker_model.sample(count, np.random.default_rng([seed, index]))
+    frame.insert(0, ID_COLUMN, format_user_ids(start, count, width))
+    return frame
+
+
+def _produce_chunk(start: int, count: int, seed: int, index: int, width: int, fmt: str):
+    """在工作进程中生成分块；CSV 在工作进程内直接格式化为文本，主进程只负责顺序写出。"""
+    frame = _generate_chunk(start, count, seed, index, width)
+    if fmt == 'csv':
+        return frame.to_csv(None, header=index == 0, index=False)
+    return frame
+
+
+class _ChunkWriter:
+    """顺序写出分块：CSV 文本直接追加；Parquet 用 pyarrow 的 ParquetWriter 分行组写入。"""
+
+    def __init__(self, path: str, fmt: str):
+        self.path = path
+        self.fmt = fmt
+        self._writer = None
+        self._file = open(path, 'w', encoding='utf-8', newline='') if fmt == 'csv' else None
+
+    def write(self, chunk) -> None:
+        if self.fmt == 'parquet':
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.path, table.schema)
+            self._writer.write_table(table)
+        else:
+            self._file.write(chunk)
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+        if self._file is not None:
+            self._file.close()
+
+
+def _resolve_output(output: str, fmt: str) -> (str, str):
+    base, _ = os.path.splitext(output)
+    if fmt in ('auto', 'parquet'):
+        try:
+            import pyarrow.parquet  # noqa: F401
+            return base + '.parquet', 'parquet'
+        except ImportError:
+            if fmt == 'parquet':
+                raise
+            print("Parquet engine not available, writing CSV instead")
+    return base + '.csv', 'csv'
+
+
+def generate_population(n_users: int, output: str, fmt: str = 'auto', chunk_size: int = 100_000,
+                        workers: Optional[int] = None, seed: int = 0, source: str = SOURCE_PATH,
+                        max_in_flight: Optional[int] = None,
+                        progress: Optional[Callable[[int, int], None]] = None) -> str:
+    """生成 n_users 个合成用户写入 output，返回实际写出的路径。
+
+    fmt 为 auto 时优先 Parquet，缺少 pyarrow 时写 CSV。分块按序号顺序写出，同时在途的分块数有上限。
+    """
+    model = CopulaModel.fit(pd.read_csv(source))
+    path, fmt = _resolve_output(output, fmt)
+    width = max(6, len(str(n_users)))
+    starts = list(range(1, n_users + 1, chunk_size))
+    tasks = [(start, min(chunk_size, n_users + 1 - start), seed, i, width, fmt) for i, start in enumerate(starts)]
+
+    writer = _ChunkWriter(path, fmt)
+    written = 0
+    try:
+        if workers == 1:
+            _init_worker(model)
+            for task in tasks:
+                writer.write(_produce_chunk(*task))
+                written += task[1]
+                if progress:
+                    progress(written, n_users)
+            return path
+
+        workers = workers or os.cpu_count() or 1
+        max_in_flight = max_in_flight or workers * 2
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(model,)) as pool:
+            pending = deque()
+            for task in tasks:
+                pending.append((task[1], pool.submit(_produce_chunk, *task)))
+                if len(pending) >= max_in_flight:
+                    count, future = pending.popleft()
+                    writer.write(future.result())
+                    written += count
+                    if progress:
+                        progress(written, n_users)
+            while pending:
+                count, future = pending.popleft()
+                writer.write(future.result())
+                written += count
+                if progress:
+                    progress(written, n_users)
+    finally:
+        writer.close()
+    return path
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='按样本用户表的分布生成大规模合成用户')
+    parser.add_argument('n_users', type=int, help='生成的用户数')
+    parser.add_argument('--output', default='synthetic_users', help='输出文件（不含扩展名）')
+    parser.add_argument('--format', choices=('auto', 'parquet', 'csv'), default='auto')
+    parser.add_argument('--chunk-size', type=int, default=100_000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--source', default=SOURCE_PATH, help='用于学习分布的样本表')
+    args = parser.parse_args(argv)
+
+    def report(done: int, total: int) -> None:
+        print(f"{done}/{total} users ({done / total:.0%})", flush=True)
+
+    path = generate_population(args.n_users, args.output, args.format, args.chunk_size, args.workers,
+                               args.seed, args.source, progress=report)
+    print(f"Generated {args.n_users} users -> {path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+分阶段计时服务
+以装饰器或上下文管理器标记业务阶段，在一次请求内收集各阶段耗时并生成 Server-Timing 响应头。
+未开始收集（非请求上下文或计时已关闭）时，每次调用只多一次 ContextVar 读取。
+"""
+from __future__ import annotations
+
+import contextvars
+import os
+import time
+from collections import OrderedDict
+from functools import wraps
+from typing import Callable, Dict, List, Optional, Tuple
+
+# 设置环境变量 PENSION_SERVER_TIMING=0 可关闭计时
+ENABLED = os.environ.get('PENSION_SERVER_TIMING', '1') not in ('0', 'false', 'False', '')
+
+_collector: "contextvars.ContextVar[Optional[List[Tuple[str, float]]]]" = contextvars.ContextVar(
+    'timing_collector', default=None)
+
+# 阶段结束时的观察者（如指标服务），参数为 (阶段名, 秒)
+_observers: List[Callable[[str, float], None]] = []
+
+
+def register_stage_observer(callback: Callable[[str, float], None]) -> None:
+    """登记阶段耗时观察者；只在有收集器的请求中被调用。"""
+    _observers.append(callback)
+
+
+def _record(spans: List[Tuple[str, float]], name: str, seconds: float) -> None:
+    spans.append((name, seconds))
+    for callback in _observers:
+        try:
+            callback(name, seconds)
+        except Exception as e:
+            print(f"Stage observer error: {e}")
+
+
+def timed(name: str):
+    """把函数调用记为名为 name 的阶段。"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            spans = _collector.get()
+            if spans is None:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _record(spans, name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+class _Span:
+    __slots__ = ('name', 'spans', 'start')
+
+    def __init__(self, name: str, spans: List[Tuple[str, float]]):
+        self.name = name
+        self.spans = spans
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        _record(self.spans, self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name: str):
+    """with span('stage'): ... 记录代码块耗时。"""
+    spans = _collector.get()
+    return _NULL_SPAN if spans is None else _Span(name, spans)
+
+
+def start_collection() -> Optional[contextvars.Token]:
+    """在当前上下文开始收集阶段耗时，返回用于结束收集的令牌；计时关闭时返回 None。"""
+    if not ENABLED:
+        return None
+    return _collector.set([])
+
+
+def finish_collection(token: Optional[contextvars.Token]) -> "OrderedDict[str, Tuple[float, int]]":
+    """结束收集，返回 阶段名 -> (总耗时毫秒, 次数)，按首次出现顺序。"""
+    if token is None:
+        return OrderedDict()
+    spans = _collector.get() or []
+    _collector.reset(token)
+    stages: "OrderedDict[str, Tuple[float, int]]" = OrderedDict()
+    for name, seconds in spans:
+        total, count = stages.get(name, (0.0, 0))
+        stages[name] = (total + seconds * 1000, count + 1)
+    return stages
+
+
+def server_timing_header(stages: Dict[str, Tuple[float, int]], total_ms: Optional[float] = None) -> str:
+    """生成 Server-Timing 头，如 'profile;dur=3.1, risk;dur=12.0;desc="x2", total;dur=20.5'。"""
+    parts = []
+    for name, (ms, count) in stages.items():
+        part = f"{name};dur={ms:.1f}"
+        if count > 1:
+            part += f';desc="x{count}"'
+        parts.append(part)
+    if total_ms is not None:
+        parts.append(f"total;dur={total_ms:.1f}")
+    return ", ".join(parts)
+
+
+def init_app(app) -> None:
+    """为 Flask 应用的每个请求收集阶段耗时并写入 Server-Timing 响应头。"""
+    from flask import g
+
+    if not ENABLED:
+        return
+
+    @app.before_request
+    def _start_timing():
+        g.timing_token = start_collection()
+        g.timing_start = time.perf_counter()
+
+    @app.after_request
+    def _add_server_timing(response):
+        token = g.pop('timing_token', None)
+        if token is not None:
+            stages = finish_collection(token)
+            total_ms = (time.perf_counter() - g.pop('timing_start')) * 1000
+            response.headers['Server-Timing'] = server_timing_header(stages, total_ms)
+        return response
+
+    @app.teardown_request
+    def _reset_timing(exc):
+        # 未经过 after_request（如未处理的异常）时也要结束收集
+        token = g.pop('timing_token', None)
+        if token is not None:
+            finish_collection(token)
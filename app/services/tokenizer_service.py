@@ -0,0 +1,271 @@
+"""
+中文分词服务
+词典编译为扁平的前缀树文件后以内存映射方式只读加载，多个工作进程共享同一份物理页；
+提供正向最大匹配分词，并缓存最近的分词结果。
+"""
+from __future__ import annotations
+
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+import unicodedata
+import zlib
+from array import array
+from bisect import bisect_left
+from collections import deque
+from typing import Iterable, List, Optional, Tuple
+
+from .cache_service import LRUCache
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DICT_PATH = os.path.join(BASE_DIR, '..', 'data', 'tokenizer_dict.txt')
+DEFAULT_CACHE_DIR = os.path.join(BASE_DIR, '..', 'data', 'tokenizer_cache')
+
+# 文件头：魔数、版本、字节序标记、节点数、边数
+_MAGIC = b'PTRI'
+_VERSION = 1
+_HEADER = struct.Struct('=4sIIII')
+_BYTE_ORDER = 1 if sys.byteorder == 'little' else 2
+
+_registered_words: set = set()
+_segment_cache = LRUCache(8192, name="tokenizer.segment")
+
+
+class TrieDictionary:
+    """只读前缀树。
+
+    节点表每个节点 3 个 uint32：子边起始下标、子边数量、是否成词；
+    子边按字符码点升序连续存放（labels 与 targets 两个 uint32 数组），查找子节点用二分。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, order, n_nodes, n_edges = _HEADER.unpack_from(self._mmap, 0)
+        if magic != _MAGIC or version != _VERSION or order != _BYTE_ORDER:
+            raise ValueError(f"incompatible trie file: {path}")
+        words = memoryview(self._mmap)[_HEADER.size:].cast('I')
+        self.nodes = words[:3 * n_nodes]
+        self.labels = words[3 * n_nodes:3 * n_nodes + n_edges]
+        self.targets = words[3 * n_nodes + n_edges:3 * n_nodes + 2 * n_edges]
+        self._words = words
+        self.size = n_nodes
+
+    def close(self) -> None:
+        """释放内存映射与文件句柄（先释放引用映射的视图，否则映射无法关闭）。"""
+        for view in (self.nodes, self.labels, self.targets, self._words):
+            view.release()
+        self._mmap.close()
+        self._file.close()
+
+    def longest_match(self, text: str, start: int) -> int:
+        """返回从 start 开始能匹配到的最长词的长度，无匹配时为 0。"""
+        nodes, labels, targets = self.nodes, self.labels, self.targets
+        node, best, i, n = 0, 0, start, len(text)
+        while i < n:
+            lo = nodes[3 * node]
+            hi = lo + nodes[3 * node + 1]
+            cp = ord(text[i])
+            k = bisect_left(labels, cp, lo, hi)
+            if k == hi or labels[k] != cp:
+                break
+            node = targets[k]
+            i += 1
+            if nodes[3 * node + 2]:
+                best = i - start
+        return best
+
+    def __contains__(self, word: str) -> bool:
+        nodes, labels, targets = self.nodes, self.labels, self.targets
+        node = 0
+        for ch in word:
+            lo = nodes[3 * node]
+            hi = lo + nodes[3 * node + 1]
+            k = bisect_left(labels, ord(ch), lo, hi)
+            if k == hi or labels[k] != ord(ch):
+                return False
+            node = targets[k]
+        return bool(nodes[3 * node + 2])
+
+
+def compile_trie(words: Iterable[str], path: str) -> None:
+    """把词表编译为扁平前缀树文件（先写临时文件再原子替换，多进程同时编译也安全）。"""
+    root: dict = {}
+    for word in words:
+        node = root
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[''] = True
+
+    # 广度优先编号，保证每个节点的子边连续
+    nodes = array('I')
+    labels = array('I')
+    targets = array('I')
+    order = [root]
+    queue = deque([(root, 0)])
+    nodes.extend((0, 0, 0))
+    while queue:
+        node, node_id = queue.popleft()
+        children = sorted((ch, child) for ch, child in node.items() if ch)
+        nodes[3 * node_id] = len(labels)
+        nodes[3 * node_id + 1] = len(children)
+        nodes[3 * node_id + 2] = 1 if node.get('') else 0
+        for ch, child in children:
+            child_id = len(order)
+            order.append(child)
+            labels.append(ord(ch))
+            targets.append(child_id)
+            nodes.extend((0, 0, 0))
+            queue.append((child, child_id))
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, _VERSION, _BYTE_ORDER, len(order), len(labels)))
+            nodes.tofile(f)
+            labels.tofile(f)
+            targets.tofile(f)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def load_words(path: str = DICT_PATH) -> List[str]:
+    words = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            word = line.strip().split()[0] if line.strip() else ''
+            if word and not word.startswith('#'):
+                words.append(word)
+    return words
+
+
+def register_words(words: Iterable[str]) -> None:
+    """并入额外的词（如各服务的关键词表），下次获取分词器时生效。"""
+    global _tokenizer
+    new = {w.strip().lower() for w in words if w and w.strip()} - _registered_words
+    if new:
+        with _tokenizer_lock:
+            _registered_words.update(new)
+            old, _tokenizer = _tokenizer, None
+            _segment_cache.clear()
+        if old is not None:
+            # 旧词典的映射在正在使用它的分词结束后关闭
+            old.retire()
+
+
+def _is_word_char(ch: str) -> bool:
+    return ch.isascii() and ch.isalnum()
+
+
+class Tokenizer:
+    """正向最大匹配分词：词典中的最长词优先，连续的英文字母/数字合为一个词，
+    空白与标点不作为词输出，其余未登录字单字成词。"""
+
+    def __init__(self, trie: TrieDictionary):
+        self.trie = trie
+        # 正在分词的调用数；被替换（retire）后最后一个调用结束时关闭词典
+        self._active = 0
+        self._retired = False
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def retire(self) -> None:
+        """分词器已被替换：不再接受新的调用，进行中的调用结束后关闭词典。"""
+        with self._lock:
+            self._retired = True
+            close = self._active == 0 and not self._closed
+            self._closed = self._closed or close
+        if close:
+            self.trie.close()
+
+    def segment(self, text: str) -> Tuple[str, ...]:
+        with self._lock:
+            retired = self._retired
+            if not retired:
+                self._active += 1
+        if retired:
+            # 替换前取得旧分词器的调用改用当前分词器
+            return get_tokenizer().segment(text)
+        try:
+            return self._segment(text)
+        finally:
+            with self._lock:
+                self._active -= 1
+                close = self._retired and self._active == 0 and not self._closed
+                self._closed = self._closed or close
+            if close:
+                self.trie.close()
+
+    def _segment(self, text: str) -> Tuple[str, ...]:
+        tokens = []
+        i, n = 0, len(text)
+        while i < n:
+            ch = text[i]
+            if _is_word_char(ch):
+                j = i + 1
+                while j < n and (_is_word_char(text[j]) or (text[j] == '.' and text[j - 1].isdigit()
+                                                            and j + 1 < n and text[j + 1].isdigit())):
+                    j += 1
+                tokens.append(text[i:j])
+                i = j
+                continue
+            if ch.isspace() or unicodedata.category(ch)[0] in 'PSZC':
+                i += 1
+                continue
+            length = self.trie.longest_match(text, i) or 1
+            tokens.append(text[i:i + length])
+            i += length
+        return tuple(tokens)
+
+
+_tokenizer: Optional[Tokenizer] = None
+_tokenizer_lock = threading.RLock()
+
+
+def get_tokenizer() -> Tokenizer:
+    """懒加载共享分词器：按词表内容的校验和命名编译文件，已存在则直接映射，不重复编译。"""
+    global _tokenizer
+    tokenizer = _tokenizer
+    if tokenizer is None:
+        with _tokenizer_lock:
+            if _tokenizer is None:
+                words = sorted(set(w.lower() for w in load_words()) | _registered_words)
+                checksum = zlib.crc32('\n'.join(words).encode('utf-8'))
+                cache_dir = os.environ.get('PENSION_TOKENIZER_CACHE', DEFAULT_CACHE_DIR)
+                path = os.path.join(cache_dir, f"dict-{checksum:08x}.trie")
+                if not os.path.exists(path):
+                    compile_trie(words, path)
+                _tokenizer = Tokenizer(TrieDictionary(path))
+            tokenizer = _tokenizer
+    return tokenizer
+
+
+def segment(text: str) -> Tuple[str, ...]:
+    """分词（带 LRU 缓存），返回不含空白与标点的词元组。"""
+    if not text:
+        return ()
+    tokens = _segment_cache.get(text)
+    if tokens is None:
+        tokens = get_tokenizer().segment(text)
+        _segment_cache.put(text, tokens)
+    return tokens
+
+
+def ngrams(tokens: Tuple[str, ...], max_n: int = 4) -> set:
+    """由相邻词拼接出的所有不超过 max_n 个词的片段，用于按词边界匹配多词关键词。"""
+    grams = set()
+    for i in range(len(tokens)):
+        joined = ''
+        for j in range(i, min(i + max_n, len(tokens))):
+            joined += tokens[j]
+            grams.add(joined)
+    return grams
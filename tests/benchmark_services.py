@@ -0,0 +1,208 @@
+"""
+服务层基准测试
+在多个数据规模下测量各热点函数的耗时，结果写入 JSON；指定基线文件时逐项比较中位数，
+超过阈值即视为性能回退，以非零状态退出（可用于 CI）。
+
+用法：
+    python tests/benchmark_services.py --sizes 500 5000 50000 --output bench.json
+    python tests/benchmark_services.py --baseline bench.json --threshold 0.2
+
+不在 pytest 的收集范围内（文件名不以 test_ 开头）。
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# 基准测试产生的对话历史写入临时目录，不污染 data/
+os.environ.setdefault('PENSION_CHAT_HISTORY_DIR', tempfile.mkdtemp(prefix='pension-bench-history-'))
+
+from app.services import data_service, future_service
+from app.services.analysis_service import get_dashboard_analysis, get_user_profile
+from app.services.data_service import (
+    calculate_pension_score, get_latest_metrics, pension_risk_assessment, predict_future_trend_nn,
+)
+from app.services.future_service import simulate_future
+from app.services.knowledge_graph_service import search_knowledge
+from app.services.nlp_service import process_user_message
+from app.services.schema_service import apply_schema
+from app.services.synthetic_data_service import CopulaModel
+
+DEFAULT_SIZES = (500, 5000, 50000)
+DEFAULT_THRESHOLD = 0.2
+
+MESSAGES = (
+    "最近睡眠不好，每天只睡5小时，压力很大",
+    "我想了解一下养老金怎么规划",
+    "今天心情不错，走了8000步",
+    "感觉记忆力下降，有点焦虑",
+    "退休后每月能领多少钱？",
+)
+QUERIES = ("养老金", "退休规划", "睡眠", "资产配置", "记忆力")
+
+
+def scale_users(base: pd.DataFrame, n: int, seed: int = 0) -> pd.DataFrame:
+    """由样本表生成 n 个合成用户（高斯 Copula，保留各列分布与相关性），用户ID为 1..n，列类型与服务层一致。"""
+    frame = CopulaModel.fit(base).sample(n, np.random.default_rng(seed))
+    frame.insert(0, '用户ID', np.arange(1, n + 1, dtype=np.int64))
+    return apply_schema(frame)
+
+
+@contextlib.contextmanager
+def use_dataset(frame: pd.DataFrame) -> Iterator[None]:
+    """临时替换服务层的用户表；画像模型、同群与近邻索引随表代数变化自动重建。"""
+    original = data_service.df
+    data_service.replace_users(frame)
+    future_service._simulation_memo.clear()
+    try:
+        yield
+    finally:
+        data_service.replace_users(original)
+        future_service._simulation_memo.clear()
+
+
+def _cycle(values: Sequence, state: List[int]):
+    state[0] += 1
+    return values[state[0] % len(values)]
+
+
+def build_benchmarks(n_users: int, seed: int = 0) -> Dict[str, Callable[[], object]]:
+    """每个基准是一个无参函数，每次调用处理一个随机用户（或一条消息/查询）。"""
+    rng = np.random.default_rng(seed)
+    user_ids = rng.integers(1, n_users + 1, size=1024).tolist()
+    state = [0]
+    metrics_pool = [get_latest_metrics(uid) for uid in user_ids[:64]]
+
+    def next_user():
+        return _cycle(user_ids, state)
+
+    def next_metrics():
+        return _cycle(metrics_pool, state)
+
+    return {
+        'get_latest_metrics': lambda: get_latest_metrics(next_user()),
+        'calculate_pension_score': lambda: calculate_pension_score(next_metrics()),
+        'get_user_profile': lambda: get_user_profile(next_metrics()),
+        'pension_risk_assessment': lambda: pension_risk_assessment(next_metrics()),
+        'predict_future_trend_nn': lambda: predict_future_trend_nn(next_metrics(), days_ahead=28),
+        'get_dashboard_analysis': lambda: get_dashboard_analysis(next_user()),
+        'simulate_future': lambda: simulate_future(next_user(), {
+            'savings_increase': int(rng.integers(0, 21)) * 500,
+            'investment_increase': int(rng.integers(0, 21)) * 250,
+            'retirement_age_adjust': int(rng.integers(-5, 6)),
+            'days': 30,
+        }),
+        'process_user_message': lambda: process_user_message(_cycle(MESSAGES, state), "稳健型",
+                                                              user_id=next_user()),
+        'search_knowledge': lambda: search_knowledge(_cycle(QUERIES, state)),
+    }
+
+
+# 单次调用耗时较长（每次重新训练模型）的基准减少重复次数
+SLOW_BENCHMARKS = {'pension_risk_assessment', 'predict_future_trend_nn', 'get_dashboard_analysis'}
+
+
+def measure(func: Callable[[], object], repeat: int, warmup: int = 1) -> Dict[str, float]:
+    """逐次计时，返回毫秒统计。"""
+    for _ in range(warmup):
+        func()
+    samples = np.empty(repeat)
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples[i] = (time.perf_counter() - start) * 1000
+    return {
+        'repeat': repeat,
+        'min_ms': round(float(samples.min()), 4),
+        'median_ms': round(float(np.median(samples)), 4),
+        'p95_ms': round(float(np.percentile(samples, 95)), 4),
+        'mean_ms': round(float(samples.mean()), 4),
+    }
+
+
+def run(sizes: Sequence[int], repeat: int = 50, slow_repeat: int = 5, only: Optional[Sequence[str]] = None,
+        seed: int = 0) -> Dict:
+    base = data_service.df
+    results: Dict[str, Dict[str, Dict[str, float]]] = {}
+    for size in sizes:
+        frame = base if size == len(base) else scale_users(base, size, seed)
+        with use_dataset(frame):
+            benchmarks = build_benchmarks(size, seed)
+            size_results = {}
+            for name, func in benchmarks.items():
+                if only and name not in only:
+                    continue
+                stats = measure(func, slow_repeat if name in SLOW_BENCHMARKS else repeat)
+                size_results[name] = stats
+                print(f"[{size:>9}] {name:<26} median {stats['median_ms']:>10.3f} ms  p95 {stats['p95_ms']:>10.3f} ms")
+            results[str(size)] = size_results
+    return {
+        'meta': {
+            'created': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'sizes': list(sizes),
+            'seed': seed,
+        },
+        'results': results,
+    }
+
+
+def compare(current: Dict, baseline: Dict, threshold: float = DEFAULT_THRESHOLD) -> List[Dict]:
+    """逐项比较中位数耗时，返回超过 (1 + threshold) 倍基线的回退项。两边都有的项才比较。"""
+    regressions = []
+    for size, benchmarks in current.get('results', {}).items():
+        for name, stats in benchmarks.items():
+            base = baseline.get('results', {}).get(size, {}).get(name)
+            if not base or base['median_ms'] <= 0:
+                continue
+            ratio = stats['median_ms'] / base['median_ms']
+            if ratio > 1 + threshold:
+                regressions.append({'size': int(size), 'benchmark': name, 'baseline_ms': base['median_ms'],
+                                    'current_ms': stats['median_ms'], 'ratio': round(ratio, 3)})
+    return regressions
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='服务层热点函数基准测试')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES), help='合成用户数')
+    parser.add_argument('--repeat', type=int, default=50, help='每项计时次数')
+    parser.add_argument('--slow-repeat', type=int, default=5, help='模型训练类基准的计时次数')
+    parser.add_argument('--only', nargs='+', help='只运行指定的基准')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.json', help='结果 JSON 路径')
+    parser.add_argument('--baseline', help='基线 JSON，指定时比较并在回退时返回 1')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='允许的中位数变慢比例')
+    args = parser.parse_args(argv)
+
+    report = run(args.sizes, args.repeat, args.slow_repeat, args.only, args.seed)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        for item in regressions:
+            print(f"REGRESSION [{item['size']}] {item['benchmark']}: "
+                  f"{item['baseline_ms']:.3f} ms -> {item['current_ms']:.3f} ms (x{item['ratio']})")
+        if regressions:
+            return 1
+        print(f"No regressions beyond {args.threshold:.0%}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
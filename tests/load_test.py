@@ -0,0 +1,436 @@
+"""
+HTTP 接口压测工具
+在本地启动应用（预分叉的多进程服务器，共享同一个监听套接字），用异步客户端按配置的接口比例与用户ID
+发送请求，支持固定并发（闭环）与固定到达率（开环）两种模式，报告 p50/p95/p99 延迟、吞吐量与错误率；
+对多个工作进程数依次压测即得到容量曲线。
+
+用法：
+    python tests/load_test.py run --workers 1 2 4 --concurrency 16 --duration 20
+    python tests/load_test.py run --workers 4 --rate 50 --duration 30 --mix dashboard=1,chat=3
+    python tests/load_test.py run --url http://127.0.0.1:8008 --concurrency 8   （压测已启动的服务）
+
+服务器通过 os.fork 预分叉，仅支持类 Unix 系统。对话消息默认不含健康信息，避免压测写入 mock_data.csv。
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+from urllib.parse import quote, urlsplit
+
+import numpy as np
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHAT_MESSAGES = (
+    "退休后每月能领多少养老金？",
+    "我想了解一下养老金怎么规划",
+    "现在的资产配置合理吗",
+    "有什么适合我的理财建议",
+    "提前退休会有什么影响",
+)
+SEARCH_QUERIES = ("养老金", "退休规划", "资产配置", "储蓄", "保险")
+
+DEFAULT_MIX = {'dashboard': 3, 'simulate': 2, 'chat': 3, 'knowledge': 2}
+
+
+def build_request(endpoint: str, user_id: int, rng: random.Random) -> Tuple[str, str, Optional[Dict]]:
+    """返回 (方法, 路径, JSON 请求体)。"""
+    if endpoint == 'dashboard':
+        return 'GET', f'/api/dashboard/{user_id}', None
+    if endpoint == 'simulate':
+        return 'POST', f'/api/future-insights/{user_id}/simulate', {
+            'savings_increase': rng.randrange(0, 10001, 500),
+            'investment_increase': rng.randrange(0, 5001, 250),
+            'retirement_age_adjust': rng.randint(-5, 5),
+        }
+    if endpoint == 'chat':
+        return 'POST', '/api/assistant/chat', {'user_id': user_id, 'message': rng.choice(CHAT_MESSAGES)}
+    if endpoint == 'knowledge':
+        return 'GET', f'/api/knowledge/search?q={quote(rng.choice(SEARCH_QUERIES))}', None
+    raise ValueError(f"unknown endpoint: {endpoint}")
+
+
+# --- 服务器 ---
+
+def serve(host: str, port: int, workers: int) -> None:
+    """预分叉服务器：父进程创建监听套接字后分叉出 workers 个子进程，各自以多线程方式处理连接。"""
+    import logging
+    from werkzeug.serving import make_server
+
+    sys.path.insert(0, ROOT_DIR)
+    from app import create_app
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    app = create_app()  # 分叉前完成导入与数据加载，子进程写时复制共享
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(1024)
+    sock.set_inheritable(True)
+
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, lambda *_: os._exit(0))
+            make_server(host, port, app, threaded=True, fd=sock.fileno()).serve_forever()
+            os._exit(0)
+        children.append(pid)
+
+    def shutdown(*_):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in children:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    while True:
+        signal.pause()
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class LocalServer:
+    """在子进程中启动预分叉服务器，等待就绪后返回基础 URL。"""
+
+    def __init__(self, workers: int, host: str = '127.0.0.1', port: Optional[int] = None,
+                 startup_timeout: float = 120.0):
+        self.workers = workers
+        self.host = host
+        self.port = port or _free_port()
+        self.startup_timeout = startup_timeout
+        self.process: Optional[subprocess.Popen] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def __enter__(self) -> "LocalServer":
+        env = dict(os.environ)
+        # 压测产生的对话历史写入临时目录
+        env.setdefault('PENSION_CHAT_HISTORY_DIR', tempfile.mkdtemp(prefix='pension-load-history-'))
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), 'serve', '--host', self.host,
+             '--port', str(self.port), '--workers', str(self.workers)],
+            cwd=ROOT_DIR, env=env)
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"server exited with code {self.process.returncode}")
+            try:
+                urllib.request.urlopen(f"{self.url}/metrics", timeout=2).read()
+                return self
+            except (urllib.error.URLError, ConnectionError, socket.timeout):
+                time.sleep(0.2)
+        self.__exit__(None, None, None)
+        raise RuntimeError("server did not become ready in time")
+
+    def __exit__(self, *exc) -> None:
+        if self.process and self.process.poll() is None:
+            self.process.send_signal(signal.SIGTERM)
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+# --- 异步客户端 ---
+
+class HTTPConnection:
+    """基于 asyncio 流的最小 HTTP/1.1 客户端连接，支持 keep-alive。"""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    async def _ensure_open(self) -> None:
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    async def request(self, method: str, path: str, body: Optional[Dict] = None) -> int:
+        """发送请求并读完响应体，返回状态码。连接被服务端关闭时重连一次。"""
+        for attempt in range(2):
+            await self._ensure_open()
+            try:
+                return await self._roundtrip(method, path, body)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                self.close()
+                if attempt:
+                    raise
+        raise ConnectionError("unreachable")
+
+    async def _roundtrip(self, method: str, path: str, body: Optional[Dict]) -> int:
+        payload = json.dumps(body).encode('utf-8') if body is not None else b''
+        head = (f"{method} {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n"
+                f"Content-Length: {len(payload)}\r\nConnection: keep-alive\r\n")
+        if body is not None:
+            head += "Content-Type: application/json\r\n"
+        self.writer.write(head.encode('ascii') + b"\r\n" + payload)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError("connection closed by server")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if 'content-length' in headers:
+            await self.reader.readexactly(int(headers['content-length']))
+        elif headers.get('transfer-encoding', '').lower() == 'chunked':
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+        else:
+            await self.reader.read()
+            self.close()
+            return status
+        if headers.get('connection', '').lower() == 'close' or status_line.startswith(b'HTTP/1.0'):
+            self.close()
+        return status
+
+
+class Recorder:
+    """按接口记录延迟与错误。"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.statuses: Dict[str, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+
+    def record(self, endpoint: str, seconds: float, status: Optional[int]) -> None:
+        self.latencies[endpoint].append(seconds)
+        if status is None or status >= 400:
+            self.errors[endpoint] += 1
+        if status is not None:
+            self.statuses[endpoint][status] += 1
+
+    def summary(self, duration: float) -> Dict:
+        def stats(latencies: List[float], errors: int) -> Dict:
+            ms = np.asarray(latencies) * 1000
+            count = len(ms)
+            return {
+                'requests': count,
+                'errors': errors,
+                'error_rate': round(errors / count, 4) if count else 0.0,
+                'throughput_rps': round(count / duration, 2) if duration else 0.0,
+                'p50_ms': round(float(np.percentile(ms, 50)), 2) if count else None,
+                'p95_ms': round(float(np.percentile(ms, 95)), 2) if count else None,
+                'p99_ms': round(float(np.percentile(ms, 99)), 2) if count else None,
+                'max_ms': round(float(ms.max()), 2) if count else None,
+            }
+
+        all_latencies = [v for values in self.latencies.values() for v in values]
+        result = {'overall': stats(all_latencies, sum(self.errors.values())), 'endpoints': {}}
+        for endpoint, latencies in sorted(self.latencies.items()):
+            result['endpoints'][endpoint] = stats(latencies, self.errors[endpoint])
+            result['endpoints'][endpoint]['statuses'] = dict(self.statuses[endpoint])
+        return result
+
+
+class LoadGenerator:
+    def __init__(self, base_url: str, mix: Dict[str, float], user_ids: Sequence[int], seed: int = 0,
+                 timeout: float = 60.0):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname or '127.0.0.1'
+        self.port = parts.port or 80
+        self.endpoints = list(mix)
+        self.weights = [mix[e] for e in self.endpoints]
+        self.user_ids = list(user_ids)
+        self.rng = random.Random(seed)
+        self.timeout = timeout
+
+    def _next(self) -> Tuple[str, str, str, Optional[Dict]]:
+        endpoint = self.rng.choices(self.endpoints, self.weights)[0]
+        method, path, body = build_request(endpoint, self.rng.choice(self.user_ids), self.rng)
+        return endpoint, method, path, body
+
+    async def _send(self, conn: HTTPConnection, recorder: Recorder, start: float,
+                    endpoint: str, method: str, path: str, body: Optional[Dict]) -> None:
+        status = None
+        try:
+            status = await asyncio.wait_for(conn.request(method, path, body), self.timeout)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+            conn.close()
+        recorder.record(endpoint, time.perf_counter() - start, status)
+
+    async def run_closed(self, concurrency: int, duration: float) -> Dict:
+        """固定并发：每个虚拟用户收到响应后立即发下一个请求。"""
+        recorder = Recorder()
+        deadline = time.perf_counter() + duration
+
+        async def user_loop():
+            conn = HTTPConnection(self.host, self.port)
+            try:
+                while time.perf_counter() < deadline:
+                    await self._send(conn, recorder, time.perf_counter(), *self._next())
+            finally:
+                conn.close()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(user_loop() for _ in range(concurrency)))
+        return recorder.summary(time.perf_counter() - started)
+
+    async def run_open(self, rate: float, duration: float, max_connections: int = 512,
+                       poisson: bool = True) -> Dict:
+        """固定到达率：按计划时间发出请求，延迟从计划发出时刻算起，服务变慢时排队时间也计入。"""
+        recorder = Recorder()
+        idle: List[HTTPConnection] = []
+        slots = asyncio.Semaphore(max_connections)
+        tasks = set()
+
+        async def one(scheduled: float, request):
+            async with slots:
+                conn = idle.pop() if idle else HTTPConnection(self.host, self.port)
+                await self._send(conn, recorder, scheduled, *request)
+                idle.append(conn)
+
+        started = time.perf_counter()
+        next_at = started
+        while next_at < started + duration:
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            task = asyncio.ensure_future(one(next_at, self._next()))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            next_at += self.rng.expovariate(rate) if poisson else 1.0 / rate
+        if tasks:
+            await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+        for conn in idle:
+            conn.close()
+        return recorder.summary(elapsed)
+
+
+def parse_mix(text: Optional[str]) -> Dict[str, float]:
+    if not text:
+        return dict(DEFAULT_MIX)
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        mix[name.strip()] = float(weight or 1)
+    unknown = set(mix) - set(DEFAULT_MIX)
+    if unknown:
+        raise ValueError(f"unknown endpoints in mix: {sorted(unknown)}")
+    return mix
+
+
+def parse_users(text: str) -> List[int]:
+    """'1-500' 或 '1,2,3'。"""
+    if '-' in text:
+        lo, hi = text.split('-', 1)
+        return list(range(int(lo), int(hi) + 1))
+    return [int(v) for v in text.split(',')]
+
+
+def run_scenario(url: str, args) -> Dict:
+    generator = LoadGenerator(url, parse_mix(args.mix), parse_users(args.users), args.seed, args.timeout)
+    if args.warmup > 0:
+        asyncio.run(generator.run_closed(min(args.concurrency, 4), args.warmup))
+    if args.rate:
+        return asyncio.run(generator.run_open(args.rate, args.duration, poisson=not args.uniform))
+    return asyncio.run(generator.run_closed(args.concurrency, args.duration))
+
+
+def _print_summary(label: str, summary: Dict) -> None:
+    overall = summary['overall']
+    print(f"== {label}: {overall['throughput_rps']} req/s, errors {overall['error_rate']:.2%}, "
+          f"p50 {overall['p50_ms']} ms, p95 {overall['p95_ms']} ms, p99 {overall['p99_ms']} ms")
+    for endpoint, stats in summary['endpoints'].items():
+        print(f"   {endpoint:<10} {stats['requests']:>7} req  {stats['throughput_rps']:>8} req/s  "
+              f"p50 {stats['p50_ms']:>9} ms  p95 {stats['p95_ms']:>9} ms  p99 {stats['p99_ms']:>9} ms  "
+              f"errors {stats['errors']}")
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Flask API 本地压测')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = sub.add_parser('serve', help='启动预分叉服务器（供 run 内部使用）')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8008)
+    serve_parser.add_argument('--workers', type=int, default=1)
+
+    run_parser = sub.add_parser('run', help='压测')
+    run_parser.add_argument('--url', help='压测已运行的服务；不指定时在本地启动')
+    run_parser.add_argument('--workers', type=int, nargs='+', default=[1], help='依次压测的工作进程数')
+    run_parser.add_argument('--concurrency', type=int, default=8, help='固定并发模式的虚拟用户数')
+    run_parser.add_argument('--rate', type=float, help='固定到达率（请求/秒），指定时使用开环模式')
+    run_parser.add_argument('--uniform', action='store_true', help='开环模式按等间隔而非泊松到达')
+    run_parser.add_argument('--duration', type=float, default=20.0, help='每轮压测秒数')
+    run_parser.add_argument('--warmup', type=float, default=3.0, help='每轮压测前的预热秒数')
+    run_parser.add_argument('--mix', help='接口比例，如 dashboard=3,simulate=2,chat=3,knowledge=2')
+    run_parser.add_argument('--users', default='1-500', help="用户ID范围或列表，如 '1-500'")
+    run_parser.add_argument('--timeout', type=float, default=60.0, help='单个请求超时秒数')
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--output', default='load_test_results.json', help='结果 JSON 路径')
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        serve(args.host, args.port, args.workers)
+        return 0
+
+    report = {'config': {k: v for k, v in vars(args).items() if k != 'command'}, 'runs': []}
+    if args.url:
+        summary = run_scenario(args.url, args)
+        _print_summary(args.url, summary)
+        report['runs'].append({'url': args.url, **summary})
+    else:
+        for workers in args.workers:
+            with LocalServer(workers) as server:
+                summary = run_scenario(server.url, args)
+            _print_summary(f"{workers} worker(s)", summary)
+            report['runs'].append({'workers': workers, **summary})
+
+    if len(report['runs']) > 1:
+        print("\nCapacity curve (workers -> req/s, p99 ms):")
+        for run in report['runs']:
+            print(f"  {run.get('workers')}: {run['overall']['throughput_rps']} req/s, p99 {run['overall']['p99_ms']} ms")
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Results written to {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -13,6 +13,17 @@ from app.services.analysis_service import get_user_profile
 from app.services.nlp_service import analyze_intent, analyze_sentiment
 from app.services.knowledge_graph_service import search_knowledge
 
+def use_memory_storage(test: unittest.TestCase) -> None:
+    """测试期间用户表只写内存：以 SQLite 后端运行测试套件时，写入用户的测试不改动共享的数据库，
+    结束后由 replace_users 恢复原表即可。"""
+    from unittest import mock
+    from app.services import data_service
+    from app.services.storage_service import CsvStorage
+    for patcher in (mock.patch.object(data_service, '_storage', CsvStorage(lambda: data_service.df)),
+                    mock.patch.object(data_service, '_storage_version', None)):
+        patcher.start()
+        test.addCleanup(patcher.stop)
+
 class TestDataService(unittest.TestCase):
     """测试数据服务"""
 
@@ -43,6 +54,64 @@ class TestDataService(unittest.TestCase):
         self.assertGreater(score_data['total_score'], 0)
         self.assertLessEqual(score_data['total_score'], 100)
 
+    def test_consumption_features(self):
+        """测试预计算的消费特征与逐项计算一致，并随指标变更刷新"""
+        from app.services import data_service
+        from app.services.data_service import get_consumption_features, CONSUMPTION_CATEGORIES
+        metrics = get_latest_metrics(1)
+        features = get_consumption_features(metrics)
+        total = sum(metrics[c] for c in CONSUMPTION_CATEGORIES)
+        self.assertAlmostEqual(features['total'], total)
+        self.assertAlmostEqual(features['consumption_rate'], total / metrics['月总流入'])
+        self.assertAlmostEqual(features['luxury_ratio'], (metrics['奢侈品消费'] + metrics['美容护肤消费']) / total)
+        self.assertAlmostEqual(sum(features['shares'].values()), 1.0)
+
+        adhoc = dict(metrics, 用户ID=None)
+        self.assertEqual(get_consumption_features(adhoc), features)
+        # 与用户表一致的指标直接取预计算结果
+        from unittest import mock
+        with mock.patch.object(data_service, '_consumption_feature_matrix', side_effect=AssertionError):
+            self.assertEqual(get_consumption_features(metrics), features)
+
+        row = data_service.df.index[data_service.df['用户ID'] == 1][0]
+        original = data_service.df.at[row, '餐饮消费']
+        try:
+            data_service.df.at[row, '餐饮消费'] = original + 1000
+            data_service.notify_metrics_changed([1])
+            current = dict(metrics, 餐饮消费=metrics['餐饮消费'] + 1000)
+            self.assertAlmostEqual(get_consumption_features(current)['total'], total + 1000)
+            row_features = data_service._consumption_matrix[data_service._consumption_rows[1]]
+            self.assertAlmostEqual(row_features[2 * len(CONSUMPTION_CATEGORIES)], total + 1000, places=2)
+            # 与用户表不一致的指标字典（旧值或调整过的情景）按字典中的取值计算
+            self.assertAlmostEqual(get_consumption_features(metrics)['total'], total)
+            scenario = dict(metrics, 奢侈品消费=metrics['奢侈品消费'] + 500)
+            self.assertEqual(get_consumption_features(scenario), get_consumption_features(dict(scenario, 用户ID=None)))
+            self.assertAlmostEqual(get_consumption_features(scenario)['total'], total + 500)
+        finally:
+            data_service.df.at[row, '餐饮消费'] = original
+            data_service.notify_metrics_changed([1])
+
+    def test_metrics_version_increments_are_not_lost(self):
+        """测试多个线程同时通知同一用户变更时版本号逐次递增"""
+        import threading
+        from unittest import mock
+        from app.services import data_service
+
+        start = data_service.get_metrics_version(424242)
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            with mock.patch.object(data_service, '_metrics_listeners', []):
+                workers = [threading.Thread(target=lambda: [data_service.notify_metrics_changed([424242])
+                                                            for _ in range(500)]) for _ in range(8)]
+                for worker in workers:
+                    worker.start()
+                for worker in workers:
+                    worker.join()
+        finally:
+            sys.setswitchinterval(interval)
+        self.assertEqual(data_service.get_metrics_version(424242), start + 4000)
+
 class TestAnalysisService(unittest.TestCase):
     """测试分析服务"""
 
@@ -65,6 +134,63 @@ class TestAnalysisService(unittest.TestCase):
             "高负债风险型", "退休保障型"
         ])
 
+    def test_dashboard_analysis(self):
+        """测试仪表盘数据包与消费分析口径一致"""
+        from app.services.analysis_service import get_dashboard_analysis
+        data = get_dashboard_analysis(1)
+        self.assertIsNotNone(data)
+        total = data['consumptionAnalysis']['totalConsumption']
+        key_metrics = {m['name']: m for m in data['keyMetrics']}
+        self.assertEqual(key_metrics['月消费总计']['value'], f"{total:,.0f}")
+        self.assertEqual(len(data['futureTrend']), 4)
+
+    def test_asset_allocation_on_frontier(self):
+        """测试资产配置来自有效前沿且权重合法"""
+        from app.services.analysis_service import generate_asset_allocation
+        young = generate_asset_allocation({'年龄': 25, '风险偏好': '激进', '总资产': 1000000})
+        old = generate_asset_allocation({'年龄': 62, '风险偏好': '保守', '总资产': 1000000})
+        self.assertAlmostEqual(sum(a['percentage'] for a in young['allocation']), 100, delta=0.5)
+        self.assertGreater(young['expectedVolatility'], old['expectedVolatility'])
+        stock = {a['assetType']: a['percentage'] for a in young['allocation']}['股票']
+        self.assertGreater(stock, {a['assetType']: a['percentage'] for a in old['allocation']}['股票'])
+
+    def test_batch_allocation_matches_single(self):
+        """测试批量求解与单用户求解一致"""
+        import numpy as np
+        from app.services.data_service import df
+        from app.services.portfolio_service import generate_asset_allocations_batch, optimize_allocation
+        batch = generate_asset_allocations_batch(df.head(20))
+        row = batch.iloc[5]
+        single = optimize_allocation(df.iloc[5]['年龄'], df.iloc[5]['风险偏好'])
+        for asset, weight in single['weights'].items():
+            self.assertAlmostEqual(row[asset], weight)
+        self.assertTrue(np.allclose(batch[list(single['weights'])].sum(axis=1), 1.0))
+
+    def test_backtest_single_asset_matches_series(self):
+        """测试单一资产买入持有的回测年化收益与序列本身一致"""
+        import numpy as np
+        from app.services.backtest_service import load_return_series, run_backtest
+        returns = load_return_series()
+        result = run_backtest(np.eye(len(returns.columns)), returns, rebalance='none', initial=1.0)
+        expected = (1 + returns).prod() ** (12 / len(returns)) - 1
+        np.testing.assert_allclose(result['cagr'].to_numpy(), expected.to_numpy(), rtol=1e-9)
+        self.assertTrue((result['maxDrawdown'] >= 0).all())
+
+    def test_backtest_grid_rules_and_contributions(self):
+        """测试配置 × 再平衡规则的批量回测与定投累计"""
+        import pandas as pd
+        from app.services.backtest_service import backtest_grid, load_return_series
+        returns = load_return_series()
+        allocations = pd.DataFrame({'用户ID': [1, 2], '现金及等价物': [0.1, 0.4], '债券': [0.3, 0.5],
+                                    '股票': [0.5, 0.1], '另类投资': [0.1, 0.0]})
+        result = backtest_grid(allocations, ('none', 'annual'), returns, monthly_contribution=[1000, 0], initial=0)
+        self.assertEqual(len(result), 4)
+        self.assertEqual(result['用户ID'].tolist(), [1, 1, 2, 2])
+        self.assertAlmostEqual(result.iloc[0]['totalContributed'], 1000 * len(returns))
+        self.assertEqual(result.iloc[2]['finalValue'], 0)
+        self.assertEqual(result.iloc[2]['maxDrawdown'], 0)
+        self.assertGreater(result.iloc[0]['cagr'], -1)
+
 class TestNLPService(unittest.TestCase):
     """测试NLP服务"""
 
@@ -106,6 +232,1161 @@ class TestKnowledgeGraph(unittest.TestCase):
             self.assertIsInstance(info, dict)
             self.assertIn('basic_info', info)
 
+class TestFutureService(unittest.TestCase):
+    """测试未来洞察服务"""
+
+    def test_sweep_matches_single_simulation(self):
+        """测试参数扫描网格与逐点模拟结果一致"""
+        import base64
+        import numpy as np
+        from app.services.future_service import (
+            sweep_future, _intervention_effects, _potential_curve, _baseline_curve, _pension_risk_index
+        )
+
+        ranges = {
+            'savings_increase': {'min': 0, 'max': 2000, 'step': 1000},
+            'debt_reduction': [100, 2000],
+            'retirement_age_adjust': {'min': -5, 'max': 5, 'step': 5},
+            'risk_adjust': ['保守', '激进'],
+        }
+        data = sweep_future(1, ranges)
+        self.assertEqual(data['shape'], [3, 1, 2, 3, 2, 12])
+        curves = np.frombuffer(base64.b64decode(data['potentialCurves']), dtype=np.uint8).reshape(data['shape'])
+
+        metrics = get_latest_metrics(1)
+        risk = _pension_risk_index(metrics)
+        current = float(data['currentScore'])
+        slope = (_baseline_curve(current, risk, 12)[-1] - current) / 12
+        axes = data['axes']
+        for idx in np.ndindex(*data['shape'][:-1]):
+            params = {name: values[i] for (name, values), i in zip(axes.items(), idx)}
+            total_delta, _ = _intervention_effects(params, metrics)
+            expected = _potential_curve(current, slope, total_delta, 12)
+            self.assertEqual(curves[idx].tolist(), expected)
+
+    def test_simulation_memo_hits_and_invalidates(self):
+        """测试模拟结果按吸附参数缓存，并在指标变更后失效"""
+        from app.services.data_service import notify_metrics_changed
+        from app.services.future_service import simulate_future, get_simulation_cache_stats
+
+        first = simulate_future(2, {'savings_increase': 1490, 'days': 10})
+        hits = get_simulation_cache_stats()['hits']
+        second = simulate_future(2, {'savings_increase': 1510, 'days': 10})
+        self.assertEqual(first, second)
+        self.assertEqual(get_simulation_cache_stats()['hits'], hits + 1)
+
+        second['dailyPlan'].clear()
+        self.assertEqual(simulate_future(2, {'savings_increase': 1500, 'days': 10}), first)
+
+        notify_metrics_changed([2])
+        hits = get_simulation_cache_stats()['hits']
+        simulate_future(2, {'savings_increase': 1500, 'days': 10})
+        self.assertEqual(get_simulation_cache_stats()['hits'], hits)
+
+    def test_simulate_rejects_out_of_range_retirement_adjust(self):
+        """测试退休年龄调整超出滑块范围时返回 400，而不是被截断到边界"""
+        from app import create_app
+        from app.services.future_service import simulate_future
+        with self.assertRaises(ValueError):
+            simulate_future(2, {'retirement_age_adjust': 8})
+        client = create_app().test_client()
+        response = client.post('/api/future-insights/2/simulate', json={'retirement_age_adjust': -6})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('retirement_age_adjust', response.get_json()['error'])
+        response = client.post('/api/future-insights/2/simulate', json={'retirement_age_adjust': 5})
+        self.assertEqual(response.status_code, 200)
+
+    def test_simulate_rejects_negative_amounts(self):
+        """测试负的金额参数返回 400，而不是截断为 0 后按默认金额模拟"""
+        from app import create_app
+        from app.services.future_service import _snap_params, simulate_future
+        for name in ('savings_increase', 'investment_increase', 'debt_reduction'):
+            with self.assertRaises(ValueError):
+                simulate_future(2, {name: -500})
+        with self.assertRaises(ValueError):
+            _snap_params({'savings_increase': 'lots'})
+        self.assertEqual(_snap_params({'savings_increase': 99999})[0]['savings_increase'], 10000)
+        client = create_app().test_client()
+        response = client.post('/api/future-insights/2/simulate', json={'savings_increase': -500})
+        self.assertEqual(response.status_code, 400)
+
+    def test_simulate_validates_days(self):
+        """测试模拟天数越界返回 400，且不写入缓存"""
+        from app import create_app
+        from app.services.future_service import get_simulation_cache_stats
+        client = create_app().test_client()
+        size = get_simulation_cache_stats()
+        for days in (0, -3, 366, 10 ** 7, 'many', None):
+            response = client.post('/api/future-insights/2/simulate', json={'days': days})
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(get_simulation_cache_stats(), size)
+        response = client.post('/api/future-insights/2/simulate', json={'days': 365})
+        self.assertEqual(len(response.get_json()['dailyBreakdown']), 365)
+
+    def test_sweep_rejects_oversized_grid(self):
+        """测试过大的扫描网格被拒绝"""
+        from app.services.future_service import sweep_future
+        ranges = {
+            'savings_increase': {'step': 1},
+            'investment_increase': {'step': 1},
+        }
+        with self.assertRaises(ValueError):
+            sweep_future(1, ranges)
+        # 单轴点数极大时在分配数组之前拒绝
+        with self.assertRaises(ValueError):
+            sweep_future(1, {'savings_increase': {'min': 0, 'max': 1e6, 'step': 1e-9}})
+
+    def test_sweep_axes_validated_like_simulation(self):
+        """测试扫描轴取值与单点模拟使用相同的范围校验与步长吸附"""
+        from app import create_app
+        from app.services.future_service import sweep_future
+        for ranges in ({'retirement_age_adjust': [0, 8]},
+                       {'retirement_age_adjust': {'min': -10, 'max': 0, 'step': 5}},
+                       {'savings_increase': [-500]},
+                       {'debt_reduction': {'values': [100, None]}},
+                       {'investment_increase': ['abc']}):
+            with self.assertRaises(ValueError):
+                sweep_future(1, ranges)
+        data = sweep_future(1, {'savings_increase': [1490, 99999]}, encoding='list')
+        self.assertEqual(data['axes']['savings_increase'], [1500, 10000])
+
+        client = create_app().test_client()
+        response = client.post('/api/future-insights/1/sweep', json={'ranges': {'debt_reduction': [None]}})
+        self.assertEqual(response.status_code, 400)
+
+    def test_sweep_api_validates_months(self):
+        """测试扫描月数越界返回 400"""
+        from app import create_app
+        client = create_app().test_client()
+        for months in (0, 10000):
+            response = client.post('/api/future-insights/1/sweep', json={'months': months})
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(client.post('/api/future-insights/1/sweep', json={'months': 6}).status_code, 200)
+
+class TestMonteCarloService(unittest.TestCase):
+    """测试蒙特卡洛退休模拟"""
+
+    def test_reproducible_and_bounded(self):
+        """测试相同种子结果可复现，且概率与分位数合理"""
+        from app.services.monte_carlo_service import simulate_retirement_outcomes
+        metrics = get_latest_metrics(3)
+        first = simulate_retirement_outcomes(metrics, n_paths=3000, seed=7, chunk_size=1000)
+        second = simulate_retirement_outcomes(metrics, n_paths=3000, seed=7, chunk_size=1000)
+        self.assertEqual(first, second)
+        self.assertGreaterEqual(first['successProbability'], 0.0)
+        self.assertLessEqual(first['successProbability'], 1.0)
+        pct = first['finalPercentiles']
+        self.assertLessEqual(pct['p5'], pct['p50'])
+        self.assertLessEqual(pct['p50'], pct['p95'])
+        self.assertEqual(len(first['percentileBands']['p50']), first['years'])
+
+    def test_batch_matches_single_user(self):
+        """测试批量模拟结果与单用户模拟一致"""
+        from app.services.data_service import df
+        from app.services.monte_carlo_service import simulate_all_users, simulate_retirement_outcomes
+        summary = simulate_all_users(df.head(4), n_paths=500, seed=1, workers=1, batch_size=3)
+        single = simulate_retirement_outcomes(get_latest_metrics(2), n_paths=500, seed=1)
+        row = summary[summary['用户ID'] == 2].iloc[0]
+        self.assertAlmostEqual(row['successProbability'], single['successProbability'])
+        self.assertAlmostEqual(row['p50'], single['finalPercentiles']['p50'])
+
+class TestPeerService(unittest.TestCase):
+    """同群分位服务测试"""
+
+    def test_batch_scores_match_single(self):
+        """测试批量评分与逐个用户评分一致"""
+        from app.services.data_service import df, calculate_pension_scores_batch
+        frame = df.head(20)
+        batch = calculate_pension_scores_batch(frame)
+        for record, score in zip(frame.to_dict('records'), batch):
+            self.assertEqual(int(score), calculate_pension_score(record)['total_score'])
+
+    def test_percentile_matches_brute_force_and_updates(self):
+        """测试分位与直接计数一致，且增量更新后与重建索引一致"""
+        from app.services.data_service import df
+        from app.services.peer_service import PeerIndex
+        frame = df.head(60).copy()
+        index = PeerIndex(frame)
+        incomes = frame['月总流入'].to_numpy(dtype=float)
+        value = incomes[5]
+        expected = ((incomes < value).sum() + (incomes <= value).sum()) / 2 / len(incomes) * 100
+        user_id = int(frame['用户ID'].iloc[5])
+        result = index.percentiles(user_id)
+        self.assertAlmostEqual(result['overall']['metrics']['income']['percentile'], round(expected, 1))
+
+        frame.loc[frame.index[5], '月总流入'] = incomes.max() * 2
+        frame.loc[frame.index[5], '年龄'] = 70
+        index.update(frame.iloc[[5]])
+        rebuilt = PeerIndex(frame)
+        for other in frame['用户ID'].head(10):
+            self.assertEqual(index.percentiles(int(other)), rebuilt.percentiles(int(other)))
+
+class TestSimilarityService(unittest.TestCase):
+    """相似用户索引测试"""
+
+    def test_incremental_update_matches_rebuild(self):
+        """测试增量更新后的查询结果与完全重建一致"""
+        import numpy as np
+        from app.services.analysis_service import get_profile_model
+        from app.services.similarity_service import SimilarityIndex
+        rng = np.random.default_rng(0)
+        ids = np.arange(1, 201)
+        vectors = rng.standard_normal((200, 8))
+        index = SimilarityIndex(ids, vectors, get_profile_model())
+        changed = [3, 50, 120]
+        vectors[np.array(changed) - 1] = rng.standard_normal((3, 8))
+        index.upsert(changed, vectors[np.array(changed) - 1])
+        rebuilt = SimilarityIndex(ids, vectors, get_profile_model())
+        for uid in (1, 3, 77, 120):
+            self.assertEqual(index.query(vectors[uid - 1], 7, exclude=uid),
+                             rebuilt.query(vectors[uid - 1], 7, exclude=uid))
+
+    def test_find_similar_users(self):
+        """测试相似用户接口返回排序后的近邻与汇总"""
+        from app.services.similarity_service import find_similar_users
+        result = find_similar_users(1, k=5)
+        self.assertEqual(len(result['neighbors']), 5)
+        distances = [n['distance'] for n in result['neighbors']]
+        self.assertEqual(distances, sorted(distances))
+        self.assertNotIn(1, [n['userId'] for n in result['neighbors']])
+        self.assertEqual(sum(result['aggregate']['personaDistribution'].values()), 5)
+        self.assertIsNone(find_similar_users(999999))
+
+class TestRecommendationService(unittest.TestCase):
+    """推荐服务测试"""
+
+    def test_deterministic_without_template_mutation(self):
+        """测试推荐结果可复现且不修改模板"""
+        import copy
+        from app.services.recommendation_service import (
+            RECOMMENDATION_TEMPLATES, generate_personalized_recommendations
+        )
+        templates = copy.deepcopy(RECOMMENDATION_TEMPLATES)
+        metrics = dict(get_latest_metrics(1), 负债率=0.8, 储蓄率=0.05, 年龄=55)
+        first = generate_personalized_recommendations("中产平衡型", metrics)
+        first['recommendations']['daily_actions'].clear()
+        second = generate_personalized_recommendations("中产平衡型", metrics)
+        self.assertEqual(RECOMMENDATION_TEMPLATES, templates)
+        self.assertEqual(second['recommendations']['daily_actions'][0]['content'], "立即增加储蓄比例")
+        self.assertEqual(second, generate_personalized_recommendations("中产平衡型", metrics))
+
+    def test_batch_matches_single(self):
+        """测试批量生成与逐个用户生成一致"""
+        from app.services.data_service import df
+        from app.services.recommendation_service import (
+            generate_personalized_recommendations, generate_recommendations_batch
+        )
+        plans = generate_recommendations_batch(df.head(30))
+        for user_id in df['用户ID'].head(30):
+            metrics = get_latest_metrics(int(user_id))
+            single = generate_personalized_recommendations(get_user_profile(metrics), metrics)
+            self.assertEqual(plans[int(user_id)], single)
+
+    def test_batch_results_do_not_alias_cache(self):
+        """测试修改批量结果不影响缓存中的推荐"""
+        from app.services.data_service import df
+        from app.services.recommendation_service import generate_recommendations_batch
+        user_id = int(df['用户ID'].iloc[0])
+        plan = generate_recommendations_batch(df.head(5))[user_id]
+        expected = [a['content'] for a in plan['recommendations']['daily_actions']]
+        plan['recommendations']['daily_actions'].clear()
+        plan['consumption_recommendations'].append({'category': 'x'})
+        again = generate_recommendations_batch(df.head(5))[user_id]
+        self.assertEqual([a['content'] for a in again['recommendations']['daily_actions']], expected)
+        self.assertNotIn({'category': 'x'}, again['consumption_recommendations'])
+
+class TestProgressService(unittest.TestCase):
+    """任务进度存储测试"""
+
+    def setUp(self):
+        import tempfile
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self._old_db = os.environ.get('PENSION_PROGRESS_DB')
+        os.environ['PENSION_PROGRESS_DB'] = os.path.join(self._tmpdir.name, 'progress.db')
+
+    def tearDown(self):
+        if self._old_db is None:
+            os.environ.pop('PENSION_PROGRESS_DB', None)
+        else:
+            os.environ['PENSION_PROGRESS_DB'] = self._old_db
+        self._tmpdir.cleanup()
+
+    def test_streaks_and_weekly_progress(self):
+        """测试连续天数、最长连续与近7天进度"""
+        from app.services.progress_service import record_progress, get_progress
+        days = ['2024-03-01', '2024-03-02', '2024-03-03', '2024-03-04',
+                '2024-03-07', '2024-03-08', '2024-03-09']
+        record_progress(7, [{'task_id': 'daily_actions_0', 'date': d} for d in days])
+        record_progress(7, [{'task_id': 'daily_actions_1', 'date': '2024-03-09'},
+                            {'task_id': 'daily_actions_0', 'date': '2024-03-08', 'completed': False}])
+        progress = get_progress(7, total_tasks=4, today='2024-03-10')
+        self.assertEqual(progress['completed_tasks'], 0)
+        self.assertEqual(progress['current_streak'], 1)
+        self.assertEqual(progress['best_streak'], 4)
+        self.assertEqual(progress['weekly_progress'], [25.0, 0.0, 0.0, 25.0, 0.0, 50.0, 0.0])
+
+    def test_future_dates_rejected_without_touching_history(self):
+        """测试晚于今天的日期被拒绝（接口返回 400），已记录的历史不变"""
+        from datetime import date, timedelta
+        from app import create_app
+        from app.services.progress_service import record_progress, get_progress
+        today = date.today()
+        days = [(today - timedelta(days=i)).isoformat() for i in range(3)]
+        record_progress(9, [{'task_id': 'daily_actions_0', 'date': d} for d in days])
+        before = get_progress(9, total_tasks=1)
+        self.assertEqual(before['current_streak'], 3)
+
+        future = (today + timedelta(days=500)).isoformat()
+        with self.assertRaises(ValueError):
+            record_progress(9, [{'task_id': 'daily_actions_0', 'date': future}])
+        client = create_app().test_client()
+        response = client.post('/api/recommendation/progress/9/batch',
+                               json={'updates': [{'task_id': 'daily_actions_0', 'date': future}]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['errors'][0]['index'], 0)
+        response = client.put('/api/recommendation/progress/9/daily_actions_0', json={'date': future})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(get_progress(9, total_tasks=1), before)
+
+    def test_completed_must_be_boolean(self):
+        """测试 completed 只接受布尔值，字符串 "false" 返回 400 而不是标记为完成"""
+        from app import create_app
+        from app.services.progress_service import get_progress
+        client = create_app().test_client()
+        for value in ('false', '0', 1, None):
+            response = client.put('/api/recommendation/progress/10/daily_actions_0', json={'completed': value})
+            self.assertEqual(response.status_code, 400)
+            response = client.post('/api/recommendation/progress/10/batch',
+                                   json={'updates': [{'task_id': 'daily_actions_0', 'completed': value}]})
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(get_progress(10, total_tasks=1)['completed_tasks'], 0)
+
+        self.assertEqual(client.put('/api/recommendation/progress/10/daily_actions_0', json={}).status_code, 200)
+        self.assertEqual(get_progress(10, total_tasks=1)['completed_tasks'], 1)
+        response = client.put('/api/recommendation/progress/10/daily_actions_0', json={'completed': False})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(get_progress(10, total_tasks=1)['completed_tasks'], 0)
+
+    def test_batch_api_reports_invalid_items(self):
+        """测试批量更新接口逐项报告不合格的更新（返回 400），整批不写入"""
+        from app import create_app
+        from app.services.progress_service import get_progress
+        client = create_app().test_client()
+        updates = [{'task_id': 'daily_actions_0', 'date': '2024-03-09'}, 'daily_actions_1', {'completed': True},
+                   {'task_id': 'daily_actions_2', 'date': 'yesterday'}]
+        response = client.post('/api/recommendation/progress/8/batch', json={'updates': updates})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([e['index'] for e in response.get_json()['errors']], [1, 2, 3])
+        self.assertEqual(get_progress(8, total_tasks=4, today='2024-03-09')['completed_tasks'], 0)
+
+        response = client.post('/api/recommendation/progress/8/batch', json={'updates': updates[:1]})
+        self.assertEqual(response.get_json(), {'success': True, 'updated': 1})
+
+class TestHistoryService(unittest.TestCase):
+    """对话历史存储测试"""
+
+    def test_pagination_across_ring_buffer_and_segments(self):
+        """测试游标分页跨越内存缓冲区与磁盘分段，且重新加载后序号连续"""
+        import tempfile
+        from unittest import mock
+        from app.services import history_service
+        with tempfile.TemporaryDirectory() as tmp, \
+                mock.patch.object(history_service, 'RING_SIZE', 5), \
+                mock.patch.object(history_service, 'SEGMENT_MAX_RECORDS', 7):
+            store = history_service.ChatHistoryStore(tmp)
+            for i in range(23):
+                store.append(3, {'message': f'm{i}'})
+
+            ids, cursor = [], None
+            while True:
+                page = store.get_history(3, cursor, limit=4)
+                ids.extend(r['id'] for r in page['history'])
+                cursor = page['next_cursor']
+                if cursor is None:
+                    break
+            self.assertEqual(ids, list(range(23, 0, -1)))
+
+            store.flush()
+            reloaded = history_service.ChatHistoryStore(tmp)
+            self.assertEqual(reloaded.append(3, {'message': 'again'})['id'], 24)
+            reloaded.flush()
+            self.assertEqual(len(os.listdir(os.path.join(tmp, '3'))), 4)
+
+    def test_history_read_waits_only_for_own_writes(self):
+        """测试读取历史只等待本用户的记录落盘，不被其他用户积压的写入阻塞"""
+        import tempfile
+        import threading
+        from unittest import mock
+        from app.services import history_service
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.object(history_service, 'RING_SIZE', 3):
+            store = history_service.ChatHistoryStore(tmp)
+            for i in range(6):
+                store.append(4, {'message': f'm{i}'})
+            store.flush()
+
+            release = threading.Event()
+            write_batch = store._write_batch
+
+            def blocked(batch):
+                release.wait(5)
+                write_batch(batch)
+
+            with mock.patch.object(store, '_write_batch', blocked):
+                store.append(5, {'message': 'slow'})
+                result = {}
+                reader = threading.Thread(target=lambda: result.update(store.get_history(4, limit=6)))
+                reader.start()
+                reader.join(2)
+                self.assertFalse(reader.is_alive())
+                release.set()
+            self.assertEqual([r['id'] for r in result['history']], [6, 5, 4, 3, 2, 1])
+            store.flush()
+            self.assertEqual(store.get_history(5)['history'][0]['message'], 'slow')
+
+class TestTokenizerService(unittest.TestCase):
+    """分词服务测试"""
+
+    def test_compiled_trie_max_match(self):
+        """测试编译后的前缀树做正向最大匹配"""
+        import tempfile
+        from app.services.tokenizer_service import Tokenizer, TrieDictionary, compile_trie
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'dict.trie')
+            compile_trie(['养老', '养老金', '账户', '余额'], path)
+            trie = TrieDictionary(path)
+            self.assertIn('养老金', trie)
+            self.assertNotIn('养', trie)
+            tokens = Tokenizer(trie).segment('养老金账户余额3.5万, ok')
+            self.assertEqual(tokens, ('养老金', '账户', '余额', '3.5', '万', 'ok'))
+            del tokens, trie
+
+    def test_register_words_closes_replaced_dictionary(self):
+        """测试并入新词后旧词典的内存映射在进行中的分词结束后关闭"""
+        import tempfile
+        import threading
+        from unittest import mock
+        from app.services import tokenizer_service
+        from app.services.tokenizer_service import Tokenizer, TrieDictionary, compile_trie
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'dict.trie')
+            compile_trie(['养老金'], path)
+            old = Tokenizer(TrieDictionary(path))
+            entered, release = threading.Event(), threading.Event()
+            segment = old._segment
+
+            def slow(text):
+                entered.set()
+                release.wait(5)
+                return segment(text)
+
+            with mock.patch.dict(os.environ, {'PENSION_TOKENIZER_CACHE': tmp}), \
+                    mock.patch.object(tokenizer_service, '_tokenizer', old), \
+                    mock.patch.object(tokenizer_service, '_registered_words', set()), \
+                    mock.patch.object(old, '_segment', slow):
+                result = {}
+                worker = threading.Thread(target=lambda: result.update(tokens=old.segment('养老金')))
+                worker.start()
+                entered.wait(5)
+                tokenizer_service.register_words(['账户余额'])
+                self.assertFalse(old.trie._mmap.closed)
+                release.set()
+                worker.join()
+                self.assertEqual(result['tokens'], ('养老金',))
+                self.assertTrue(old.trie._mmap.closed)
+                # 替换前取得旧分词器的调用改用当前分词器
+                self.assertEqual(old.segment('账户余额'), ('账户余额',))
+                tokenizer_service.get_tokenizer().retire()
+
+    def test_keywords_respect_word_boundaries(self):
+        """测试关键词按词边界匹配，情感按词数归一化"""
+        from app.services.nlp_service import analyze_sentiment, extract_health_info
+        self.assertIsNone(extract_health_info("最近遇到一些困难"))
+        self.assertEqual(extract_health_info("今天好累")['fatigue_level'], 2)
+        result = analyze_sentiment("今天心情很开心")
+        self.assertEqual(result['sentiment'], 'positive')
+        self.assertAlmostEqual(result['score'], 1 / 4)
+
+class TestMessageAnalysisCache(unittest.TestCase):
+    """消息分析缓存测试"""
+
+    def test_normalized_messages_share_analysis(self):
+        """测试规范化后相同的消息命中缓存，且画像相关部分按请求生成"""
+        from app.services.nlp_service import analyze_message, get_analysis_cache_stats, process_user_message
+        message = "最近 压力大，总是头晕"
+        before = get_analysis_cache_stats()
+        first = process_user_message(message, "中产平衡型")
+        second = process_user_message("  最近   压力大，总是头晕 ", "年轻进取型")
+        after = get_analysis_cache_stats()
+        self.assertGreaterEqual(after['hits'] - before['hits'], 1)
+        self.assertEqual(first['intent'], second['intent'])
+        self.assertEqual(first['health_info'], second['health_info'])
+        self.assertEqual(second['tags'][0]['text'], "年轻进取型")
+        self.assertEqual(first['tags'][1:], second['tags'][1:])
+
+        analysis = analyze_message(message)
+        analysis['health_info']['stress_level'] = 0
+        self.assertNotEqual(analyze_message(message)['health_info']['stress_level'], 0)
+
+class TestChatAnalytics(unittest.TestCase):
+    """对话日志离线分析测试"""
+
+    def test_streamed_chunks_merge_to_same_totals(self):
+        """测试 JSONL/CSV 流式读取，分块合并结果与整体计算一致"""
+        import json
+        import tempfile
+        from app.services.chat_analytics_service import ChatStats, analyze_messages, iter_messages
+        messages = ["我今天好累", "最近压力大，睡不着", "谢谢", "我去跑步了，很开心"] * 5
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(os.path.join(tmp, 'a.jsonl'), 'w', encoding='utf-8') as f:
+                for m in messages[:12]:
+                    f.write(json.dumps({'message': m}, ensure_ascii=False) + '\n')
+            with open(os.path.join(tmp, 'b.csv'), 'w', encoding='utf-8') as f:
+                f.write('user_id,message\n' + ''.join(f'1,{m}\n' for m in messages[12:]))
+            self.assertEqual(list(iter_messages([tmp])), messages)
+            chunked = analyze_messages(iter_messages([tmp]), workers=1, chunk_size=3)
+
+        whole = ChatStats()
+        for m in messages:
+            whole.add(m)
+        self.assertEqual(chunked.messages, 20)
+        self.assertEqual(chunked.to_frame().to_dict('records'), whole.to_frame().to_dict('records'))
+        self.assertEqual(chunked.health_signals['fatigue_level'], 5)
+
+    def test_malformed_jsonl_lines_are_skipped_and_counted(self):
+        """测试格式有误的 JSONL 行被跳过并计数，不中断整个分析"""
+        import json
+        import tempfile
+        from collections import Counter
+        from app.services.chat_analytics_service import iter_messages
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'a.jsonl')
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(json.dumps({'message': '我今天好累'}, ensure_ascii=False) + '\n')
+                f.write('{"message": "截断的行\n')
+                f.write('[1, 2]\n\n')
+                f.write(json.dumps({'text': '谢谢'}, ensure_ascii=False) + '\n')
+            skipped = Counter()
+            self.assertEqual(list(iter_messages([path], skipped)), ['我今天好累', '谢谢'])
+            self.assertEqual(skipped, Counter({path: 2}))
+
+class TestSessionContext(unittest.TestCase):
+    """会话上下文测试"""
+
+    def test_context_limits_and_idle_eviction(self):
+        """测试会话数上限、空闲淘汰与健康信号滑动平均"""
+        from unittest import mock
+        from app.services.session_service import SessionContextCache
+        cache = SessionContextCache(max_sessions=2, ttl=60)
+        with mock.patch('app.services.session_service.time.monotonic', return_value=0.0):
+            cache.update(1, 'symptom_report', 'negative', {'stress_level': 8})
+            cache.update(1, 'symptom_report', 'negative', {'stress_level': 4})
+            cache.update(2, 'general_chat', 'neutral')
+            cache.update(3, 'general_chat', 'positive')
+            self.assertIsNone(cache.get_context(1))
+        with mock.patch('app.services.session_service.time.monotonic', return_value=10.0):
+            cache.update(4, 'symptom_report', 'negative', {'stress_level': 8})
+            cache.update(4, 'symptom_report', 'negative', {'stress_level': 4})
+            context = cache.get_context(4)
+        self.assertEqual(context['negative_streak'], 2)
+        self.assertEqual(context['health_trends']['stress_level'], 6.0)
+        with mock.patch('app.services.session_service.time.monotonic', return_value=65.0):
+            self.assertIsNotNone(cache.get_context(4))
+            self.assertIsNone(cache.get_context(3))
+        self.assertEqual(cache.stats()['sessions'], 1)
+
+    def test_response_uses_previous_turns(self):
+        """测试连续负面情绪时回复包含趋势提示"""
+        from app.services.nlp_service import process_user_message
+        from app.services.session_service import _sessions
+        from unittest import mock
+        _sessions.clear()
+        with mock.patch('app.services.nlp_service.record_message', return_value={'id': 1}):
+            first = process_user_message("我很焦虑", "中产平衡型", user_id=99)
+            process_user_message("还是很焦虑", "中产平衡型", user_id=99)
+            third = process_user_message("依然焦虑", "中产平衡型", user_id=99)
+        self.assertNotIn("最近几次交流", first['response'])
+        self.assertIn("最近几次交流", third['response'])
+
+class TestTimingService(unittest.TestCase):
+    """分阶段计时测试"""
+
+    def test_stages_reported_in_server_timing_header(self):
+        """测试请求内各阶段耗时写入 Server-Timing 响应头，请求外不收集"""
+        from flask import Flask
+        from app.services import timing_service
+        from app.services.timing_service import span, timed
+
+        @timed("inner")
+        def inner():
+            return 1
+
+        app = Flask(__name__)
+        timing_service.init_app(app)
+
+        @app.route('/t')
+        def handler():
+            inner()
+            inner()
+            with span("block"):
+                pass
+            return "ok"
+
+        header = app.test_client().get('/t').headers['Server-Timing']
+        self.assertRegex(header, r'^inner;dur=[0-9.]+;desc="x2", block;dur=[0-9.]+, total;dur=[0-9.]+$')
+        self.assertEqual(inner(), 1)
+        self.assertIsNone(timing_service._collector.get())
+
+class TestMetricsService(unittest.TestCase):
+    """运行指标测试"""
+
+    def test_sharded_histogram_merges_threads(self):
+        """测试多线程记录的直方图在导出时汇总，桶计数为累计值"""
+        import threading
+        from app.services import metrics_service
+        from app.services.metrics_service import Histogram
+
+        histogram = Histogram('test_latency_seconds', 'test', ('blueprint',), buckets=(0.1, 1.0))
+        try:
+            threads = [threading.Thread(target=lambda: [histogram.observe('dashboard', value=v)
+                                                        for v in (0.05, 0.5, 5.0)]) for _ in range(4)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            text = metrics_service.render_metrics()
+        finally:
+            metrics_service._registry.remove(histogram)
+        self.assertIn('test_latency_seconds_bucket{blueprint="dashboard",le="0.1"} 4', text)
+        self.assertIn('test_latency_seconds_bucket{blueprint="dashboard",le="1"} 8', text)
+        self.assertIn('test_latency_seconds_bucket{blueprint="dashboard",le="+Inf"} 12', text)
+        self.assertIn('test_latency_seconds_count{blueprint="dashboard"} 12', text)
+
+    def test_metrics_endpoint(self):
+        """测试 /metrics 端点导出请求延迟与在途请求数"""
+        from app import create_app
+
+        client = create_app().test_client()
+        client.get('/api/knowledge/search?q=养老金')
+        text = client.get('/metrics').get_data(as_text=True)
+        self.assertIn('# TYPE pension_http_request_duration_seconds histogram', text)
+        self.assertIn('pension_http_request_duration_seconds_count{blueprint="knowledge",method="GET"}', text)
+        self.assertIn('pension_http_requests_in_flight{blueprint="other"} 1', text)
+        self.assertIn('pension_cache_hit_ratio{cache=', text)
+
+    def test_unhandled_exception_counted_once(self):
+        """测试未处理异常的请求只计一次 5xx"""
+        import re
+        from app import create_app
+        from app.services.metrics_service import render_metrics
+
+        app = create_app()
+
+        @app.route('/boom')
+        def boom():
+            raise RuntimeError('boom')
+
+        def count():
+            match = re.search(r'pension_http_requests_total\{blueprint="other",status="5xx"\} (\d+)', render_metrics())
+            return int(match.group(1)) if match else 0
+
+        before = count()
+        self.assertEqual(app.test_client().get('/boom').status_code, 500)
+        self.assertEqual(count(), before + 1)
+
+class TestBenchmarkSuite(unittest.TestCase):
+    """基准测试工具测试"""
+
+    def test_scale_users_and_regression_check(self):
+        """测试合成用户的规模与取值范围，以及按阈值判定回退"""
+        from app.services import data_service
+        from benchmark_services import compare, scale_users
+
+        frame = scale_users(data_service.df, 2000, seed=1)
+        self.assertEqual(len(frame), 2000)
+        self.assertEqual(frame['用户ID'].tolist(), list(range(1, 2001)))
+        self.assertTrue((frame['总负债'] <= frame['总资产'] * 10).all())
+        self.assertListEqual(list(frame.columns), list(data_service.df.columns))
+
+        baseline = {'results': {'500': {'a': {'median_ms': 1.0}, 'b': {'median_ms': 2.0}}}}
+        current = {'results': {'500': {'a': {'median_ms': 1.1}, 'b': {'median_ms': 3.0},
+                                       'c': {'median_ms': 9.0}}}}
+        regressions = compare(current, baseline, threshold=0.2)
+        self.assertEqual([r['benchmark'] for r in regressions], ['b'])
+
+class TestLoadTest(unittest.TestCase):
+    """压测工具测试"""
+
+    def test_client_against_test_server(self):
+        """测试异步客户端在固定并发下记录延迟分位与错误率"""
+        import asyncio
+        import threading
+        from werkzeug.serving import make_server
+        from app import create_app
+        from load_test import LoadGenerator, parse_mix, parse_users
+
+        self.assertEqual(parse_mix('knowledge=2,chat'), {'knowledge': 2.0, 'chat': 1.0})
+        self.assertEqual(parse_users('3-5'), [3, 4, 5])
+        with self.assertRaises(ValueError):
+            parse_mix('unknown=1')
+
+        server = make_server('127.0.0.1', 0, create_app(), threaded=True)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            generator = LoadGenerator(f'http://127.0.0.1:{server.port}', {'knowledge': 1}, [1])
+            summary = asyncio.run(generator.run_closed(concurrency=2, duration=0.5))
+        finally:
+            server.shutdown()
+        overall = summary['overall']
+        self.assertGreater(overall['requests'], 0)
+        self.assertEqual(overall['errors'], 0)
+        self.assertLessEqual(overall['p50_ms'], overall['p99_ms'])
+        self.assertEqual(summary['endpoints']['knowledge']['statuses'], {200: overall['requests']})
+
+class TestSyntheticDataService(unittest.TestCase):
+    """合成用户数据测试"""
+
+    def test_copula_sample_is_consistent(self):
+        """测试合成用户的汇总字段与分项一致，且保留收入与资产的相关方向"""
+        import numpy as np
+        import pandas as pd
+        from app.services.synthetic_data_service import SOURCE_PATH, CopulaModel
+
+        source = pd.read_csv(SOURCE_PATH)
+        frame = CopulaModel.fit(source).sample(20000, np.random.default_rng(0))
+        self.assertListEqual(list(frame.columns), [c for c in source.columns if c != '用户ID'])
+        np.testing.assert_allclose(frame['总资产'],
+                                   frame[['活期存款', '理财产品', '股票基金', '房产估值']].sum(axis=1), atol=0.01)
+        np.testing.assert_allclose(frame['负债率'], (frame['总负债'] / frame['总资产']).round(2))
+        self.assertTrue(set(frame['风险偏好']) <= set(source['风险偏好']))
+        self.assertTrue((frame['期望收益率下限'] <= frame['期望收益率上限']).all())
+        expected = source['月工资收入'].corr(source['总资产'], method='spearman')
+        actual = frame['月工资收入'].corr(frame['总资产'], method='spearman')
+        self.assertAlmostEqual(actual, expected, delta=0.1)
+
+    def test_generate_population_in_chunks(self):
+        """测试分块写出的用户数与用户ID，结果只由随机种子决定"""
+        import tempfile
+        import pandas as pd
+        from app.services.synthetic_data_service import generate_population
+
+        with tempfile.TemporaryDirectory() as tmp:
+            first = generate_population(1000, os.path.join(tmp, 'a'), fmt='csv', chunk_size=300, workers=1)
+            second = generate_population(1000, os.path.join(tmp, 'b'), fmt='csv', chunk_size=300, workers=1)
+            frame = pd.read_csv(first)
+            with open(first, 'rb') as a, open(second, 'rb') as b:
+                self.assertEqual(a.read(), b.read())
+        self.assertEqual(len(frame), 1000)
+        self.assertEqual(frame['用户ID'].iloc[0], 'U000001')
+        self.assertTrue(frame['用户ID'].is_unique)
+
+class TestSchemaService(unittest.TestCase):
+    """用户表类型定义测试"""
+
+    def test_compact_dtypes_round_trip(self):
+        """测试用户表按类型定义压缩后，逐个用户取出的值与原始 CSV 一致"""
+        import numpy as np
+        import pandas as pd
+        from app.services import data_service
+        from app.services.schema_service import float32_safe, memory_report
+
+        frame = data_service.df
+        self.assertEqual(str(frame['风险偏好'].dtype), 'category')
+        self.assertEqual(frame['月工资收入'].dtype, np.float32)
+        self.assertEqual(frame['总资产'].dtype, np.float64)
+        self.assertEqual(frame['年龄'].dtype, np.int32)
+        self.assertFalse(float32_safe(np.array([7403547.99]), 2))
+
+        raw = pd.read_csv(data_service.DATA_PATH).iloc[4].to_dict()
+        metrics = get_latest_metrics(5)
+        for column in ('月工资收入', '储蓄率', '期望收益率下限', '餐饮消费', '总资产', '风险偏好', '年龄'):
+            self.assertEqual(metrics[column], raw[column], column)
+
+        report = memory_report(frame)
+        self.assertGreater(report['reduction'], 2)
+        self.assertEqual(report['rows'], len(frame))
+
+class TestIngestionService(unittest.TestCase):
+    """用户数据分块导入测试"""
+
+    def setUp(self):
+        use_memory_storage(self)
+
+    def test_chunked_ingest_validates_and_resumes(self):
+        """测试逐块校验剔除不合格行、写入用户表，中断后从断点继续"""
+        import tempfile
+        import pandas as pd
+        from app.services import data_service
+        from app.services.ingestion_service import ingest_file
+
+        source = pd.read_csv(data_service.DATA_PATH).head(12).astype(object)
+        source['用户ID'] = [f'U{900000 + i}' for i in range(12)]
+        source.loc[2, '年龄'] = 200
+        source.loc[5, '月工资收入'] = 'abc'
+        source.loc[7, '风险偏好'] = '未知'
+        source = source.drop(columns=['月总流入', '储蓄率'])
+        original = data_service.df
+
+        class Interrupted(Exception):
+            pass
+
+        calls = []
+
+        def flaky_sink(frame):
+            calls.append(len(frame))
+            if len(calls) == 2:
+                raise Interrupted()
+            return data_service.upsert_users(frame)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'users.csv')
+            source.to_csv(path, index=False)
+            try:
+                with self.assertRaises(Interrupted):
+                    ingest_file(path, chunk_rows=4, sink=flaky_sink)
+                self.assertTrue(os.path.exists(path + '.ingest.json'))
+                report = ingest_file(path, chunk_rows=4)
+                self.assertFalse(os.path.exists(path + '.ingest.json'))
+                self.assertGreater(report['resumed_from'], 0)
+                self.assertEqual(report['rows'], 12)
+                self.assertEqual(report['rejected'], 3)
+                self.assertEqual(report['inserted'], 9)
+                self.assertEqual([e['line'] for e in report['errors']], [7, 9])
+                metrics = get_latest_metrics(900000)
+                self.assertAlmostEqual(metrics['月总流入'], round(
+                    metrics['月工资收入'] + metrics['经营性收入'] + metrics['被动收入'], 2), places=2)
+                self.assertIsNone(get_latest_metrics(900002))
+            finally:
+                data_service.replace_users(original)
+
+    def test_partial_rows_recompute_totals_and_incomplete_inserts_rejected(self):
+        """测试已有用户的部分字段更新后汇总字段重新计算，缺少必填列的新用户被拒绝并列出缺失列"""
+        import io
+        import json
+        from app.services import data_service
+        from app.services.ingestion_service import ingest_stream
+
+        original = data_service.df
+        before = get_latest_metrics(1)
+        body = '\n'.join([
+            json.dumps({'用户ID': 'U000001', '月工资收入': 66690.14, '房贷余额': 0}),
+            json.dumps({'用户ID': 'U777777', '年龄': 40}),
+        ]).encode('utf-8')
+        try:
+            report = ingest_stream(io.BytesIO(body), 'ndjson')
+            self.assertEqual((report['updated'], report['inserted'], report['rejected']), (1, 0, 1))
+            error = report['errors'][0]
+            self.assertEqual((error['line'], error['userId']), (2, 'U777777'))
+            self.assertIn('风险偏好', error['column'])
+            self.assertIsNone(get_latest_metrics(777777))
+
+            after = get_latest_metrics(1)
+            self.assertAlmostEqual(after['月总流入'], round(66690.14 + before['经营性收入'] + before['被动收入'], 2),
+                                   places=2)
+            self.assertAlmostEqual(after['总负债'], round(before['信用卡欠款'] + before['其他贷款'], 2), places=2)
+            self.assertAlmostEqual(after['负债率'], round(after['总负债'] / after['总资产'], 2), places=2)
+        finally:
+            data_service.replace_users(original)
+
+    def test_error_line_numbers_count_blank_lines(self):
+        """测试空行计入行号，错误报告中的行号与源文件一致"""
+        import io
+        from app.services.ingestion_service import iter_chunks, validate_chunk
+
+        body = '用户ID,年龄\nU000001,30\n\nU900002,200\n'.encode('utf-8')
+        chunks = list(iter_chunks(io.BytesIO(body), 'csv', chunk_rows=10))
+        frame, _, next_line, _ = chunks[0]
+        _, errors = validate_chunk(frame)
+        self.assertEqual([(e['line'], e['userId']) for e in errors], [(4, 'U900002')])
+        self.assertEqual(next_line, 5)
+
+class TestBulkIngestAPI(unittest.TestCase):
+    """批量写入接口测试"""
+
+    def setUp(self):
+        use_memory_storage(self)
+
+    def test_bulk_upsert_requires_token_and_reports_row_errors(self):
+        """测试令牌校验、NDJSON 批量写入、逐行错误报告，以及只失效受影响用户的缓存"""
+        import json
+        from unittest import mock
+        from app import create_app
+        from app.services import data_service
+
+        client = create_app().test_client()
+        original = data_service.df
+        complete = {k: v for k, v in get_latest_metrics(2).items() if v == v}
+        lines = [
+            json.dumps({'用户ID': 'U000001', '月工资收入': 30000, '经营性收入': 0, '被动收入': 0}),
+            '{not json',
+            json.dumps({'用户ID': 'U900100', '年龄': -3}),
+            json.dumps({**complete, '用户ID': 'U900101', '月工资收入': 8000, '经营性收入': 0, '被动收入': 0,
+                        '月总流出': 6000}, ensure_ascii=False),
+        ]
+        body = '\n'.join(lines).encode('utf-8')
+        version_1 = data_service.get_metrics_version(1)
+        version_2 = data_service.get_metrics_version(2)
+        with mock.patch.dict(os.environ, {'PENSION_INGEST_TOKEN': 'secret'}):
+            denied = client.post('/api/users/bulk', data=body, headers={'Authorization': 'Bearer wrong'})
+            self.assertEqual(denied.status_code, 401)
+            try:
+                response = client.post('/api/users/bulk?chunk_rows=2', data=body,
+                                       content_type='application/x-ndjson',
+                                       headers={'Authorization': 'Bearer secret'})
+                report = response.get_json()
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual((report['rows'], report['updated'], report['inserted'], report['rejected']),
+                                 (4, 1, 1, 2))
+                self.assertEqual([e['line'] for e in report['errors']], [2, 3])
+                self.assertEqual(get_latest_metrics(1)['月总流入'], 30000)
+                self.assertAlmostEqual(get_latest_metrics(900101)['储蓄率'], 0.25)
+                self.assertEqual(data_service.get_metrics_version(1), version_1 + 1)
+                self.assertEqual(data_service.get_metrics_version(2), version_2)
+            finally:
+                data_service.replace_users(original)
+
+    def test_bulk_rejects_unscorable_insert_and_accepts_json_array(self):
+        """测试缺少必填列的新用户经接口写入时被拒绝（仪表盘仍为 404），application/json 数组按行处理"""
+        from unittest import mock
+        from app import create_app
+        from app.services import data_service
+
+        client = create_app().test_client()
+        original = data_service.df
+        headers = {'Authorization': 'Bearer secret'}
+        with mock.patch.dict(os.environ, {'PENSION_INGEST_TOKEN': 'secret'}):
+            try:
+                response = client.post('/api/users/bulk', data='{"用户ID":"U777777","年龄":40}'.encode('utf-8'),
+                                       content_type='application/x-ndjson', headers=headers)
+                report = response.get_json()
+                self.assertEqual((report['inserted'], report['rejected']), (0, 1))
+                self.assertIn('月工资收入', report['errors'][0]['column'])
+                self.assertEqual(client.get('/api/dashboard/777777').status_code, 404)
+
+                response = client.post('/api/users/bulk', json=[{'用户ID': 'U000002', '信任评分': 80}, 5],
+                                       headers=headers)
+                report = response.get_json()
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual((report['updated'], report['rejected']), (1, 1))
+                self.assertEqual(get_latest_metrics(2)['信任评分'], 80)
+                self.assertEqual(client.post('/api/users/bulk', json={'用户ID': 'U000002'},
+                                             headers=headers).status_code, 400)
+            finally:
+                data_service.replace_users(original)
+
+class TestReloadService(unittest.TestCase):
+    """用户数据热加载测试"""
+
+    def setUp(self):
+        # 热加载只用于 CSV 后端
+        use_memory_storage(self)
+
+    def test_reload_applies_only_changed_rows(self):
+        """测试数据文件变化后只写入修改、新增的用户并删除已移除的用户，未变化的用户不受影响"""
+        import shutil
+        import tempfile
+        import pandas as pd
+        from app.services import data_service
+        from app.services.reload_service import DatasetWatcher
+
+        original = data_service.df
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'users.csv')
+            shutil.copy(data_service.DATA_PATH, path)
+            watcher = DatasetWatcher(path)
+            watcher.snapshot()
+            self.assertIsNone(watcher.check())
+
+            raw = pd.read_csv(path)
+            raw.loc[0, '月工资收入'] = 99999.5
+            added = raw.iloc[[1]].assign(用户ID='U000777')
+            raw = pd.concat([raw.drop(index=[5]), added], ignore_index=True)
+            # 重新写出会改变数字格式，但取值相同的用户不应被视为变化
+            raw.to_csv(path, index=False)
+            versions = {uid: data_service.get_metrics_version(uid) for uid in (1, 3, 6, 777)}
+            try:
+                report = watcher.check()
+                self.assertEqual(report, {'inserted': 1, 'updated': 1, 'deleted': 1, 'rejected': 0})
+                self.assertEqual(get_latest_metrics(1)['月工资收入'], 99999.5)
+                self.assertIsNone(get_latest_metrics(6))
+                self.assertIsNotNone(get_latest_metrics(777))
+                self.assertEqual(data_service.get_metrics_version(3), versions[3])
+                for uid in (1, 6, 777):
+                    self.assertEqual(data_service.get_metrics_version(uid), versions[uid] + 1)
+                self.assertIsNone(watcher.check())
+            finally:
+                data_service.replace_users(original)
+
+    def test_rejected_rows_stay_in_baseline_for_deletion(self):
+        """测试未通过校验的行保留在比较基准中：修正后重新读取，之后从文件删除时删除该用户"""
+        import shutil
+        import tempfile
+        import pandas as pd
+        from app.services import data_service
+        from app.services.reload_service import DatasetWatcher
+
+        original = data_service.df
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'users.csv')
+            shutil.copy(data_service.DATA_PATH, path)
+            watcher = DatasetWatcher(path)
+            watcher.snapshot()
+            raw = pd.read_csv(path, dtype=str, keep_default_na=False)
+            salary = get_latest_metrics(8)['月工资收入']
+            try:
+                edited = raw.copy()
+                edited.loc[edited['用户ID'] == 'U000008', '年龄'] = 'abc'
+                edited.to_csv(path, index=False)
+                report = watcher.check()
+                self.assertEqual((report['rejected'], report['updated']), (1, 0))
+                self.assertEqual(get_latest_metrics(8)['月工资收入'], salary)
+                # 内容不变时不重复读取
+                self.assertIsNone(watcher.check())
+
+                raw[raw['用户ID'] != 'U000008'].to_csv(path, index=False)
+                report = watcher.check()
+                self.assertEqual((report['deleted'], report['rejected']), (1, 0))
+                self.assertIsNone(get_latest_metrics(8))
+            finally:
+                data_service.replace_users(original)
+
+    def test_watcher_starts_in_serving_process(self):
+        """测试创建应用时不启动监视线程，处理请求的进程在第一个请求时启动，fork 出的进程重新创建"""
+        from unittest import mock
+        from app import create_app
+        from app.services import reload_service
+
+        with mock.patch.dict(os.environ, {reload_service.INTERVAL_ENV: '3600'}), \
+                mock.patch.object(reload_service, 'configured_backend', return_value='csv'), \
+                mock.patch.object(reload_service, '_watcher', None), \
+                mock.patch.object(reload_service, '_watcher_pid', None), \
+                mock.patch.object(reload_service.DatasetWatcher, 'start') as start:
+            client = create_app().test_client()
+            self.assertIsNone(reload_service._watcher)
+            client.get('/metrics')
+            client.get('/metrics')
+            first = reload_service._watcher
+            self.assertIsNotNone(first)
+            self.assertEqual(reload_service._watcher_pid, os.getpid())
+            self.assertEqual(start.call_count, 1)
+
+            # 模拟 fork 后的子进程：不沿用父进程的监视对象
+            reload_service._watcher_pid = -1
+            client.get('/metrics')
+            self.assertIsNot(reload_service._watcher, first)
+            self.assertEqual(start.call_count, 2)
+
+class TestStorageService(unittest.TestCase):
+    """用户指标存储测试"""
+
+    def test_sqlite_backend_reads_and_writes(self):
+        """测试 SQLite 后端从 CSV 导入、按用户ID查询、批量写入删除与健康指标更新"""
+        import sqlite3
+        import tempfile
+        import threading
+        import pandas as pd
+        from app.services import data_service
+        from app.services.storage_service import SqliteStorage
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'metrics.db')
+            storage = SqliteStorage(path)
+            self.assertEqual(storage.get_user(5), get_latest_metrics(5))
+            self.assertIsNone(storage.get_user(999999))
+
+            rows = data_service.df[data_service.df['用户ID'].isin([1, 2])].copy()
+            rows['月工资收入'] = rows['月工资收入'] + 0.01
+            storage.write_users(rows, deleted=[3])
+            self.assertAlmostEqual(storage.get_user(1)['月工资收入'], get_latest_metrics(1)['月工资收入'] + 0.01)
+            self.assertIsNone(storage.get_user(3))
+
+            storage.update_health(1, {'sleep_hours': 4, 'unknown_field': 1})
+            storage.update_health(987654, {'MMSE': 20})
+            health = storage.load_health().set_index('user_id')
+            self.assertEqual(health.loc[1, 'sleep_hours'], 4)
+            self.assertEqual((health.loc[987654, 'MMSE'], health.loc[987654, 'daily_steps']), (20, 5000))
+
+            # 其他线程从连接池借出连接，读到已提交的写入
+            seen = {}
+            worker = threading.Thread(target=lambda: seen.update(user=storage.get_user(1)))
+            worker.start()
+            worker.join()
+            self.assertEqual(seen['user']['月工资收入'], storage.get_user(1)['月工资收入'])
+
+            conn = sqlite3.connect(path)
+            self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+            plan = ' '.join(str(r) for r in conn.execute(
+                'EXPLAIN QUERY PLAN SELECT * FROM users WHERE "用户ID" = ?', (1,)))
+            self.assertIn('idx_users_id', plan)
+            conn.close()
+
+    def test_sqlite_connection_pool_is_bounded_and_rebuilt_after_fork(self):
+        """测试 SQLite 连接池：借出的连接用完归还复用，数量有上限，fork 后的进程重建连接池"""
+        import sqlite3
+        import tempfile
+        from unittest import mock
+        from app.services import storage_service
+
+        with tempfile.TemporaryDirectory() as tmp, \
+                mock.patch.object(storage_service, 'POOL_SIZE', 2), \
+                mock.patch.object(storage_service, 'POOL_TIMEOUT', 0.1):
+            storage = storage_service.SqliteStorage(os.path.join(tmp, 'metrics.db'))
+            with storage._connection() as first:
+                pass
+            with storage._connection() as again, storage._connection() as second:
+                self.assertIs(again, first)
+                self.assertIsNot(second, first)
+                with self.assertRaises(sqlite3.OperationalError):
+                    with storage._connection():
+                        pass
+            self.assertEqual(storage.get_user(5)['用户ID'], 5)
+
+            # 模拟 fork 后的子进程：不再借出父进程打开的连接
+            storage._pool_pid = -1
+            with storage._connection() as child:
+                self.assertNotIn(child, (first, second))
+            self.assertIn(first, storage._inherited)
+
+    def test_sqlite_sync_reloads_writes_from_other_processes(self):
+        """测试 SQLite 模式下其他进程写入后内存用户表按版本重新加载，自身的写入不触发重新加载"""
+        import tempfile
+        from unittest import mock
+        from app.services import data_service
+        from app.services.storage_service import SqliteStorage
+
+        before = {uid: data_service.get_metrics_version(uid) for uid in (1, 2, 3, 4)}
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, 'metrics.db')
+                storage = SqliteStorage(path)
+                with mock.patch.object(data_service, 'df', data_service.df), \
+                        mock.patch.object(data_service, '_storage', storage), \
+                        mock.patch.object(data_service, '_storage_version', storage.users_version()):
+                    self.assertFalse(data_service.sync_from_storage(0))
+
+                    # 另一个进程通过自己的连接写入
+                    other = SqliteStorage(path)
+                    rows = data_service.df[data_service.df['用户ID'] == 1].copy()
+                    rows['月工资收入'] = rows['月工资收入'] + 100
+                    other.write_users(rows, deleted=[3])
+                    self.assertTrue(data_service.sync_from_storage(0))
+                    self.assertFalse(data_service.sync_from_storage(0))
+                    frame = data_service.df.set_index('用户ID')
+                    self.assertAlmostEqual(float(frame.loc[1, '月工资收入']), float(rows['月工资收入'].iloc[0]),
+                                           places=2)
+                    self.assertNotIn(3, frame.index)
+                    versions = {uid: data_service.get_metrics_version(uid) - before[uid] for uid in (1, 2, 3)}
+                    self.assertEqual(versions, {1: 1, 2: 0, 3: 1})
+
+                    update = data_service.df[data_service.df['用户ID'] == 4][['用户ID', '活期存款']].copy()
+                    update['活期存款'] = update['活期存款'] + 1
+                    data_service.upsert_users(update)
+                    self.assertFalse(data_service.sync_from_storage(0))
+                    self.assertEqual(data_service._storage_version, 2)
+        finally:
+            # 恢复原用户表后让受影响用户的缓存与索引按原表重建
+            data_service.notify_metrics_changed([1, 3, 4])
+
 class TestIntegration(unittest.TestCase):
     """集成测试"""
 